@@ -14,3 +14,8 @@ from django.core.asgi import get_asgi_application
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "inmar.settings")
 
 application = get_asgi_application()
+
+# Imported once the apps are loaded.
+from sku.server import start_server  # noqa: E402
+
+start_server()
@@ -42,6 +42,7 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    "sku.metrics.InstrumentationMiddleware",
     "django.middleware.security.SecurityMiddleware",
     "django.contrib.sessions.middleware.SessionMiddleware",
     "django.middleware.common.CommonMiddleware",
@@ -53,6 +54,55 @@ MIDDLEWARE = [
 
 ROOT_URLCONF = "inmar.urls"
 
+# Share of the requests whose queries, render time and response size are measured into the
+# histograms served at /metrics, the others are only counted.
+SKU_METRICS_SAMPLE_RATE = 0.05
+
+# A sampled request running the same query shape this many times is reported as a likely N+1.
+SKU_METRICS_N_PLUS_ONE = 10
+
+# Client addresses /metrics is served to, for the Prometheus scraper, it answers 404 to any other. Behind a proxy
+# the address is the proxy's, serve /metrics from the internal network only.
+SKU_METRICS_ALLOWED_IPS = ['127.0.0.1', '::1']
+
+# Answer get_skus_by_meta_data from an in-process columnar index of the SKU hierarchy ids instead of sku_search.
+SKU_COLUMN_INDEX = False
+
+# Snapshot written by dumpskuindex the index is memory-mapped from, shared by the workers of a host.
+SKU_COLUMN_INDEX_SNAPSHOT = None
+
+# Snapshot written by dumpcatalog the hierarchy, the column index and the search index are built from at startup
+# instead of the database, memory-mapped and shared by the workers of a host.
+SKU_CATALOG_SNAPSHOT = None
+
+# Seconds the hierarchy and the validation rules held by a worker are used before it checks whether another worker
+# changed them, through the versions in the sku_version table. Changes made by the worker itself are seen at once.
+SKU_VERSION_CHECK_INTERVAL = 0.1
+
+# Directory of the write-behind journals: SKUs posted to /api/v1/sku/queue/ are acknowledged once appended to the
+# journal of the process and written to the database in batches by a background thread. None disables the queue.
+SKU_WRITE_BEHIND_DIR = None
+
+# A batch of queued SKUs is written once it holds this many SKUs, or this many seconds after its first one arrived.
+SKU_WRITE_BEHIND_BATCH_SIZE = 1000
+SKU_WRITE_BEHIND_WINDOW = 0.2
+
+REST_FRAMEWORK = {
+    "DEFAULT_PAGINATION_CLASS": "sku.pagination.KeysetPagination",
+    "PAGE_SIZE": 1000,
+    "DEFAULT_RENDERER_CLASSES": [
+        "sku.renderers.FastJSONRenderer",
+        "rest_framework.renderers.BrowsableAPIRenderer",
+        "sku.renderers.NDJSONRenderer",
+    ],
+    "DEFAULT_PARSER_CLASSES": [
+        "rest_framework.parsers.JSONParser",
+        "rest_framework.parsers.FormParser",
+        "rest_framework.parsers.MultiPartParser",
+        "sku.parsers.NDJSONParser",
+    ],
+}
+
 TEMPLATES = [
     {
         "BACKEND": "django.template.backends.django.DjangoTemplates",
@@ -87,6 +137,26 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/4.1/topics/cache/
+
+# The "responses" cache holds the cached hierarchy and SKU read responses. Their keys include the versions of
+# their tags, kept in the sku_version table, so a write in any worker evicts them in all of them, whatever the
+# backend. Use "django.core.cache.backends.filebased.FileBasedCache" or
+# "django.core.cache.backends.redis.RedisCache" to also share the responses between workers.
+CACHES = {
+    "default": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+    },
+    "responses": {
+        "BACKEND": "django.core.cache.backends.locmem.LocMemCache",
+        "LOCATION": "sku-responses",
+        "TIMEOUT": 300,
+        "OPTIONS": {"MAX_ENTRIES": 10000},
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/4.1/ref/settings/#auth-password-validators
 
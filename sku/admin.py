@@ -1,3 +1,34 @@
+import re
+
+from django import forms
 from django.contrib import admin
 
-# Register your models here.
+from .hierarchy import LEVELS
+from .models import ValidationRule
+from .rules import NAME_CHECKS, RULE_KINDS
+
+
+class ValidationRuleForm(forms.ModelForm):
+    level = forms.ChoiceField(choices=[(level, level) for level in LEVELS])
+    kind = forms.ChoiceField(choices=[(kind, kind) for kind in RULE_KINDS])
+
+    class Meta:
+        model = ValidationRule
+        fields = '__all__'
+
+    def clean(self):
+        data = super().clean()
+        # Rules whose value does not compile would be skipped by the serializers.
+        if data.get('kind') in NAME_CHECKS:
+            try:
+                NAME_CHECKS[data['kind']](data.get('value', ''))
+            except (ValueError, re.error) as ex:
+                self.add_error('value', str(ex))
+        return data
+
+
+@admin.register(ValidationRule)
+class ValidationRuleAdmin(admin.ModelAdmin):
+    form = ValidationRuleForm
+    list_display = ('id', 'level', 'kind', 'value', 'message')
+    list_filter = ('level', 'kind')
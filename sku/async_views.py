@@ -0,0 +1,80 @@
+"""
+Async variants of the read endpoints, for deployments served by inmar.asgi.
+They are plain Django views, DRF views are synchronous, and read with the async ORM so a request
+waiting on the database does not hold a thread. Responses have the same bodies as the DRF views.
+"""
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.http import HttpResponse
+from rest_framework.exceptions import APIException, MethodNotAllowed
+
+from .models import Location, Department, Category, SubCategory
+from .pagination import alist_response
+from .renderers import FastJSONRenderer
+from .serializers import LocationTreeSerializer, department_values, category_values, subcategory_values
+from .views import LocationDetailView, LocationViewSet, parse_depth, prefetch_tree, skus_by_meta_data
+
+
+def async_api_view(view):
+    """
+    Answers the API exceptions raised by an async view with their status and detail, like DRF does.
+    """
+    @wraps(view)
+    async def wrapped(request, *args, **kwargs):
+        try:
+            if request.method not in ('GET', 'HEAD'):
+                raise MethodNotAllowed(request.method)
+            return await view(request, *args, **kwargs)
+        except APIException as exc:
+            return HttpResponse(FastJSONRenderer().render({'detail': exc.detail}), status=exc.status_code,
+                                content_type='application/json')
+    return wrapped
+
+
+@async_api_view
+async def get_skus_by_meta_data(request):
+    """
+    Async variant of views.get_skus_by_meta_data, with the same parameters.
+    """
+    # The column index may catch up with the change log first.
+    return await alist_response(request, await sync_to_async(skus_by_meta_data)(request.GET))
+
+
+@async_api_view
+async def location_detail(request, **kwargs):
+    """
+    Async variant of LocationDetailView, the rows come from the cached hierarchy.
+    """
+    rows = await sync_to_async(LocationDetailView(kwargs=kwargs).get_rows)()
+    return await alist_response(request, rows)
+
+
+@async_api_view
+async def location_list(request):
+    """
+    Async variant of the location list, `?depth=` as in LocationViewSet.
+    """
+    context = {'depth': parse_depth(request.GET, LocationViewSet.max_depth)}
+
+    def serialize(rows):
+        return LocationTreeSerializer(rows, many=True, context=context).data
+
+    return await alist_response(request, prefetch_tree(Location.objects.all(), context['depth']), serialize)
+
+
+def model_list(queryset, values):
+    """
+    Returns an async list view of the queryset, serialized from the rows of a ValuesListSerializer.
+    """
+    @async_api_view
+    async def view(request):
+        return await alist_response(request, values.queryset(queryset.all()), values.serialize)
+    return view
+
+
+department_list = model_list(Department.objects.all(), department_values)
+
+category_list = model_list(Category.objects.all(), category_values)
+
+subcategory_list = model_list(SubCategory.objects.all(), subcategory_values)
@@ -0,0 +1,70 @@
+"""
+Catalog snapshots: the locations, departments, categories, subcategories and SKUs written to one snapshot file
+with the column index and the search index of the SKUs, see snapshot.CatalogSnapshot. Workers map it on first
+use instead of reading the tables and building the indexes, then catch up with the change logs from the
+positions it was written at.
+"""
+import time
+
+import numpy as np
+from django.db.models import Max
+
+from .column_index import ColumnIndex
+from .hierarchy import LEVELS, PARENT_FIELDS, node_rows
+from .inverted_index import SearchIndex, document_terms
+from .models import SKUDataMapping, SKUSearchChange, HierarchyChange
+from .pagination import keyset_iterator
+from .rollup import PATH_FIELDS
+from .snapshot import CATALOG_KIND, string_table, write_snapshot
+
+SKU_COLUMNS = ('sku', 'description') + PATH_FIELDS
+
+
+def dump_catalog(path, chunk_size=100000):
+    """
+    Writes the catalog snapshot to path and returns its metadata. The names and descriptions are stored once
+    each in the string table. The SKUs are read once, the search index is built from the same rows.
+    """
+    # Changes logged while reading are applied again by the processes catching up, which is harmless.
+    meta = {
+        'kind': CATALOG_KIND,
+        'last_change': SKUSearchChange.objects.aggregate(last=Max('id'))['last'] or 0,
+        'last_hierarchy_change': HierarchyChange.objects.aggregate(last=Max('id'))['last'] or 0,
+    }
+    strings = {}
+    arrays = {}
+    names = []
+    for level in LEVELS:
+        rows = list(node_rows(level))
+        names.append({pk: name for pk, name, _ in rows})
+        meta[level] = len(rows)
+        arrays[level + '.id'] = np.array([row[0] for row in rows], dtype=np.int32)
+        arrays[level + '.name'] = np.array([strings.setdefault(row[1], len(strings)) for row in rows], dtype=np.int32)
+        if PARENT_FIELDS[level]:
+            arrays[level + '.parent'] = np.array([row[2] for row in rows], dtype=np.int32)
+
+    chunks = []
+    chunk = []
+
+    def documents():
+        # Collects the columns on the way, the rows are in the sku_search TEXT_FIELDS layout.
+        for row in keyset_iterator(SKUDataMapping.objects.values_list(*SKU_COLUMNS), chunk_size):
+            chunk.append((row[0], strings.setdefault(row[1], len(strings))) + row[2:])
+            if len(chunk) == chunk_size:
+                chunks.append(np.array(chunk, dtype=np.int32))
+                chunk.clear()
+            yield row[0], document_terms(row[:2] + tuple(level.get(pk, '') for level, pk in zip(names, row[2:])))
+
+    search = SearchIndex.from_documents(documents(), meta['last_change'])
+    chunks.append(np.array(chunk, dtype=np.int32).reshape(-1, len(SKU_COLUMNS)))
+    rows = np.concatenate(chunks)
+    arrays.update(ColumnIndex.from_columns({name: rows[:, index] for index, name in enumerate(SKU_COLUMNS)}).arrays)
+    arrays['description'] = rows[:, 1]
+    arrays['strings.offsets'], arrays['strings.data'] = string_table(strings)
+    arrays['search.skus'], arrays['search.frequencies'], arrays['search.offsets'] = \
+        search.skus, search.frequencies, search.offsets
+    arrays['search.terms.offsets'], arrays['search.terms.data'] = string_table(search.terms)
+
+    meta.update(skus=len(rows), strings=len(strings), written_at=time.time())
+    write_snapshot(path, arrays, **meta)
+    return meta
@@ -0,0 +1,393 @@
+"""
+Columnar in-process index of the SKU hierarchy ids, answering get_skus_by_meta_data without the database.
+The sku, location, department, category and subcategory ids of every SKU are NumPy int32 columns ordered
+by sku, and every hierarchy column has a posting list: its row positions grouped by id. A filter reads the
+positions of its most selective id list, then checks the other columns on those rows only.
+The index can be written to a snapshot file and memory-mapped from it, so the workers of a host share it.
+SKUs written later are applied from the sku_search change log to a small delta, merged into new columns
+once it grows, the database is not read again.
+"""
+import copy
+import logging
+import threading
+
+import numpy as np
+from django.conf import settings
+from django.db import connection
+from django.db.models import Max
+
+from .hierarchy import LEVELS, get_hierarchy
+from .models import SKUSearch, SKUSearchChange
+from .pagination import keyset_iterator
+from .rollup import PATH_FIELDS
+from .search import ChangeLogFollower
+from .snapshot import Snapshot, SnapshotError, get_catalog, write_snapshot
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = ('sku',) + PATH_FIELDS
+
+# Arrays of the index, the columns and the posting lists of the hierarchy columns.
+INDEX_ARRAYS = COLUMNS + tuple(field + part for field in PATH_FIELDS for part in ('.values', '.positions', '.offsets'))
+
+SNAPSHOT_KIND = 'sku_columns'
+
+# Number of SKUs changed since the build kept aside in the delta, they are merged into the columns beyond it.
+MAX_DELTA = 10000
+
+# Number of rows turned into names at a time when iterating over the matching SKUs.
+ROWS_CHUNK = 2000
+
+
+def posting_lists(column):
+    """
+    Returns the distinct values of a column, the row positions grouped by value, ascending within every
+    group, and the offsets of the groups in the positions.
+    """
+    order = np.argsort(column, kind='stable').astype(np.int32)
+    values, counts = np.unique(column[order], return_counts=True)
+    offsets = np.zeros(len(values) + 1, dtype=np.int64)
+    np.cumsum(counts, out=offsets[1:])
+    return values.astype(np.int32), order, offsets
+
+
+class ColumnIndex(ChangeLogFollower):
+    """
+    The columns and posting lists of the SKUs, see the module docstring. arrays maps the COLUMNS to their
+    int32 arrays ordered by sku, and `<column>.values`, `<column>.positions`, `<column>.offsets` to the
+    posting lists of the hierarchy columns.
+    """
+    # Only ids are indexed, renaming a node changes nothing here.
+    follows_names = False
+
+    def __init__(self, arrays, last_change=0):
+        super().__init__(last_change)
+        self.arrays = arrays
+        # (SKUs masked out of the columns, id paths of the changed SKUs still existing)
+        self.delta = (np.empty(0, dtype=np.int64), {})
+
+    @classmethod
+    def from_columns(cls, columns, last_change=0):
+        """
+        Builds the posting lists of the columns, a dict of the COLUMNS to arrays ordered by sku.
+        """
+        arrays = {name: np.asarray(columns[name], dtype=np.int32) for name in COLUMNS}
+        for field in PATH_FIELDS:
+            values, positions, offsets = posting_lists(arrays[field])
+            arrays[field + '.values'], arrays[field + '.positions'], arrays[field + '.offsets'] = \
+                values, positions, offsets
+        return cls(arrays, last_change)
+
+    @classmethod
+    def from_db(cls, chunk_size=100000):
+        # Changes logged while reading are applied again by the next catch_up, which is harmless.
+        last_change = SKUSearchChange.objects.aggregate(last=Max('id'))['last'] or 0
+        chunks = []
+        chunk = []
+        for row in keyset_iterator(SKUSearch.objects.values_list(*COLUMNS), chunk_size):
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                chunks.append(np.array(chunk, dtype=np.int32))
+                chunk = []
+        chunks.append(np.array(chunk, dtype=np.int32).reshape(-1, len(COLUMNS)))
+        rows = np.concatenate(chunks)
+        return cls.from_columns({name: rows[:, index] for index, name in enumerate(COLUMNS)}, last_change)
+
+    @classmethod
+    def load(cls, path):
+        """
+        Maps the index written to a snapshot file by save, its position in the change log is restored.
+        """
+        snapshot = Snapshot(path)
+        if snapshot.meta.get('kind') != SNAPSHOT_KIND:
+            raise SnapshotError('{} is not a snapshot of the SKU columns.'.format(path))
+        return cls(snapshot.arrays, snapshot.meta['last_change'])
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """
+        Maps the index stored in a catalog snapshot, see snapshot.CatalogSnapshot.
+        """
+        return cls({name: catalog.arrays[name] for name in INDEX_ARRAYS}, catalog.meta['last_change'])
+
+    def save(self, path):
+        """
+        Writes the index, its delta merged, to a snapshot file.
+        """
+        removed, added = self.delta
+        index = self.compact() if len(removed) or added else self
+        write_snapshot(path, index.arrays, kind=SNAPSHOT_KIND, last_change=index.last_change, skus=len(index))
+
+    def __len__(self):
+        return len(self.arrays['sku']) - len(self.delta[0]) + len(self.delta[1])
+
+    def groups(self, field, ids):
+        """
+        Returns the indexes of the posting lists of the ids in the values of the field, the ids missing skipped.
+        """
+        values = self.arrays[field + '.values']
+        # Searching with the dtype of the array, NumPy would otherwise convert the array for every search.
+        ids = np.unique(np.fromiter(ids, dtype=values.dtype, count=len(ids)))
+        found = np.searchsorted(values, ids)
+        inside = found < len(values)
+        found, ids = found[inside], ids[inside]
+        return found[values[found] == ids]
+
+    def positions(self, field, found):
+        """
+        Returns the ordered row positions of the posting lists found by groups.
+        """
+        offsets = self.arrays[field + '.offsets']
+        positions = self.arrays[field + '.positions']
+        if len(found) == 1:
+            return positions[offsets[found[0]]:offsets[found[0] + 1]]
+        starts, lengths = offsets[found], offsets[found + 1] - offsets[found]
+        # Gathers all the lists at once: the position of every item in its list plus the start of the list.
+        items = np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)
+        return np.sort(positions[items])
+
+    def filter(self, filters):
+        """
+        Returns the ordered SKUs whose hierarchy ids are among the ids given by field in filters, a dict of
+        PATH_FIELDS to id lists. Without filters every SKU is returned.
+        """
+        removed, added = self.delta
+        if not filters:
+            skus = self.arrays['sku'].astype(np.int64)
+        else:
+            groups = {field: self.groups(field, ids) for field, ids in filters.items()}
+            sizes = {field: int((self.arrays[field + '.offsets'][found + 1] -
+                                 self.arrays[field + '.offsets'][found]).sum()) for field, found in groups.items()}
+            # The most selective field gives the candidate rows, the others are only read on them.
+            fields = sorted(filters, key=sizes.get)
+            positions = self.positions(fields[0], groups[fields[0]])
+            for field in fields[1:]:
+                if not len(positions):
+                    break
+                positions = positions[np.isin(self.arrays[field][positions], filters[field])]
+            skus = self.arrays['sku'][positions].astype(np.int64)
+
+        if len(removed):
+            skus = skus[~np.isin(skus, removed)]
+        matched = [sku for sku, path in added.items()
+                   if all(path[PATH_FIELDS.index(field)] in ids for field, ids in filters.items())]
+        if matched:
+            skus = np.sort(np.concatenate([skus, np.array(matched, dtype=np.int64)]))
+        return skus
+
+    def paths(self, skus):
+        """
+        Returns the (location, department, category, subcategory) ids of existing SKUs, a (len(skus), 4) array.
+        """
+        added = self.delta[1]
+        skus = np.asarray(skus, dtype=np.int64)
+        paths = np.empty((len(skus), len(PATH_FIELDS)), dtype=np.int64)
+        changed = np.isin(skus, np.fromiter(added, dtype=np.int64, count=len(added)))
+        positions = np.searchsorted(self.arrays['sku'], skus[~changed].astype(self.arrays['sku'].dtype))
+        for index, field in enumerate(PATH_FIELDS):
+            paths[~changed, index] = self.arrays[field][positions]
+        for row in np.flatnonzero(changed):
+            paths[row] = added[int(skus[row])]
+        return paths
+
+    def catch_up(self, chunk_size=1000):
+        """
+        Applies the SKUs logged as changed since the build or the last catch up to the delta.
+        Returns False when the index has to be rebuilt instead.
+        """
+        skus, position = self.read_changes(MAX_DELTA)
+        if skus is None:
+            return False
+        if not skus:
+            self.advance(position)
+            return True
+
+        removed, added = self.delta
+        added = dict(added)
+        for sku in skus:
+            added.pop(sku, None)
+        skus = sorted(skus)
+        for start in range(0, len(skus), chunk_size):
+            for row in SKUSearch.objects.filter(sku__in=skus[start:start + chunk_size]).values_list(*COLUMNS):
+                added[row[0]] = row[1:]
+        # Only the SKUs of the columns have to be masked, new ones are only in the delta.
+        present = np.array(skus, dtype=np.int64)
+        present = present[np.isin(present, self.arrays['sku'])]
+        # Filters running in other threads keep the delta they started with.
+        self.delta = (np.union1d(removed, present), added)
+        self.advance(position)
+        return True
+
+    def compact(self):
+        """
+        Returns a new index with the delta merged into its columns, at the same position in the change log.
+        """
+        removed, added = self.delta
+        keep = ~np.isin(self.arrays['sku'], removed)
+        rows = np.array([(sku,) + tuple(path) for sku, path in added.items()], dtype=np.int32).reshape(-1, len(COLUMNS))
+        columns = {name: np.concatenate([self.arrays[name][keep], rows[:, index]]) for index, name in enumerate(COLUMNS)}
+        order = np.argsort(columns['sku'], kind='stable')
+        index = self.from_columns({name: column[order] for name, column in columns.items()}, self.last_change)
+        index.applied, index.gap_since = self.applied, self.gap_since
+        return index
+
+
+class IndexedRows:
+    """
+    The SKUs matched by the column index as [sku, location, department, category, subcategory] rows, the
+    names read from the cached hierarchy. It supports the part of the QuerySet API used by the keyset
+    pagination, filter(pk__gt=), order_by('pk') and slicing, so it is paginated and streamed like the
+    sku_search values_list rows it replaces.
+    """
+
+    def __init__(self, index, skus, hierarchy):
+        self.index = index
+        self.skus = skus
+        self.hierarchy = hierarchy
+
+    def filter(self, pk__gt):
+        return IndexedRows(self.index, self.skus[np.searchsorted(self.skus, pk__gt, side='right'):], self.hierarchy)
+
+    def order_by(self, *fields):
+        return self
+
+    def __len__(self):
+        return len(self.skus)
+
+    def __getitem__(self, key):
+        if not isinstance(key, slice):
+            raise TypeError('IndexedRows only supports slicing.')
+        return IndexedRows(self.index, self.skus[key], self.hierarchy)
+
+    def rows(self, skus):
+        name = self.hierarchy.name
+        return [(sku,) + tuple(name(level, pk) for level, pk in zip(LEVELS, path))
+                for sku, path in zip(skus.tolist(), self.index.paths(skus).tolist())]
+
+    def __iter__(self):
+        for start in range(0, len(self.skus), ROWS_CHUNK):
+            yield from self.rows(self.skus[start:start + ROWS_CHUNK])
+
+    async def __aiter__(self):
+        for row in self:
+            yield row
+
+
+def index_enabled():
+    return getattr(settings, 'SKU_COLUMN_INDEX', False)
+
+
+def indexed_skus(params):
+    """
+    Returns the IndexedRows of the SKUs matching the location, department, category and subcategory
+    names given in params, any subset of them, like search_by_names. Returns None while the index of the
+    process is first built.
+    """
+    index = get_column_index()
+    if index is None:
+        return None
+    hierarchy = get_hierarchy()
+    filters = {field: hierarchy.ids(level, params[level])
+               for level, field in zip(LEVELS, PATH_FIELDS) if params.get(level) is not None}
+    return IndexedRows(index, index.filter(filters), hierarchy)
+
+
+_index = None
+_lock = threading.Lock()
+# Thread building the next index and whether it rebuilds it from sku_search, lookups use the current one meanwhile.
+_builder = None
+_rebuilding = False
+
+
+def get_column_index():
+    """
+    Returns the column index of this process, mapping it from a snapshot on first use, see load_column_index.
+    Every call first applies the SKUs changed by any process since, read from the sku_search change log.
+    Building the index from sku_search, merging a delta grown beyond MAX_DELTA and rebuilding an index too far
+    behind the change log run in a background thread, lookups keep using the current index until the new one is
+    swapped in, and get None until the first one is.
+    """
+    global _index
+    with _lock:
+        if _index is None:
+            if _builder is None:
+                _index = load_column_index()
+        elif not _rebuilding:
+            if not _index.catch_up():
+                if _builder is None:
+                    start_builder(ColumnIndex.from_db, rebuild=True)
+            elif _builder is None and len(_index.delta[0]) + len(_index.delta[1]) > MAX_DELTA:
+                # A copy, so the delta and the position it merges do not move while it runs.
+                start_builder(copy.copy(_index).compact)
+        return _index
+
+
+def wait_column_index():
+    """
+    Returns the column index of this process once it is built, waiting for the background builder. For the
+    commands and tests timing or checking it, requests never wait.
+    """
+    get_column_index()
+    builder = _builder
+    if builder is not None:
+        builder.join()
+    return get_column_index()
+
+
+def start_builder(build, rebuild=False):
+    """
+    Runs build in a background thread and swaps the index it returns in, the caller holds the lock.
+    The new index catches up with the changes logged since its position on the next call.
+    """
+    global _builder, _rebuilding
+
+    def run():
+        global _index, _builder, _rebuilding
+        index = None
+        try:
+            index = build()
+        except Exception:
+            logger.exception('Building the column index failed, the current one is kept')
+        finally:
+            # The thread has its own connection.
+            connection.close()
+            with _lock:
+                if _builder is thread:
+                    if index is not None:
+                        _index = index
+                    _builder, _rebuilding = None, False
+
+    thread = _builder = threading.Thread(target=run, name='sku-column-index', daemon=True)
+    _rebuilding = rebuild
+    thread.start()
+
+
+def load_column_index():
+    """
+    Maps the index from SKU_COLUMN_INDEX_SNAPSHOT, or else from the catalog snapshot, when it exists and is still
+    within the change log. Otherwise starts building it from sku_search and returns None, the caller holds the lock.
+    """
+    path = getattr(settings, 'SKU_COLUMN_INDEX_SNAPSHOT', None)
+    index = None
+    if path:
+        try:
+            index = ColumnIndex.load(path)
+        except (OSError, SnapshotError, KeyError):
+            pass
+    elif get_catalog() is not None:
+        index = ColumnIndex.from_catalog(get_catalog())
+    if index is not None and index.catch_up():
+        return index
+    start_builder(ColumnIndex.from_db)
+    return None
+
+
+def drop_column_index():
+    """
+    Drops the column index of this process, the next lookup loads it again. Needed after the tables were
+    emptied without going through the change log.
+    """
+    global _index, _builder, _rebuilding
+    with _lock:
+        _index = _builder = None
+        _rebuilding = False
@@ -0,0 +1,149 @@
+"""
+Export of the SKU catalog, in the sku_data.txt layout read by loadskudata, as CSV, NDJSON or Parquet.
+The rows are read from the denormalized sku_search table in chunks and encoded chunk by chunk, so the
+memory used does not depend on the size of the catalog.
+"""
+import csv
+import io
+
+from django.db import connection
+
+from .pagination import keyset_iterator
+from .renderers import dumps
+from .search import search_by_names
+from .validation import SKU_FIELDS
+
+try:
+    import pyarrow
+    import pyarrow.parquet
+except ImportError:  # pyarrow is optional, only the Parquet format needs it
+    pyarrow = None
+
+# Columns of the export, the sku_data.txt layout, and the sku_search fields they are read from.
+EXPORT_COLUMNS = tuple(SKU_FIELDS)
+EXPORT_FIELDS = ('sku', 'description', 'location_name', 'department_name', 'category_name', 'subcategory_name')
+
+# format -> (content type, file extension)
+EXPORT_FORMATS = {
+    'csv': ('text/csv', '.txt'),
+    'ndjson': ('application/x-ndjson', '.ndjson'),
+    'parquet': ('application/vnd.apache.parquet', '.parquet'),
+}
+
+
+def export_format(filepath):
+    """
+    Returns the export format matching the extension of a file, csv for unknown extensions.
+    """
+    for name, (_, extension) in EXPORT_FORMATS.items():
+        if str(filepath).endswith(extension):
+            return name
+    return 'csv'
+
+
+def catalog_queryset(params=None):
+    """
+    Returns the export rows of the SKUs matching the location, department, category and subcategory
+    names of the params, as get_skus_by_meta_data filters them.
+    """
+    return search_by_names(params or {}).values_list(*EXPORT_FIELDS)
+
+
+def catalog_chunks(queryset, chunk_size=10000):
+    """
+    Yields the rows of the queryset ordered by sku, in lists of chunk_size rows. They are fetched through
+    a server-side cursor with iterator(), except on MySQL, whose driver buffers the whole result set of
+    a query, where every chunk is read with its own `sku > last` query instead.
+    """
+    if connection.vendor == 'mysql':
+        rows = keyset_iterator(queryset, chunk_size)
+    else:
+        rows = queryset.order_by('pk').iterator(chunk_size=chunk_size)
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) == chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def encode_csv(chunks):
+    yield (','.join(EXPORT_COLUMNS) + '\n').encode()
+    for chunk in chunks:
+        output = io.StringIO()
+        csv.writer(output, lineterminator='\n').writerows(chunk)
+        yield output.getvalue().encode()
+
+
+def encode_ndjson(chunks):
+    for chunk in chunks:
+        yield b''.join(dumps(dict(zip(EXPORT_COLUMNS, row))) + b'\n' for row in chunk)
+
+
+class ChunkSink(io.RawIOBase):
+    """
+    Write only file collecting what is written to it until it is taken, so a file format written
+    from the start to the end can be streamed.
+    """
+
+    def __init__(self):
+        super().__init__()
+        self.chunks = []
+        self.position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self.chunks.append(bytes(data))
+        self.position += len(data)
+        return len(data)
+
+    def tell(self):
+        return self.position
+
+    def take(self):
+        data = b''.join(self.chunks)
+        self.chunks = []
+        return data
+
+
+def parquet_schema():
+    return pyarrow.schema([(column, pyarrow.int64() if length is None else pyarrow.string())
+                           for column, length in SKU_FIELDS.items()])
+
+
+def encode_parquet(chunks):
+    """
+    Writes every chunk as a row group, the names are dictionary encoded by pyarrow.
+    """
+    schema = parquet_schema()
+    sink = ChunkSink()
+    writer = pyarrow.parquet.ParquetWriter(sink, schema)
+    try:
+        for chunk in chunks:
+            writer.write_batch(pyarrow.RecordBatch.from_arrays(
+                [pyarrow.array(values, field.type) for values, field in zip(zip(*chunk), schema)], schema=schema))
+            yield sink.take()
+    finally:
+        writer.close()
+    yield sink.take()
+
+
+ENCODERS = {'csv': encode_csv, 'ndjson': encode_ndjson, 'parquet': encode_parquet}
+
+
+def export_catalog(format, queryset=None, chunk_size=10000, chunks=None):
+    """
+    Returns an iterator of the SKUs of the queryset, all of them by default, encoded in the format as bytes.
+    chunks replaces the rows read from the queryset, see catalog_chunks.
+    """
+    if format not in ENCODERS:
+        raise ValueError('format must be one of {}.'.format(', '.join(ENCODERS)))
+    if format == 'parquet' and pyarrow is None:
+        raise ImportError('The parquet format requires pyarrow, pip install pyarrow')
+    if chunks is None:
+        chunks = catalog_chunks(catalog_queryset() if queryset is None else queryset, chunk_size)
+    return ENCODERS[format](chunks)
@@ -0,0 +1,194 @@
+import time
+from collections import namedtuple
+from types import MappingProxyType
+
+from django.conf import settings
+from django.db.models import Max
+
+from .models import Location, Department, Category, SubCategory, HierarchyChange
+from .snapshot import get_catalog
+from .versions import bump_versions, get_version
+
+LEVELS = ('location', 'department', 'category', 'subcategory')
+
+LEVEL_MODELS = dict(zip(LEVELS, (Location, Department, Category, SubCategory)))
+PARENT_FIELDS = dict(zip(LEVELS, (None, 'location_id', 'department_id', 'category_id')))
+
+VERSION_KEY = 'sku:hierarchy:version'
+
+# Number of entries kept in the hierarchy change log, hierarchies of older catalog snapshots are read from the tables.
+MAX_NODE_CHANGES = 10000
+
+Node = namedtuple('Node', ('id', 'name', 'parent_id', 'children'))
+
+
+class Hierarchy:
+    """
+    Immutable in-memory snapshot of the Location -> Department -> Category -> SubCategory tree.
+    Nodes are indexed by id and by name for every level, children are kept as id tuples.
+    """
+
+    def __init__(self, locations, departments, categories, subcategories):
+        """
+        Each argument is an iterable of (id, name, parent_id) rows, ordered by id.
+        """
+        levels = [list(rows) for rows in (locations, departments, categories, subcategories)]
+        children = [{} for _ in LEVELS]
+        for depth, rows in enumerate(levels[1:], start=1):
+            for pk, name, parent_id in rows:
+                children[depth - 1].setdefault(parent_id, []).append(pk)
+
+        self.nodes = {}
+        self.names = {}
+        for depth, (level, rows) in enumerate(zip(LEVELS, levels)):
+            nodes = {}
+            names = {}
+            for pk, name, parent_id in rows:
+                nodes[pk] = Node(pk, name, parent_id, tuple(children[depth].get(pk, ())))
+                names.setdefault(name, []).append(pk)
+            self.nodes[level] = MappingProxyType(nodes)
+            self.names[level] = MappingProxyType({name: tuple(ids) for name, ids in names.items()})
+
+    @classmethod
+    def from_db(cls):
+        return cls(*(node_rows(level) for level in LEVELS))
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """
+        Builds the hierarchy from the nodes of a catalog snapshot, those logged as changed since it was written
+        read again from the tables. Returns None when the change log no longer goes back to the snapshot.
+        """
+        since = catalog.meta['last_hierarchy_change']
+        changes = list(HierarchyChange.objects.filter(id__gt=since).order_by('id')
+                       .values_list('id', 'level', 'node_id')[:MAX_NODE_CHANGES + 1])
+        # Entries up to MAX_NODE_CHANGES before the newest one may have been pruned from the log.
+        if len(changes) > MAX_NODE_CHANGES or changes and changes[-1][0] - MAX_NODE_CHANGES > since:
+            return None
+        changed = {level: set() for level in LEVELS}
+        for _, depth, pk in changes:
+            changed[LEVELS[depth]].add(pk)
+
+        levels = []
+        for level in LEVELS:
+            rows = catalog.node_rows(level)
+            if changed[level]:
+                rows = [row for row in rows if row[0] not in changed[level]]
+                rows = sorted(rows + list(node_rows(level, changed[level])), key=lambda row: row[0])
+            levels.append(rows)
+        return cls(*levels)
+
+    def get(self, level, pk):
+        """
+        Returns the node with the given id, or None.
+        """
+        return self.nodes[level].get(pk)
+
+    def name(self, level, pk):
+        """
+        Returns the name of the node with the given id, or None.
+        """
+        node = self.nodes[level].get(pk)
+        return node.name if node else None
+
+    def ids(self, level, name):
+        """
+        Returns the ids of the nodes of a level with the given name. Names are only unique
+        within their parent, so there may be several.
+        """
+        return self.names[level].get(name, ())
+
+    def children(self, level, pk):
+        """
+        Returns the child nodes of the given node, ordered by id.
+        """
+        node = self.get(level, pk)
+        if node is None:
+            return ()
+        child_level = self.nodes[LEVELS[LEVELS.index(level) + 1]]
+        return tuple(child_level[child] for child in node.children)
+
+    def path(self, level, pk):
+        """
+        Returns the ids from the location down to the given node, or None when it does not exist.
+        """
+        ids = []
+        for current in reversed(LEVELS[:LEVELS.index(level) + 1]):
+            node = self.get(current, pk)
+            if node is None:
+                return None
+            ids.append(node.id)
+            pk = node.parent_id
+        return tuple(reversed(ids))
+
+
+def node_rows(level, pks=None):
+    """
+    Returns the (id, name, parent_id) rows of the nodes of a level ordered by id, only those with the given ids
+    when pks is given.
+    """
+    queryset = LEVEL_MODELS[level].objects.order_by('id')
+    if pks is not None:
+        queryset = queryset.filter(id__in=list(pks))
+    if PARENT_FIELDS[level] is None:
+        return ((pk, name, None) for pk, name in queryset.values_list('id', 'name'))
+    return queryset.values_list('id', 'name', PARENT_FIELDS[level])
+
+
+def load_hierarchy():
+    """
+    Builds the hierarchy from the catalog snapshot when one is configured and still within the change log,
+    otherwise from the tables.
+    """
+    catalog = get_catalog()
+    hierarchy = Hierarchy.from_catalog(catalog) if catalog is not None else None
+    return Hierarchy.from_db() if hierarchy is None else hierarchy
+
+
+def version_check_interval():
+    """
+    Seconds an in-process copy is used before its shared version is read again, see SKU_VERSION_CHECK_INTERVAL.
+    """
+    return getattr(settings, 'SKU_VERSION_CHECK_INTERVAL', 0.1)
+
+
+_hierarchy = None
+_version = None
+_checked = 0
+
+
+def get_hierarchy():
+    """
+    Returns the cached hierarchy, building it on first use and again whenever a write in any worker moved
+    its shared version, which is read at most every SKU_VERSION_CHECK_INTERVAL seconds. Writes of this
+    process drop it at once.
+    """
+    global _hierarchy, _version, _checked
+    now = time.monotonic()
+    if _hierarchy is None or now - _checked >= version_check_interval():
+        # The version is read before building, a concurrent change triggers another rebuild.
+        version = get_version(VERSION_KEY)
+        _checked = now
+        if _hierarchy is None or version != _version:
+            _hierarchy, _version = load_hierarchy(), version
+    return _hierarchy
+
+
+def invalidate_hierarchy():
+    """
+    Drops the cached hierarchy of every worker.
+    Call it through transaction.on_commit so no worker rebuilds from uncommitted data.
+    """
+    global _hierarchy
+    bump_versions([VERSION_KEY])
+    _hierarchy = None
+
+
+def record_node_changes(level, pks):
+    """
+    Appends the written or deleted nodes of a level to the hierarchy change log and drops its oldest entries.
+    Run it in the transaction writing the nodes.
+    """
+    HierarchyChange.objects.bulk_create([HierarchyChange(level=LEVELS.index(level), node_id=pk) for pk in pks])
+    newest = HierarchyChange.objects.aggregate(newest=Max('id'))['newest'] or 0
+    HierarchyChange.objects.filter(id__lte=newest - MAX_NODE_CHANGES).delete()
@@ -0,0 +1,347 @@
+import copy
+import logging
+import re
+import threading
+from array import array
+from bisect import bisect_left
+from collections import Counter
+
+import numpy as np
+from django.db import connection
+from django.db.models import Max
+
+from .models import SKUSearch, SKUSearchChange
+from .pagination import keyset_iterator
+from .search import ChangeLogFollower
+from .snapshot import StringTable, get_catalog
+
+logger = logging.getLogger(__name__)
+
+TOKEN = re.compile(r'[^\W_]+')
+
+TEXT_FIELDS = ('sku', 'description', 'location_name', 'department_name', 'category_name', 'subcategory_name')
+
+# Number of SKUs changed since the build kept aside in the delta, they are merged into the arrays beyond it.
+MAX_DELTA = 10000
+
+
+def tokenize(text):
+    """
+    Returns the lower cased words of the text.
+    """
+    return TOKEN.findall(text.lower())
+
+
+def document_terms(row):
+    """
+    Returns the term frequencies of a TEXT_FIELDS row, over its description and hierarchy names.
+    """
+    return Counter(term for text in row[1:] for term in tokenize(text))
+
+
+def top_ranked(scores, limit):
+    """
+    Returns the positions of the limit highest scores, ties going to the lowest positions, ranked.
+    """
+    if len(scores) > limit:
+        kth = -np.partition(-scores, limit - 1)[limit - 1]
+        above = np.flatnonzero(scores > kth)
+        top = np.concatenate([above, np.flatnonzero(scores == kth)[:limit - len(above)]])
+    else:
+        top = np.arange(len(scores))
+    return top[np.lexsort((top, -scores[top]))]
+
+
+class SearchIndex(ChangeLogFollower):
+    """
+    Inverted index of the sku_search rows. Every term of the descriptions and hierarchy names
+    maps to the SKUs containing it with its frequency in them. Terms are sorted, so the terms
+    starting with a prefix form one range, and their postings are stored back to back in
+    NumPy arrays, so that range is a single slice.
+    SKUs changed after the build are masked out of the arrays and kept in a small delta.
+    """
+
+    def __init__(self, terms, skus, frequencies, offsets, last_change=0):
+        """
+        terms is the sorted list of the terms, the SKUs containing term i and its frequencies in them are
+        the skus and frequencies between offsets i and i + 1, ordered by sku. last_change is the id of the
+        last change log entry they include.
+        """
+        self.terms = terms
+        self.skus = skus
+        self.frequencies = frequencies
+        self.offsets = offsets
+        self.skus_end = int(self.skus.max()) + 1 if len(self.skus) else 0
+
+        super().__init__(last_change)
+        # (SKUs masked out of the arrays, term frequencies of the changed SKUs still existing)
+        self.delta = (np.empty(0, dtype=np.int64), {})
+
+    @classmethod
+    def from_documents(cls, documents, last_change=0):
+        """
+        documents is an iterable of (sku, term frequencies) pairs, last_change the id of the
+        last change log entry they include.
+        """
+        vocabulary = {}
+        term_ids, skus, frequencies = array('l'), array('l'), array('l')
+        for sku, terms in documents:
+            for term, frequency in terms.items():
+                term_ids.append(vocabulary.setdefault(term, len(vocabulary)))
+                skus.append(sku)
+                frequencies.append(frequency)
+
+        terms = sorted(vocabulary)
+        rank = np.empty(len(terms), dtype=np.int64)
+        rank[[vocabulary[term] for term in terms]] = np.arange(len(terms))
+        term_ids = rank[np.frombuffer(term_ids, dtype=np.int_)] if term_ids else np.empty(0, dtype=np.int64)
+        return cls.from_postings(terms, term_ids, np.frombuffer(skus, dtype=np.int_),
+                                 np.frombuffer(frequencies, dtype=np.int_), last_change)
+
+    @classmethod
+    def from_postings(cls, terms, term_ids, skus, frequencies, last_change=0):
+        """
+        Builds the index from postings in any order, term_ids indexing the sorted list of terms.
+        Terms left without postings are dropped.
+        """
+        counts = np.bincount(term_ids, minlength=len(terms))
+        used = np.flatnonzero(counts)
+        if len(used) < len(terms):
+            rank = np.full(len(terms), -1, dtype=np.int64)
+            rank[used] = np.arange(len(used))
+            terms, term_ids = [terms[index] for index in used.tolist()], rank[term_ids]
+        order = np.lexsort((skus, term_ids))
+        offsets = np.searchsorted(term_ids[order], np.arange(len(terms) + 1))
+        return cls(terms, skus[order].astype(np.int64), frequencies[order].astype(np.int64), offsets, last_change)
+
+    @classmethod
+    def from_db(cls, chunk_size=10000):
+        # Changes logged while reading are applied again by the next catch_up, which is harmless.
+        last_change = SKUSearchChange.objects.aggregate(last=Max('id'))['last'] or 0
+        rows = keyset_iterator(SKUSearch.objects.values_list(*TEXT_FIELDS), chunk_size)
+        return cls.from_documents(((row[0], document_terms(row)) for row in rows), last_change)
+
+    @classmethod
+    def from_catalog(cls, catalog):
+        """
+        Maps the index stored in a catalog snapshot, see snapshot.CatalogSnapshot, only the terms are decoded.
+        """
+        terms = StringTable(catalog.arrays['search.terms.offsets'], catalog.arrays['search.terms.data'])
+        return cls(terms.decode(np.arange(len(terms))), catalog.arrays['search.skus'],
+                   catalog.arrays['search.frequencies'], catalog.arrays['search.offsets'], catalog.meta['last_change'])
+
+    def term_range(self, prefix):
+        """
+        Returns the (start, end) indexes of the terms starting with prefix.
+        """
+        return bisect_left(self.terms, prefix), bisect_left(self.terms, prefix + '\U0010ffff')
+
+    def match(self, prefix, delta):
+        """
+        Returns the SKUs having a term starting with prefix, sorted, and the sum of the
+        frequencies of those terms in each of them.
+        """
+        removed, added = delta
+        start, end = self.term_range(prefix)
+        skus = self.skus[self.offsets[start]:self.offsets[end]]
+        frequencies = self.frequencies[self.offsets[start]:self.offsets[end]]
+        if end - start > 1 and len(skus) * 64 > self.skus_end:
+            # SKUs are dense integers, counting many of them is much faster than sorting.
+            totals = np.bincount(skus, weights=frequencies)
+            skus = np.flatnonzero(totals)
+            frequencies = totals[skus].astype(np.int64)
+        elif end - start > 1:
+            skus, inverse = np.unique(skus, return_inverse=True)
+            frequencies = np.bincount(inverse, weights=frequencies).astype(np.int64)
+        if len(removed):
+            keep = ~np.isin(skus, removed, assume_unique=True)
+            skus, frequencies = skus[keep], frequencies[keep]
+
+        added = [(sku, sum(frequency for term, frequency in terms.items() if term.startswith(prefix)))
+                 for sku, terms in added.items()]
+        added = [(sku, score) for sku, score in added if score]
+        if added:
+            skus = np.concatenate([skus, np.array([sku for sku, _ in added], dtype=np.int64)])
+            frequencies = np.concatenate([frequencies, np.array([score for _, score in added], dtype=np.int64)])
+            order = np.argsort(skus, kind='stable')
+            skus, frequencies = skus[order], frequencies[order]
+        return skus, frequencies
+
+    def search(self, query, limit=20):
+        """
+        Returns up to limit (sku, score) pairs of the SKUs matching every word of the query as a
+        prefix of one of their terms, ranked by the summed term frequencies, then by sku.
+        """
+        words = list(dict.fromkeys(tokenize(query)))
+        if not words:
+            return []
+        delta = self.delta
+        matches = [self.match(word, delta) for word in words]
+        if len(matches) == 1:
+            skus, scores = matches[0]
+        else:
+            size = max((int(skus[-1]) + 1 for skus, _ in matches if len(skus)), default=0)
+            totals = np.zeros(size, dtype=np.int64)
+            counts = np.zeros(size, dtype=np.int32)
+            for skus, frequencies in matches:
+                totals[skus] += frequencies
+                counts[skus] += 1
+            skus = np.flatnonzero(counts == len(matches))
+            scores = totals[skus]
+        top = top_ranked(scores, limit)
+        return list(zip(skus[top].tolist(), scores[top].tolist()))
+
+    def suggest(self, prefix, limit=10):
+        """
+        Returns up to limit (term, number of SKUs) pairs of the terms starting with prefix, most frequent first.
+        The counts cover the SKUs of the last build.
+        """
+        start, end = self.term_range(prefix.lower())
+        counts = np.diff(self.offsets[start:end + 1])
+        top = top_ranked(counts, limit)
+        return [(self.terms[start + index], int(counts[index])) for index in top]
+
+    def catch_up(self, chunk_size=1000):
+        """
+        Applies the SKUs logged as changed since the build or the last catch up.
+        Returns False when the index has to be rebuilt instead.
+        """
+        skus, position = self.read_changes(MAX_DELTA)
+        if skus is None:
+            return False
+        if not skus:
+            self.advance(position)
+            return True
+
+        removed, added = self.delta
+        added = dict(added)
+        for sku in skus:
+            added.pop(sku, None)
+        skus = sorted(skus)
+        for start in range(0, len(skus), chunk_size):
+            for row in SKUSearch.objects.filter(sku__in=skus[start:start + chunk_size]).values_list(*TEXT_FIELDS):
+                added[row[0]] = document_terms(row)
+        removed = np.union1d(removed, np.array(skus, dtype=np.int64))
+        # Searches running in other threads keep the delta they started with.
+        self.delta = (removed, added)
+        self.advance(position)
+        return True
+
+    def compact(self):
+        """
+        Returns a new index with the delta merged into its arrays, at the same position in the change log.
+        The postings are re-sorted in memory, the database is not read.
+        """
+        removed, added = self.delta
+        keep = ~np.isin(self.skus, removed)
+        new_terms = {term for terms in added.values() for term in terms}.difference(self.terms)
+        terms = sorted(new_terms.union(self.terms))
+        position = {term: index for index, term in enumerate(terms)}
+        rank = np.array([position[term] for term in self.terms], dtype=np.int64)
+        term_ids = [rank[np.repeat(np.arange(len(self.terms)), np.diff(self.offsets))[keep]]]
+        skus, frequencies = [self.skus[keep]], [self.frequencies[keep]]
+        postings = [(position[term], sku, frequency) for sku, doc in added.items() for term, frequency in doc.items()]
+        if postings:
+            postings = np.array(postings, dtype=np.int64)
+            term_ids.append(postings[:, 0])
+            skus.append(postings[:, 1])
+            frequencies.append(postings[:, 2])
+        index = self.from_postings(terms, np.concatenate(term_ids), np.concatenate(skus), np.concatenate(frequencies),
+                                   self.last_change)
+        index.applied, index.gap_since = self.applied, self.gap_since
+        return index
+
+
+_index = None
+_lock = threading.Lock()
+# Thread building the next index and whether it rebuilds it from sku_search, searches use the current one meanwhile.
+_builder = None
+_rebuilding = False
+
+
+def get_search_index():
+    """
+    Returns the search index of this process, mapping it from the catalog snapshot on first use, see
+    load_search_index. Every call first applies the SKUs changed by any process since, reading them from the
+    sku_search change log. Building the index from sku_search, merging a delta grown beyond MAX_DELTA and rebuilding
+    an index too far behind the change log run in a background thread, searches keep using the current index until
+    the new one is swapped in, and get None until the first one is.
+    """
+    global _index
+    with _lock:
+        if _index is None:
+            if _builder is None:
+                _index = load_search_index()
+        elif not _rebuilding:
+            if not _index.catch_up():
+                if _builder is None:
+                    start_builder(SearchIndex.from_db, rebuild=True)
+            elif _builder is None and len(_index.delta[0]) + len(_index.delta[1]) > MAX_DELTA:
+                # A copy, so the delta and the position it merges do not move while it runs.
+                start_builder(copy.copy(_index).compact)
+        return _index
+
+
+def wait_search_index():
+    """
+    Returns the search index of this process once it is built, waiting for the background builder. For the
+    commands and tests timing or checking it, requests never wait.
+    """
+    get_search_index()
+    builder = _builder
+    if builder is not None:
+        builder.join()
+    return get_search_index()
+
+
+def start_builder(build, rebuild=False):
+    """
+    Runs build in a background thread and swaps the index it returns in, the caller holds the lock.
+    The new index catches up with the changes logged since its position on the next call.
+    """
+    global _builder, _rebuilding
+
+    def run():
+        global _index, _builder, _rebuilding
+        index = None
+        try:
+            index = build()
+        except Exception:
+            logger.exception('Building the search index failed, the current one is kept')
+        finally:
+            # The thread has its own connection.
+            connection.close()
+            with _lock:
+                if _builder is thread:
+                    if index is not None:
+                        _index = index
+                    _builder, _rebuilding = None, False
+
+    thread = _builder = threading.Thread(target=run, name='sku-search-index', daemon=True)
+    _rebuilding = rebuild
+    thread.start()
+
+
+def load_search_index():
+    """
+    Maps the index from the catalog snapshot when one is configured and still within the change log.
+    Otherwise starts building it from sku_search and returns None, the caller holds the lock.
+    """
+    catalog = get_catalog()
+    if catalog is not None:
+        index = SearchIndex.from_catalog(catalog)
+        if index.catch_up():
+            return index
+    start_builder(SearchIndex.from_db)
+    return None
+
+
+def drop_search_index():
+    """
+    Drops the search index of this process, the next search rebuilds it. Needed after the tables were
+    emptied without going through the change log.
+    """
+    global _index, _builder, _rebuilding
+    with _lock:
+        _index = _builder = None
+        _rebuilding = False
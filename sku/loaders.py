@@ -0,0 +1,615 @@
+import os
+import queue
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Count, Max
+
+from .hierarchy import invalidate_hierarchy, record_node_changes
+from .response_cache import created_node_tags, invalidate_tags_on_commit, sku_tags
+from .models import Location, Department, Category, SubCategory, SKUDataMapping, ImportState
+from .search import refresh_skus
+from .signals import delete_nodes, delete_skus
+from .tree import sync_tree
+from .validation import ChunkValidator, normalize_names, quarantine_path
+
+
+def upsert_options(unique_fields, update_fields):
+    """
+    Returns the bulk_create arguments updating update_fields on conflicts. MySQL upserts on any
+    unique key and rejects unique_fields, the other backends require them.
+    """
+    options = {'update_conflicts': True, 'update_fields': update_fields}
+    if connection.features.supports_update_conflicts_with_target:
+        options['unique_fields'] = unique_fields
+    return options
+
+
+def read_chunks(filepath, chunksize=None, **kwargs):
+    """
+    Returns an iterator of DataFrames for the given CSV or Parquet file.
+    Without a chunksize the whole file is returned as a single chunk, otherwise
+    at most chunksize rows are held in memory at a time.
+    Extra keyword arguments are passed on to pandas.read_csv, Parquet files only take usecols.
+    """
+    if str(filepath).endswith('.parquet'):
+        return read_parquet_chunks(filepath, chunksize, kwargs.get('usecols'))
+    if not chunksize:
+        return iter([pd.read_csv(filepath, **kwargs)])
+    return iter(pd.read_csv(filepath, chunksize=chunksize, **kwargs))
+
+
+# Errors of a file pandas can not parse or decode, see parse_error_message.
+PARSE_ERRORS = (pd.errors.ParserError, pd.errors.EmptyDataError, UnicodeDecodeError)
+
+
+def parse_error_message(filepath, ex):
+    """
+    Returns the message of a PARSE_ERRORS error with the line of the file it was found on. Parser errors
+    name their line, a decoding error only its byte in a buffer, so its line is found by decoding the file
+    line by line.
+    """
+    if isinstance(ex, UnicodeDecodeError):
+        with open(filepath, 'rb') as source:
+            for number, line in enumerate(source, 1):
+                try:
+                    line.decode(ex.encoding)
+                except UnicodeDecodeError as line_ex:
+                    return 'Line {} can not be decoded as {}: {}'.format(number, ex.encoding, line_ex.reason)
+    return 'Can not be parsed: {}'.format(str(ex).strip())
+
+
+def read_parquet_chunks(filepath, chunksize=None, usecols=None):
+    """
+    Yields the row groups of a Parquet file, such as the exports of exportskudata, as DataFrames of at most
+    chunksize rows. Their index counts the rows from the start of the file, like read_csv chunks.
+    """
+    import pyarrow.parquet
+
+    parquet = pyarrow.parquet.ParquetFile(filepath)
+    start = 0
+    for batch in parquet.iter_batches(batch_size=chunksize or max(parquet.metadata.num_rows, 1), columns=usecols):
+        data = batch.to_pandas()
+        data.index = pd.RangeIndex(start, start + len(data))
+        start += len(data)
+        yield data
+
+
+def prefetch(chunks, depth=1):
+    """
+    Iterates over chunks while a background thread parses up to depth chunks ahead,
+    so parsing the next chunk overlaps with the database write of the current one.
+    Exceptions raised by the reader are re-raised in the consuming thread.
+    """
+    buffer = queue.Queue(maxsize=depth)
+    done = object()
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                buffer.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def produce():
+        try:
+            for chunk in chunks:
+                if not put(chunk):
+                    return
+        except Exception as ex:
+            put(ex)
+        else:
+            put(done)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while True:
+            item = buffer.get()
+            if item is done:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class HierarchyResolver:
+    """
+    Resolves (location, department, category, subcategory) name tuples to ids.
+    Every level is resolved with one select for the known rows and one bulk_create
+    for the missing ones, and the resulting ids are kept in dictionaries so the
+    same names are never looked up twice.
+    """
+
+    def __init__(self):
+        self.locations = {}
+        self.departments = {}
+        self.categories = {}
+        self.subcategories = {}
+
+    def _resolve_level(self, model, level, parent_field, keys, cache):
+        """
+        Resolves (parent_id, name) keys of one hierarchy level into the given cache.
+        Locations have no parent, their keys use None as parent_id.
+        """
+        missing = {key for key in keys if key not in cache}
+        if not missing:
+            return
+        # Names are also matched ignoring case: under a case insensitive collation, like MySQL's default, a name
+        # differing only by case from an existing node conflicts with it on insert and is fetched as that node.
+        folded = {}
+        for parent, name in missing:
+            folded.setdefault((parent, name.casefold()), []).append((parent, name))
+        names = {}
+
+        def fetch():
+            queryset = model.objects.filter(name__in={name for _, name in missing})
+            if parent_field:
+                queryset = queryset.filter(**{'{}__in'.format(parent_field): {parent for parent, _ in missing}})
+                rows = list(queryset.values_list('id', parent_field, 'name'))
+            else:
+                rows = [(pk, None, name) for pk, name in queryset.values_list('id', 'name')]
+            # Exact matches first, a case sensitive backend may hold both spellings.
+            for pk, parent, name in rows:
+                names[pk] = name
+                if (parent, name) in missing:
+                    cache.setdefault((parent, name), pk)
+            for pk, parent, name in rows:
+                for key in folded.get((parent, name.casefold()), ()):
+                    cache.setdefault(key, pk)
+
+        fetch()
+        to_create = [key for key in missing if key not in cache]
+        if to_create:
+            # Nodes inserted concurrently by another loader are skipped by the unique constraints.
+            model.objects.bulk_create(
+                [model(name=name, **({parent_field: parent} if parent_field else {})) for parent, name in to_create],
+                ignore_conflicts=True,
+            )
+            # bulk_create does not return primary keys on MySQL, read them back.
+            fetch()
+            unresolved = [name for parent, name in to_create if (parent, name) not in cache]
+            if unresolved:
+                raise DatabaseError('{} {} could not be created or found, they conflict with existing names.'.format(
+                    level, ', '.join(sorted(unresolved))))
+            sync_tree(level, ((cache[key], key[0], names[cache[key]]) for key in to_create))
+            record_node_changes(level, [cache[key] for key in to_create])
+            # bulk_create sends no post_save signals.
+            invalidate_tags_on_commit(created_node_tags(level, (parent for parent, _ in to_create)))
+            transaction.on_commit(invalidate_hierarchy)
+
+    def resolve(self, tuples):
+        """
+        Returns a dict mapping each (location, department, category, subcategory) name tuple
+        to its (location_id, department_id, category_id, subcategory_id) tuple.
+        """
+        tuples = set(tuples)
+
+        self._resolve_level(Location, 'location', None, {(None, loc) for loc, _, _, _ in tuples}, self.locations)
+        loc_ids = {loc: self.locations[(None, loc)] for loc, _, _, _ in tuples}
+
+        self._resolve_level(Department, 'department', 'location_id',
+                            {(loc_ids[loc], dpt) for loc, dpt, _, _ in tuples}, self.departments)
+        dpt_ids = {(loc, dpt): self.departments[(loc_ids[loc], dpt)] for loc, dpt, _, _ in tuples}
+
+        self._resolve_level(Category, 'category', 'department_id',
+                            {(dpt_ids[(loc, dpt)], cat) for loc, dpt, cat, _ in tuples}, self.categories)
+        cat_ids = {(loc, dpt, cat): self.categories[(dpt_ids[(loc, dpt)], cat)] for loc, dpt, cat, _ in tuples}
+
+        self._resolve_level(SubCategory, 'subcategory', 'category_id',
+                            {(cat_ids[(loc, dpt, cat)], sub) for loc, dpt, cat, sub in tuples}, self.subcategories)
+
+        return {
+            (loc, dpt, cat, sub): (
+                loc_ids[loc], dpt_ids[(loc, dpt)], cat_ids[(loc, dpt, cat)],
+                self.subcategories[(cat_ids[(loc, dpt, cat)], sub)]
+            )
+            for loc, dpt, cat, sub in tuples
+        }
+
+
+def fingerprint(data, columns):
+    """
+    Returns a vectorized 64-bit content hash of the given columns as an int64 array.
+    """
+    hashed = pd.util.hash_pandas_object(data[list(columns)].astype(str), index=False)
+    return hashed.to_numpy().view('int64')
+
+
+class ImportStateTracker:
+    """
+    Keeps the fingerprints of the rows imported from a source, so that an incremental
+    import only applies the rows that were inserted, changed or deleted since the last run.
+    """
+
+    def __init__(self, source, batch_size=1000):
+        self.source = source
+        self.batch_size = batch_size
+        state = ImportState.objects.filter(source=source).values_list('key', 'fingerprint')
+        keys, fingerprints = [], []
+        for key, fp in state.iterator(chunk_size=batch_size * 10):
+            keys.append(key)
+            fingerprints.append(fp)
+        self.previous = pd.Series(fingerprints, index=keys, dtype='int64')
+        self.seen = set()
+        # False once a row was rejected without a readable key, the keys missing from the source are unknown then.
+        self.complete = True
+
+    def changed(self, keys, fingerprints):
+        """
+        Returns a boolean mask of the rows whose fingerprint is new or differs from the
+        previous import, and marks all given keys as seen.
+        """
+        positions = self.previous.index.get_indexer(keys)
+        # Unknown keys get position -1, which picks the padding element.
+        previous = np.append(self.previous.to_numpy(), 0)[positions]
+        self.seen.update(keys.tolist())
+        return (positions == -1) | (previous != fingerprints)
+
+    def keep(self, keys, complete=True):
+        """
+        Marks the keys of rows rejected by the validator as seen, so their previous import is kept. complete is
+        False when some of the rejected rows had no readable key.
+        """
+        self.seen.update(keys)
+        self.complete = self.complete and complete
+
+    def save(self, keys, fingerprints):
+        """
+        Upserts the fingerprints of the applied rows.
+        """
+        state = dict(zip(keys.tolist(), fingerprints.tolist()))
+        ImportState.objects.bulk_create(
+            [ImportState(source=self.source, key=key, fingerprint=fp) for key, fp in state.items()],
+            batch_size=self.batch_size, **upsert_options(['source', 'key'], ['fingerprint']),
+        )
+
+    def deleted(self):
+        """
+        Returns the keys of the previous import that were not seen in this one, none when a rejected row had
+        no readable key.
+        """
+        if not self.complete:
+            return []
+        return [key for key in self.previous.index.tolist() if key not in self.seen]
+
+    def forget(self, keys):
+        for start in range(0, len(keys), self.batch_size):
+            ImportState.objects.filter(source=self.source, key__in=keys[start:start + self.batch_size]).delete()
+
+
+class MetaDataLoader:
+    """
+    Loads rows in the meta_data.csv layout, creating the missing hierarchy nodes.
+    """
+    columns = ('Location', 'Department', 'Category', 'SubCategory')
+
+    def __init__(self, resolver=None, tracker=None, validator=None, delete_skus=False):
+        self.resolver = resolver or HierarchyResolver()
+        self.tracker = tracker
+        self.validator = validator or ChunkValidator.for_meta_data()
+        self.delete_skus = delete_skus
+        self.loaded = 0
+        self.skipped = 0
+        self.unchanged = 0
+        self.deleted = 0
+        # SKUs deleted with their subcategories, or subcategories kept because SKUs reference them, and their SKUs.
+        self.deleted_skus = 0
+        self.kept = 0
+        self.kept_skus = 0
+
+    def load(self, data):
+        """
+        Resolves every hierarchy tuple of the given DataFrame and returns the number of rows loaded.
+        Rows rejected by the validator are skipped. In incremental mode tuples that were already
+        imported are not resolved again, and the tuples of rejected rows are kept.
+        """
+        valid = self.validator.validate(data)
+        self.skipped += len(data) - len(valid)
+        if self.tracker and len(valid) < len(data):
+            self.keep_rejected(data[~data.index.isin(valid.index)])
+        if valid.empty:
+            return 0
+        if self.tracker:
+            keys = fingerprint(valid, self.columns)
+            changed = self.tracker.changed(keys, keys)
+            self.unchanged += int(len(valid) - changed.sum())
+            valid, keys = valid[changed], keys[changed]
+        with transaction.atomic():
+            self.resolver.resolve(zip(*(valid[column].astype(str) for column in self.columns)))
+            if self.tracker:
+                self.tracker.save(keys, keys)
+        self.loaded += len(valid)
+        return len(valid)
+
+    def keep_rejected(self, rejected):
+        """
+        Marks the tuples of the rejected rows, normalized like the valid ones, as seen.
+        """
+        if not set(self.columns).issubset(rejected.columns):
+            self.tracker.keep([], complete=False)
+            return
+        names = pd.DataFrame({column: normalize_names(rejected[column]) for column in self.columns})
+        self.tracker.keep(fingerprint(names, self.columns).tolist())
+
+    def finish(self):
+        """
+        In incremental mode deletes the subcategories whose tuple is no longer in the source. Deleting a subcategory
+        deletes its SKUs, so subcategories still referenced by SKUs are only deleted with delete_skus, otherwise
+        they are kept and counted, and deleted by a later run once their SKUs moved.
+        """
+        if not self.tracker:
+            return
+        deleted = set(self.tracker.deleted())
+        if not deleted:
+            return
+        current = pd.DataFrame(
+            SubCategory.objects.values_list('id', 'category__department__location__name', 'category__department__name',
+                                            'category__name', 'name'),
+            columns=('id',) + self.columns,
+        )
+        current = current[pd.Series(fingerprint(current, self.columns)).isin(deleted).to_numpy()]
+        ids = current['id'].tolist()
+        referenced = dict(SKUDataMapping.objects.filter(subcategory_id__in=ids).values_list('subcategory_id')
+                          .annotate(skus=Count('sku')).order_by())
+        if referenced and not self.delete_skus:
+            kept = current['id'].isin(list(referenced)).to_numpy()
+            # The kept tuples stay in the import state, the next runs report them again.
+            deleted -= set(fingerprint(current[kept], self.columns).tolist())
+            current = current[~kept]
+            self.kept += len(referenced)
+            self.kept_skus += sum(referenced.values())
+        else:
+            self.deleted_skus += sum(referenced.values())
+        with transaction.atomic():
+            delete_nodes(SubCategory, current['id'].tolist())
+            self.tracker.forget(list(deleted))
+        self.deleted += len(current)
+
+
+class SKUBulkLoader:
+    """
+    Loads rows in the sku_data.txt layout into SKUDataMapping.
+    Hierarchy names are deduplicated and resolved once, SKUs are inserted with
+    bulk_create in batches of batch_size, each batch in its own transaction
+    together with its sku_search rows.
+    """
+    columns = ('LOCATION', 'DEPARTMENT', 'CATEGORY', 'SUBCATEGORY')
+
+    def __init__(self, batch_size=1000, resolver=None, tracker=None, validator=None):
+        self.batch_size = batch_size
+        self.resolver = resolver or HierarchyResolver()
+        self.tracker = tracker
+        self.validator = validator or ChunkValidator.for_skus()
+        self.inserted = 0
+        self.skipped = 0
+        self.errored = 0
+        self.unchanged = 0
+        self.deleted = 0
+        self.started = time.monotonic()
+
+    @property
+    def rows_per_second(self):
+        elapsed = time.monotonic() - self.started
+        return self.inserted / elapsed if elapsed else 0.0
+
+    def load(self, data):
+        """
+        Inserts the rows of the given DataFrame and returns the number of inserted SKUs.
+        Rows rejected by the validator are skipped, in incremental mode their SKUs are kept.
+        """
+        valid = self.validator.validate(data)
+        self.skipped += len(data) - len(valid)
+        if self.tracker and len(valid) < len(data):
+            self.keep_rejected(data[~data.index.isin(valid.index)])
+        if valid.empty:
+            return 0
+        if self.tracker:
+            return self.load_incremental(valid)
+
+        names = list(zip(*(valid[column].astype(str) for column in self.columns)))
+        ids = self.resolver.resolve(names)
+
+        objs = [
+            SKUDataMapping(description="SKUDESC{}".format(index + 1), location_id=loc_id, department_id=dpt_id,
+                           category_id=cat_id, subcategory_id=sub_id)
+            for index, (loc_id, dpt_id, cat_id, sub_id) in zip(valid.index, (ids[key] for key in names))
+        ]
+        try:
+            for start in range(0, len(objs), self.batch_size):
+                batch = objs[start:start + self.batch_size]
+                try:
+                    with transaction.atomic():
+                        # bulk_create does not return the new skus on MySQL, they are the ones above the last one.
+                        last = SKUDataMapping.objects.aggregate(last=Max('sku'))['last'] or 0
+                        SKUDataMapping.objects.bulk_create(batch)
+                        refresh_skus(SKUDataMapping.objects.filter(sku__gt=last), self.batch_size)
+                except Exception:
+                    self.errored += len(objs) - start
+                    raise
+                self.inserted += len(batch)
+        finally:
+            self.invalidate(ids.values())
+        return len(objs)
+
+    def invalidate(self, paths):
+        """
+        Evicts the cached SKU query responses covering the given id paths, bulk_create sends no signals.
+        """
+        invalidate_tags_on_commit(tag for path in set(paths) for tag in sku_tags(*path))
+
+    def keep_rejected(self, rejected):
+        """
+        Marks the SKUs of the rejected rows as seen, finish deletes nothing when one has no readable SKU.
+        """
+        keys = pd.to_numeric(rejected.get('SKU', pd.Series(np.nan, index=rejected.index)), errors='coerce')
+        readable = (keys > 0) & (keys % 1 == 0)
+        self.tracker.keep(keys[readable].astype('int64').tolist(), complete=bool(readable.all()))
+
+    def load_incremental(self, valid):
+        """
+        Upserts the validated rows whose fingerprint is new or changed, keyed by the SKU column,
+        and returns their number. The description is taken from the NAME column.
+        """
+        columns = ['SKU', 'NAME'] + list(self.columns)
+        keys = valid['SKU'].astype('int64').to_numpy()
+        fingerprints = fingerprint(valid, columns)
+        changed = self.tracker.changed(keys, fingerprints)
+        self.unchanged += int(len(valid) - changed.sum())
+        valid, keys, fingerprints = valid[changed], keys[changed], fingerprints[changed]
+
+        names = list(zip(*(valid[column].astype(str) for column in self.columns)))
+        ids = self.resolver.resolve(names)
+        # Changed SKUs may move, the responses of their previous path are evicted too.
+        paths = set(ids.values())
+        for start in range(0, len(keys), self.batch_size):
+            paths.update(SKUDataMapping.objects.filter(sku__in=keys[start:start + self.batch_size].tolist()).values_list(
+                'location_id', 'department_id', 'category_id', 'subcategory_id').distinct())
+        objs = [
+            SKUDataMapping(sku=sku, description=description, location_id=loc_id, department_id=dpt_id,
+                           category_id=cat_id, subcategory_id=sub_id)
+            for sku, description, (loc_id, dpt_id, cat_id, sub_id)
+            in zip(keys.tolist(), valid['NAME'].astype(str), (ids[key] for key in names))
+        ]
+        try:
+            for start in range(0, len(objs), self.batch_size):
+                end = start + self.batch_size
+                try:
+                    with transaction.atomic():
+                        SKUDataMapping.objects.bulk_create(objs[start:end], **upsert_options(
+                            ['sku'], ['description', 'location', 'department', 'category', 'subcategory']))
+                        refresh_skus(SKUDataMapping.objects.filter(sku__in=keys[start:end].tolist()), self.batch_size)
+                        self.tracker.save(keys[start:end], fingerprints[start:end])
+                except Exception:
+                    self.errored += len(objs) - start
+                    raise
+                self.inserted += len(objs[start:end])
+        finally:
+            self.invalidate(paths)
+        return len(objs)
+
+    def finish(self):
+        """
+        In incremental mode deletes the SKUs that are no longer in the source, the SKUs of rejected rows are kept.
+        """
+        if not self.tracker:
+            return
+        deleted = self.tracker.deleted()
+        for start in range(0, len(deleted), self.batch_size):
+            batch = deleted[start:start + self.batch_size]
+            with transaction.atomic():
+                delete_skus(batch)
+                self.tracker.forget(batch)
+        self.deleted += len(deleted)
+
+    def load_file(self, filepath, chunksize=None, quarantine_dir=None):
+        """
+        Streams the given file through load() and returns a summary dict.
+        Rejected rows go to the file's quarantine file, see quarantine_path.
+        A chunk that fails is counted as errored and loading continues with the next one. A file that can not
+        be parsed stops at the chunk with the error, the chunks before it are loaded.
+        """
+        self.validator.quarantine = quarantine_path(filepath, quarantine_dir)
+        errors = []
+        parse_error = None
+        try:
+            for data in prefetch(read_chunks(filepath, chunksize)):
+                errored = self.errored
+                try:
+                    self.load(data)
+                except Exception as ex:
+                    if self.errored == errored:
+                        self.errored += len(data)
+                    errors.append(str(ex))
+        except PARSE_ERRORS as ex:
+            parse_error = parse_error_message(filepath, ex)
+            errors.append(parse_error)
+        return {
+            'file': str(filepath),
+            'inserted': self.inserted,
+            'skipped': self.skipped,
+            'errored': self.errored,
+            'unchanged': self.unchanged,
+            'errors': errors,
+            'parse_error': parse_error,
+            'rows_per_second': self.rows_per_second,
+            'quarantine': self.validator.quarantine if self.validator.written else None,
+        }
+
+
+def collect_hierarchy(filepaths, columns=SKUBulkLoader.columns, chunksize=None):
+    """
+    Returns the set of distinct hierarchy name tuples of the rows of the given files that pass the same
+    ChunkValidator as SKUBulkLoader, so no node is created for a row the workers quarantine. The files are
+    read in the same chunks as by the workers, the rejected rows are only written to quarantine by them.
+    A file that can not be parsed contributes the chunks before the error, its worker reports the error.
+    """
+    tuples = set()
+    for filepath in filepaths:
+        validator = ChunkValidator.for_skus()
+        try:
+            for data in read_chunks(filepath, chunksize):
+                data = validator.validate(data)
+                tuples.update(zip(*(data[column].astype(str) for column in columns)))
+        except PARSE_ERRORS:
+            continue
+    return tuples
+
+
+_worker_resolver = None
+
+
+def _init_worker(levels):
+    """
+    Process pool initializer. Sets Django up when the process was spawned and seeds
+    the hierarchy resolver with the levels pre-resolved by the parent. Connections
+    are opened lazily, so every worker gets its own.
+    """
+    global _worker_resolver
+    import django
+    from django.apps import apps
+    if not apps.ready:
+        django.setup()
+    _worker_resolver = HierarchyResolver()
+    _worker_resolver.locations, _worker_resolver.departments, \
+        _worker_resolver.categories, _worker_resolver.subcategories = levels
+
+
+def _load_file_in_worker(filepath, batch_size, chunksize, quarantine_dir):
+    try:
+        return SKUBulkLoader(batch_size, _worker_resolver).load_file(filepath, chunksize, quarantine_dir)
+    except FileNotFoundError:
+        return {'file': str(filepath), 'inserted': 0, 'skipped': 0, 'errored': 0, 'unchanged': 0,
+                'errors': ['File not found'], 'parse_error': None, 'rows_per_second': 0.0, 'quarantine': None}
+
+
+def load_files_parallel(filepaths, workers, batch_size=1000, chunksize=None, quarantine_dir=None):
+    """
+    Loads several files in the sku_data.txt layout with a pool of worker processes.
+    The shared hierarchy is resolved once up front so workers never race to create
+    the same node, then each file is bulk-inserted by one worker over its own
+    connection. Yields one summary dict per file as they complete.
+    """
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    from django.db import connections
+
+    existing = [filepath for filepath in filepaths if os.path.exists(filepath)]
+    resolver = HierarchyResolver()
+    resolver.resolve(collect_hierarchy(existing, chunksize=chunksize))
+    levels = (resolver.locations, resolver.departments, resolver.categories, resolver.subcategories)
+
+    # Forked workers must not share the parent's database connection.
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker, initargs=(levels,)) as pool:
+        futures = [pool.submit(_load_file_in_worker, filepath, batch_size, chunksize, quarantine_dir)
+                   for filepath in filepaths]
+        for future in as_completed(futures):
+            yield future.result()
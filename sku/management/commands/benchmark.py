@@ -0,0 +1,270 @@
+import json
+import os
+import platform
+import statistics
+import subprocess
+import tempfile
+import time
+from datetime import datetime, timezone
+from urllib.parse import urlencode
+
+import django
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import caches
+from django.core.management.base import BaseCommand, CommandError
+from django.core.management.color import no_style
+from django.db import connection
+from django.test import Client
+from sku.column_index import drop_column_index, index_enabled, wait_column_index
+from sku.hierarchy import invalidate_hierarchy
+from sku.inverted_index import drop_search_index, wait_search_index
+from sku.loaders import MetaDataLoader, SKUBulkLoader, prefetch, read_chunks
+from sku.management.commands.generatecatalog import parse_shape, write_catalog
+from sku.models import Location, SKUSearch, ValidationRule
+from sku.response_cache import CACHE_ALIAS
+
+# Streamed endpoints return every matching SKU, they are sampled this many times less.
+STREAMED_SAMPLES_DIVISOR = 10
+
+
+class Command(BaseCommand):
+    """
+    run command to benchmark the loaders and the API:= python manage.py benchmark --sizes 10000,1000000,10000000
+                                                           --output bench/sqlite.json
+    Run it against a scratch database, for every size the sku tables are emptied, a synthetic catalog is
+    generated, loaded through both loaders, then every endpoint is timed in process. The last catalog is
+    left in the tables.
+    Run it once with SQLite and once with MySQL settings, the database, commit and versions are recorded with
+    the results, and --baseline compares the run with the results of another commit.
+    """
+    help = 'Time the loaders and the API endpoints on synthetic catalogs of increasing size'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=str, default='10000', help='Comma separated numbers of SKUs')
+        parser.add_argument('--shape', type=str, default='10x20x20x20',
+                            help='Locations x departments x categories x subcategories of the synthetic catalogs')
+        parser.add_argument('--samples', type=int, default=50, help='Number of timed requests per endpoint')
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument('--chunksize', type=int, default=100000)
+        parser.add_argument('--output', type=str, help='Write the results to this JSON file')
+        parser.add_argument('--baseline', type=str, help='JSON results of an earlier run to compare with')
+        parser.add_argument('--flush', action='store_true', help='Empty the sku tables even if they hold data')
+
+    def handle(self, *args, **options):
+        try:
+            sizes = [int(size) for size in options['sizes'].split(',')]
+        except ValueError:
+            raise CommandError('--sizes must be a comma separated list of numbers.')
+        if options['samples'] < 1:
+            raise CommandError('--samples must be positive.')
+        if Location.objects.exists() and not options['flush']:
+            raise CommandError('The sku tables are not empty, use a scratch database or pass --flush.')
+        baseline = None
+        if options['baseline']:
+            with open(options['baseline']) as source:
+                baseline = json.load(source)
+
+        results = {
+            'commit': git_commit(),
+            'created': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'database_version': '.'.join(str(part) for part in getattr(connection, 'mysql_version', ()))
+                                or getattr(connection.Database, 'sqlite_version', ''),
+            'python': platform.python_version(),
+            'django': django.get_version(),
+            'shape': options['shape'],
+            'runs': [],
+        }
+        with tempfile.TemporaryDirectory() as directory:
+            for size in sizes:
+                self.stdout.write(self.style.MIGRATE_HEADING('{} SKUs'.format(size)))
+                flush()
+                shape = parse_shape(options['shape'], size)
+                meta_path, sku_path = write_catalog(shape, directory, options['chunksize'])
+                run = {
+                    'skus': size,
+                    'loaders': self.load(meta_path, sku_path, options),
+                    'endpoints': self.time_endpoints(options['samples']),
+                }
+                results['runs'].append(run)
+                self.report(run, baseline)
+
+        if options['output']:
+            os.makedirs(os.path.dirname(os.path.abspath(options['output'])), exist_ok=True)
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+    def load(self, meta_path, sku_path, options):
+        """
+        Loads the catalog files through both loaders and returns their throughput.
+        """
+        started = time.perf_counter()
+        loader = MetaDataLoader()
+        for data in prefetch(read_chunks(meta_path, options['chunksize'])):
+            loader.load(data)
+        meta_seconds = time.perf_counter() - started
+
+        started = time.perf_counter()
+        summary = SKUBulkLoader(options['batch_size']).load_file(sku_path, options['chunksize'])
+        sku_seconds = time.perf_counter() - started
+        if summary['errors']:
+            raise CommandError('Loading {} failed: {}'.format(sku_path, summary['errors'][0]))
+        return {
+            'importdata': {'rows': loader.loaded, 'seconds': meta_seconds,
+                           'rows_per_second': loader.loaded / meta_seconds if meta_seconds else 0.0},
+            'loadskudata': {'rows': summary['inserted'], 'seconds': sku_seconds,
+                            'rows_per_second': summary['inserted'] / sku_seconds if sku_seconds else 0.0},
+        }
+
+    def endpoints(self):
+        """
+        Returns name -> (url, streamed) of the timed requests, built from the first SKU of the catalog.
+        """
+        row = SKUSearch.objects.order_by('sku').first()
+        path = {'location': row.location_name, 'department': row.department_name, 'category': row.category_name,
+                'subcategory': row.subcategory_name}
+        ids = (row.location_id, row.department_id, row.category_id, row.subcategory_id)
+        detail = '/api/v1/location/{}/department/{}/category/{}/subcategory/{}/'.format(*ids)
+        return {
+            'locations': ('/api/v1/location/', False),
+            'locations depth 3': ('/api/v1/location/?depth=3', False),
+            'location departments': ('/api/v1/location/{}/department/'.format(ids[0]), False),
+            'subcategory detail': (detail, False),
+            'departments': ('/api/v1/departments/', False),
+            'categories': ('/api/v1/category/', False),
+            'subcategories': ('/api/v1/subcategory/', False),
+            'skus by location': ('/api/v1/get_skus_by_meta_data/?' + urlencode({'location': path['location']}),
+                                 False),
+            'skus by path': ('/api/v1/get_skus_by_meta_data/?' + urlencode(path), False),
+            'skus by location ndjson': ('/api/v1/get_skus_by_meta_data/?' + urlencode(
+                {'location': path['location'], 'format': 'ndjson'}), True),
+            'sku search': ('/api/v1/sku/search/?' + urlencode({'q': path['subcategory']}), False),
+            'sku search suggest': ('/api/v1/sku/search/suggest/?' + urlencode({'q': path['category'][:3]}), False),
+            'sku counts': ('/api/v1/sku/counts/?level=subcategory', False),
+            'tree': ('/api/v1/tree/', False),
+            'tree subtree': ('/api/v1/tree/location/{}/'.format(ids[0]), False),
+            'tree ancestors': ('/api/v1/tree/subcategory/{}/ancestors/'.format(ids[3]), False),
+            'async skus by location': ('/api/v1/async/get_skus_by_meta_data/?' + urlencode(
+                {'location': path['location']}), False),
+            'async locations': ('/api/v1/async/location/', False),
+            'async departments': ('/api/v1/async/departments/', False),
+            'metrics': ('/metrics', False),
+        }
+
+    def time_endpoints(self, samples):
+        """
+        Times every endpoint and the bulk writes, returns name -> statistics. The first request of an
+        endpoint is timed apart, later ones may be answered from the response cache. The in-process indexes are
+        built first, the requests would otherwise be answered without them while they build in the background.
+        """
+        wait_search_index()
+        if index_enabled():
+            wait_column_index()
+        client = Client(HTTP_HOST='localhost')
+        results = {}
+        for name, (url, streamed) in self.endpoints().items():
+            results[name] = measure(lambda: client.get(url),
+                                    max(1, samples // STREAMED_SAMPLES_DIVISOR) if streamed else samples)
+
+        row = SKUSearch.objects.order_by('sku').first()
+        items = [{'description': 'BENCH{}'.format(index), 'location': row.location_id,
+                  'department': row.department_id, 'category': row.category_id,
+                  'subcategory': row.subcategory_id} for index in range(100)]
+        created = []
+
+        def create():
+            response = client.post('/api/v1/bulk/sku/', json.dumps(items), content_type='application/json')
+            created.append([item['id'] for item in response.json()])
+            return response
+
+        def delete():
+            return client.delete('/api/v1/bulk/sku/', json.dumps(created.pop()), content_type='application/json')
+
+        results['bulk sku create 100'] = measure(create, samples)
+        results['bulk sku delete 100'] = measure(delete, samples)
+        return results
+
+    def report(self, run, baseline):
+        before = {}
+        if baseline:
+            before = next((previous for previous in baseline['runs'] if previous['skus'] == run['skus']), {})
+        for name, loader in run['loaders'].items():
+            line = '{:<28} {:>12.0f} rows/s'.format(name, loader['rows_per_second'])
+            if name in before.get('loaders', {}):
+                line += '  (baseline {:.0f} rows/s)'.format(before['loaders'][name]['rows_per_second'])
+            self.stdout.write(line)
+        for name, result in run['endpoints'].items():
+            line = '{:<28} first {:>9.2f} ms  median {:>9.2f} ms  p95 {:>9.2f} ms  {:>4} queries  {:>10} bytes'.format(
+                name, result['first_ms'], result['median_ms'], result['p95_ms'], result['queries'], result['bytes'])
+            if name in before.get('endpoints', {}):
+                previous = before['endpoints'][name]['median_ms']
+                line += '  ({:+.0%} vs baseline)'.format(result['median_ms'] / previous - 1 if previous else 0)
+            style = self.style.ERROR if result['status'] >= 400 else str
+            self.stdout.write(style(line))
+
+
+def measure(request, samples):
+    """
+    Sends the request samples + 1 times and returns its timings, the number of queries and the size of
+    the body of the first one.
+    """
+    queries = QueryCounter()
+    with connection.execute_wrapper(queries):
+        first, response, size = timed(request)
+    timings = sorted(timed(request)[0] for _ in range(samples))
+    return {
+        'status': response.status_code,
+        'queries': queries.count,
+        'bytes': size,
+        'first_ms': first,
+        'median_ms': statistics.median(timings),
+        'p95_ms': timings[min(int(len(timings) * 0.95), len(timings) - 1)],
+        'samples': samples,
+    }
+
+
+class QueryCounter:
+    """
+    Counts the queries run through a connection. The query log can not be used, every request clears it.
+    """
+
+    def __init__(self):
+        self.count = 0
+
+    def __call__(self, execute, sql, params, many, context):
+        self.count += 1
+        return execute(sql, params, many, context)
+
+
+def timed(request):
+    """
+    Returns the milliseconds taken by the request until its whole body was read, the response and body size.
+    """
+    started = time.perf_counter()
+    response = request()
+    size = sum(len(chunk) for chunk in response.streaming_content) if response.streaming else len(response.content)
+    return (time.perf_counter() - started) * 1000, response, size
+
+
+def flush():
+    """
+    Empties the tables of the sku app and the caches built from them, the validation rules are kept.
+    """
+    tables = [model._meta.db_table for model in apps.get_app_config('sku').get_models() if model is not ValidationRule]
+    connection.ops.execute_sql_flush(connection.ops.sql_flush(no_style(), tables, reset_sequences=True))
+    caches[CACHE_ALIAS].clear()
+    invalidate_hierarchy()
+    drop_search_index()
+    drop_column_index()
+
+
+def git_commit():
+    """
+    Returns the commit of the checkout, None outside of a git repository.
+    """
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=settings.BASE_DIR, capture_output=True,
+                              text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
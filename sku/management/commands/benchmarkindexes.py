@@ -0,0 +1,120 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from sku.loaders import MetaDataLoader, SKUBulkLoader
+from sku.management.commands.generatecatalog import parse_shape
+from sku.models import Department, Category, SubCategory, SKUDataMapping
+from sku.synthetic import meta_data_frame, sku_data_frames
+
+
+class Command(BaseCommand):
+    """
+    run command to compare the hierarchy indexes:= python manage.py benchmarkindexes --skus 10000000
+    Run it against a scratch database, it fills the sku tables with a synthetic catalog
+    and drops and re-creates the indexes while measuring.
+    """
+    help = 'Show query plans and latency of the hierarchy lookups with and without their indexes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--skus', type=int, default=10000000, help='Number of synthetic SKUs')
+        parser.add_argument('--shape', type=str, default='10x20x20x20',
+                            help='Locations x departments x categories x subcategories of the synthetic catalog')
+        parser.add_argument('--samples', type=int, default=200, help='Number of lookups timed per query')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--reuse', action='store_true', help='Benchmark the data already in the tables')
+
+    def handle(self, *args, **options):
+        if not options['reuse']:
+            if SKUDataMapping.objects.exists():
+                raise CommandError('The sku tables are not empty, use a scratch database or pass --reuse.')
+            self.generate(options)
+
+        queries = self.queries(options['samples'])
+        with connection.schema_editor() as editor:
+            self.drop_indexes(editor)
+        try:
+            before = self.measure(queries, 'without indexes')
+        finally:
+            with connection.schema_editor() as editor:
+                self.create_indexes(editor)
+        after = self.measure(queries, 'with indexes')
+
+        self.stdout.write('')
+        for name in before:
+            self.stdout.write('{:<22} median {:>9.3f} ms -> {:>9.3f} ms   p95 {:>9.3f} ms -> {:>9.3f} ms'.format(
+                name, before[name][0], after[name][0], before[name][1], after[name][1]))
+
+    def generate(self, options):
+        shape = parse_shape(options['shape'], options['skus'])
+        started = time.monotonic()
+        MetaDataLoader().load(meta_data_frame(shape))
+        loader = SKUBulkLoader(batch_size=options['batch_size'])
+        for data in sku_data_frames(shape, chunksize=options['batch_size'] * 10):
+            loader.load(data)
+        self.stdout.write('Generated {} SKUs in {:.0f}s ({:.0f} rows/sec)'.format(
+            loader.inserted, time.monotonic() - started, loader.rows_per_second))
+
+    def queries(self, samples):
+        """
+        Returns the benchmarked lookups as name -> list of querysets, built from random existing rows.
+        """
+        departments = list(Department.objects.order_by('?').values_list('location_id', 'name')[:samples])
+        categories = list(Category.objects.order_by('?').values_list('department_id', 'name')[:samples])
+        subcategories = list(SubCategory.objects.order_by('?').values_list('category_id', 'name')[:samples])
+        paths = list(SubCategory.objects.order_by('?').values_list(
+            'category__department__location_id', 'category__department_id', 'category_id', 'id')[:samples])
+        return {
+            'department by name': [Department.objects.filter(location_id=parent, name=name)
+                                   for parent, name in departments],
+            'category by name': [Category.objects.filter(department_id=parent, name=name)
+                                 for parent, name in categories],
+            'subcategory by name': [SubCategory.objects.filter(category_id=parent, name=name)
+                                    for parent, name in subcategories],
+            'skus by hierarchy': [SKUDataMapping.objects.filter(location_id=loc, department_id=dpt, category_id=cat,
+                                                                subcategory_id=sub).values_list('sku')[:1000]
+                                  for loc, dpt, cat, sub in paths],
+            'skus by department': [SKUDataMapping.objects.filter(location_id=loc, department_id=dpt)
+                                   .values_list('sku')[:1000] for loc, dpt, _, _ in paths],
+        }
+
+    def measure(self, queries, label):
+        """
+        Prints the plan of the first lookup of every query and returns name -> (median ms, p95 ms).
+        """
+        self.stdout.write(self.style.MIGRATE_HEADING('Query plans {}'.format(label)))
+        results = {}
+        for name, querysets in queries.items():
+            if not querysets:
+                continue
+            self.stdout.write(self.style.MIGRATE_LABEL(name))
+            self.stdout.write(querysets[0].explain())
+            timings = []
+            for queryset in querysets:
+                started = time.perf_counter()
+                list(queryset.all())
+                timings.append((time.perf_counter() - started) * 1000)
+            timings.sort()
+            results[name] = (statistics.median(timings), timings[int(len(timings) * 0.95)])
+        return results
+
+    def drop_indexes(self, editor):
+        for model in (Department, Category, SubCategory):
+            constraints = model._meta.constraints
+            # SQLite drops a constraint by rebuilding the table from the model, which must not list it then.
+            model._meta.constraints = []
+            try:
+                for constraint in constraints:
+                    editor.remove_constraint(model, constraint)
+            finally:
+                model._meta.constraints = constraints
+        for index in SKUDataMapping._meta.indexes:
+            editor.remove_index(SKUDataMapping, index)
+
+    def create_indexes(self, editor):
+        for model in (Department, Category, SubCategory):
+            for constraint in model._meta.constraints:
+                editor.add_constraint(model, constraint)
+        for index in SKUDataMapping._meta.indexes:
+            editor.add_index(SKUDataMapping, index)
@@ -0,0 +1,72 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from rest_framework.renderers import JSONRenderer
+from sku.models import Location, Department, Category, SubCategory
+from sku.renderers import FastJSONRenderer, orjson
+from sku.serializers import DepartmentSerializer, CategorySerializer, SubCategorySerializer, department_values, \
+    category_values, subcategory_values
+
+
+class Command(BaseCommand):
+    """
+    run command to compare the list serializers:= python manage.py benchmarkserializers --rows 100000
+    Times the ModelSerializer and JSONRenderer of the department, category and subcategory lists against
+    their values_list serializers and FastJSONRenderer, on rows built in memory, and checks that both give
+    the same bytes. No database is needed.
+    """
+    help = 'Time the read serializers and JSON renderers of the hierarchy lists'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--rows', type=int, default=100000, help='Number of rows serialized per list')
+        parser.add_argument('--repeat', type=int, default=5, help='Number of timed runs, the median is reported')
+
+    def handle(self, *args, **options):
+        if options['rows'] < 1 or options['repeat'] < 1:
+            raise CommandError('--rows and --repeat must be positive.')
+        self.stdout.write('orjson {}'.format(orjson.__version__ if orjson else 'not installed, using the json module'))
+        for name, serializer_class, values, instances, rows in self.lists(options['rows']):
+            old = self.measure(options['repeat'], lambda: serializer_class(instances, many=True).data, JSONRenderer())
+            new = self.measure(options['repeat'], lambda: values.serialize(rows), FastJSONRenderer())
+            if old[2] != new[2]:
+                raise CommandError('The {} serializers do not render the same bytes.'.format(name))
+            self.stdout.write(
+                '{:<14} serializer {:>8.1f} ms -> {:>7.1f} ms   render {:>7.1f} ms -> {:>7.1f} ms   '
+                'total {:>5.1f}x faster, {} bytes'.format(name, old[0], new[0], old[1], new[1],
+                                                          (old[0] + old[1]) / (new[0] + new[1]), len(new[2])))
+
+    def lists(self, count):
+        """
+        Returns (name, serializer class, values serializer, model instances, values_list rows) of every list.
+        """
+        location = Location(id=1, name='Perimeter')
+        departments = [Department(id=pk, name='Department {}'.format(pk), location=location)
+                       for pk in range(1, count + 1)]
+        categories = [Category(id=pk, name='Category{}'.format(pk), department=departments[pk % len(departments)])
+                      for pk in range(1, count + 1)]
+        subcategories = [SubCategory(id=pk, name='Subcategory {}'.format(pk), category=categories[pk // 2])
+                         for pk in range(1, count + 1)]
+        return [
+            ('departments', DepartmentSerializer, department_values, departments,
+             [(obj.id, obj.name, obj.location_id) for obj in departments]),
+            ('categories', CategorySerializer, category_values, categories,
+             [(obj.id, obj.name, obj.department_id, obj.department.name) for obj in categories]),
+            ('subcategories', SubCategorySerializer, subcategory_values, subcategories,
+             [(obj.id, obj.name, obj.category_id) for obj in subcategories]),
+        ]
+
+    def measure(self, repeat, serialize, renderer):
+        """
+        Returns the median milliseconds of serializing and of rendering, and the rendered bytes.
+        """
+        serialize_ms = []
+        render_ms = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            data = serialize()
+            serialized = time.perf_counter()
+            content = renderer.render(data)
+            serialize_ms.append((serialized - started) * 1000)
+            render_ms.append((time.perf_counter() - serialized) * 1000)
+        return statistics.median(serialize_ms), statistics.median(render_ms), content
@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sku.catalog import dump_catalog
+
+
+class Command(BaseCommand):
+    """
+    run command to write the catalog snapshot:= python manage.py dumpcatalog
+    It is written to SKU_CATALOG_SNAPSHOT, or to the given file. Workers started later map it instead of reading
+    the hierarchy and the SKUs from the database, then catch up with the changes logged since it was written.
+    """
+    help = 'Write the locations, departments, categories, subcategories and SKUs to a catalog snapshot'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filepath', type=str, nargs='?', default=None,
+                            help='Snapshot file, SKU_CATALOG_SNAPSHOT by default')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Number of SKUs read per query')
+
+    def handle(self, *args, **options):
+        filepath = options['filepath'] or getattr(settings, 'SKU_CATALOG_SNAPSHOT', None)
+        if not filepath:
+            raise CommandError('Give the snapshot file or set SKU_CATALOG_SNAPSHOT.')
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        started = time.monotonic()
+        meta = dump_catalog(filepath, options['chunk_size'])
+        self.stdout.write(self.style.SUCCESS(
+            'Wrote {location} locations, {department} departments, {category} categories, {subcategory} subcategories '
+            'and {skus} SKUs to {filepath} in {elapsed:.1f}s'.format(
+                filepath=filepath, elapsed=time.monotonic() - started, **meta)))
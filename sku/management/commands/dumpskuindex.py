@@ -0,0 +1,29 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sku.column_index import ColumnIndex
+
+
+class Command(BaseCommand):
+    """
+    run command to write the column index snapshot:= python manage.py dumpskuindex
+    It is written to SKU_COLUMN_INDEX_SNAPSHOT, or to the given file. Workers started later map it and only
+    apply the SKUs written since from the change log, run it again when they lag too far behind.
+    """
+    help = 'Write a snapshot of the columnar SKU index for the workers to memory-map'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filepath', type=str, nargs='?', default=None,
+                            help='Snapshot file, SKU_COLUMN_INDEX_SNAPSHOT by default')
+        parser.add_argument('--chunk-size', type=int, default=100000, help='Number of SKUs read per query')
+
+    def handle(self, *args, **options):
+        filepath = options['filepath'] or getattr(settings, 'SKU_COLUMN_INDEX_SNAPSHOT', None)
+        if not filepath:
+            raise CommandError('Give the snapshot file or set SKU_COLUMN_INDEX_SNAPSHOT.')
+        started = time.monotonic()
+        index = ColumnIndex.from_db(options['chunk_size'])
+        index.save(filepath)
+        self.stdout.write(self.style.SUCCESS('Wrote {} SKUs up to change {} to {} in {:.1f}s'.format(
+            len(index), index.last_change, filepath, time.monotonic() - started)))
@@ -0,0 +1,55 @@
+import sys
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from sku.export import EXPORT_FORMATS, catalog_chunks, catalog_queryset, export_catalog, export_format
+from sku.hierarchy import LEVELS
+
+
+class Command(BaseCommand):
+    """
+    run command to export the SKUs:= python manage.py exportskudata exports\sku_data.parquet
+    The format follows the extension, .txt or .csv for the sku_data.txt layout, .ndjson or .parquet, or is given
+    with --format. The files are read back by loadskudata, with --incremental to keep the SKU numbers and names.
+    Only the SKUs below some nodes are exported with --location, --department, --category and --subcategory.
+    """
+    help = 'Export the SKUs in the sku_data.txt layout as CSV, NDJSON or Parquet'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filepath', type=str, help='Output file, - for the standard output')
+        parser.add_argument('--format', choices=list(EXPORT_FORMATS), default=None,
+                            help='Output format, by default the one of the file extension')
+        parser.add_argument('--chunk-size', type=int, default=10000,
+                            help='Number of SKUs read per database round trip and written per Parquet row group')
+        for level in LEVELS:
+            parser.add_argument('--{}'.format(level), type=str, help='Only export the SKUs of this {}'.format(level))
+
+    def handle(self, *args, **options):
+        if options['chunk_size'] < 1:
+            raise CommandError('--chunk-size must be positive.')
+        filepath = options['filepath']
+        format = options['format'] or export_format(filepath)
+        self.exported = 0
+        chunks = self.count(catalog_chunks(catalog_queryset(options), options['chunk_size']))
+        try:
+            content = export_catalog(format, chunks=chunks)
+        except ImportError as ex:
+            raise CommandError(str(ex))
+
+        started = time.monotonic()
+        output = sys.stdout.buffer if filepath == '-' else open(filepath, 'wb')
+        try:
+            for chunk in content:
+                output.write(chunk)
+        finally:
+            if output is not sys.stdout.buffer:
+                output.close()
+        if filepath != '-':
+            elapsed = time.monotonic() - started
+            self.stdout.write(self.style.SUCCESS('Exported {} SKUs to {} in {:.1f}s ({:.0f} rows/sec)'.format(
+                self.exported, filepath, elapsed, self.exported / elapsed if elapsed else 0.0)))
+
+    def count(self, chunks):
+        for chunk in chunks:
+            self.exported += len(chunk)
+            yield chunk
@@ -0,0 +1,56 @@
+import os
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from sku.synthetic import SKU_COLUMNS, CatalogShape, meta_data_frame, sku_data_frames
+
+
+def parse_shape(value, skus):
+    """
+    Returns the CatalogShape of a locations x departments x categories x subcategories string.
+    """
+    try:
+        return CatalogShape(*(int(size) for size in value.split('x')), skus=skus)
+    except (TypeError, ValueError):
+        raise CommandError('--shape must look like 10x20x20x20')
+
+
+def write_catalog(shape, directory, chunksize=100000, seed=0):
+    """
+    Writes the meta_data.csv and sku_data.txt files of the shape into the directory and returns their paths.
+    """
+    os.makedirs(directory, exist_ok=True)
+    meta_path = os.path.join(directory, 'meta_data.csv')
+    sku_path = os.path.join(directory, 'sku_data.txt')
+    meta_data_frame(shape).to_csv(meta_path, index=False)
+    with open(sku_path, 'w', newline='') as output:
+        output.write(','.join(SKU_COLUMNS) + '\n')
+        for data in sku_data_frames(shape, chunksize, seed):
+            data.to_csv(output, header=False, index=False)
+    return meta_path, sku_path
+
+
+class Command(BaseCommand):
+    """
+    run command to write a synthetic catalog:= python manage.py generatecatalog catalogs/1m --skus 1000000
+    The directory receives meta_data.csv and sku_data.txt, ready for importdata and loadskudata.
+    The same shape, size and seed always give the same files.
+    """
+    help = 'Generate a synthetic catalog in the meta_data.csv and sku_data.txt layouts'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', type=str)
+        parser.add_argument('--skus', type=int, default=10000, help='Number of SKUs')
+        parser.add_argument('--shape', type=str, default='10x20x20x20',
+                            help='Locations x departments x categories x subcategories')
+        parser.add_argument('--seed', type=int, default=0, help='Seed of the SKU placement')
+        parser.add_argument('--chunksize', type=int, default=100000, help='Number of SKUs generated at a time')
+
+    def handle(self, *args, **options):
+        if options['skus'] < 0 or options['chunksize'] < 1:
+            raise CommandError('--skus must not be negative and --chunksize must be positive.')
+        shape = parse_shape(options['shape'], options['skus'])
+        started = time.monotonic()
+        meta_path, sku_path = write_catalog(shape, options['directory'], options['chunksize'], options['seed'])
+        self.stdout.write(self.style.SUCCESS('Wrote {} hierarchy paths to {} and {} SKUs to {} in {:.1f}s'.format(
+            shape.leaves, meta_path, shape.skus, sku_path, time.monotonic() - started)))
@@ -1,6 +1,7 @@
-from django.core.management.base import BaseCommand
-import pandas as pd
-from sku.models import Location, Department, Category, SubCategory, SKUDataMapping
+from django.core.management.base import BaseCommand, CommandError
+from sku.loaders import (PARSE_ERRORS, ImportStateTracker, MetaDataLoader, parse_error_message, read_chunks,
+                         prefetch)
+from sku.validation import ChunkValidator, quarantine_path
 
 
 class Command(BaseCommand):
@@ -11,17 +12,46 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('filepath', type=str)
+        parser.add_argument('--chunksize', type=int, default=None,
+                            help='Stream the file in chunks of this many rows instead of reading it at once')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only resolve rows that are new since the last incremental run and delete the '
+                                 'subcategories missing from the input that no SKU references')
+        parser.add_argument('--delete-skus', action='store_true',
+                            help='With --incremental also delete the subcategories missing from the input that SKUs '
+                                 'reference, together with their SKUs')
+        parser.add_argument('--quarantine', type=str, default=None,
+                            help='CSV file receiving the rejected rows, <file>.quarantine.csv next to the input '
+                                 'by default')
 
     def handle(self, *args, **options):
         filepath = options['filepath']
         try:
-            data = pd.read_csv(filepath)
-            for index, row in data.iterrows():
-                location, created = Location.objects.get_or_create(name=row['Location'])
-                department, created = Department.objects.get_or_create(name=row['Department'], location=location)
-                category, created = Category.objects.get_or_create(name=row['Category'], department=department)
-                subcategory, created = SubCategory.objects.get_or_create(name=row['SubCategory'], category=category)
-                #SKUDataMapping.objects.create(description=row['NAME'], location=location, department=department, category=category, subcategory=subcategory)
+            tracker = ImportStateTracker('importdata') if options['incremental'] else None
+            validator = ChunkValidator.for_meta_data(options['quarantine'] or quarantine_path(filepath))
+            loader = MetaDataLoader(tracker=tracker, validator=validator, delete_skus=options['delete_skus'])
+            try:
+                for data in prefetch(read_chunks(filepath, options['chunksize'])):
+                    loader.load(data)
+            except PARSE_ERRORS as ex:
+                # Only a complete input tells which subcategories disappeared, finish is not run.
+                raise CommandError('{}: {}. {} rows were loaded before it, no subcategory is deleted'.format(
+                    filepath, parse_error_message(filepath, ex), loader.loaded))
+            loader.finish()
+            if loader.skipped:
+                self.stdout.write(self.style.WARNING('{} rows skipped'.format(loader.skipped)))
+            if validator.written:
+                self.stdout.write(self.style.WARNING('Rejected rows written to {}'.format(validator.quarantine)))
+            if tracker:
+                self.stdout.write('{} rows loaded, {} unchanged, {} subcategories deleted with {} SKUs'.format(
+                    loader.loaded, loader.unchanged, loader.deleted, loader.deleted_skus))
+                if not tracker.complete:
+                    self.stdout.write(self.style.WARNING(
+                        'No subcategory deleted because rows were rejected for missing columns'))
+            if loader.kept:
+                self.stdout.write(self.style.WARNING(
+                    '{} subcategories missing from the input kept, {} SKUs reference them, use --delete-skus to '
+                    'delete them with their SKUs'.format(loader.kept, loader.kept_skus)))
             self.stdout.write(self.style.SUCCESS('Data imported successfully'))
         except FileNotFoundError:
             self.stdout.write(self.style.ERROR('File not found'))
@@ -1,31 +1,101 @@
-from django.core.management.base import BaseCommand
-import pandas as pd
-from sku.models import Location, Department, Category, SubCategory, SKUDataMapping
+import glob
+
+from django.core.management.base import BaseCommand, CommandError
+from sku.loaders import HierarchyResolver, ImportStateTracker, SKUBulkLoader, load_files_parallel
 
 
 class Command(BaseCommand):
     """
     run command to load the: data:= python manage.py loadskudata sku\sku_data.txt
+    several files or glob patterns can be loaded in parallel:= python manage.py loadskudata "feeds/*.txt" --workers 8
     """
     help = 'Import data from text file and insert into Django models'
 
     def add_arguments(self, parser):
-        parser.add_argument('filepath', type=str)
+        parser.add_argument('filepath', type=str, nargs='+', help='Files or glob patterns to load')
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Number of SKUs inserted per bulk_create and transaction')
+        parser.add_argument('--chunksize', type=int, default=None,
+                            help='Stream the file in chunks of this many rows instead of reading it at once')
+        parser.add_argument('--workers', type=int, default=1,
+                            help='Number of worker processes, each loading whole files over its own connection')
+        parser.add_argument('--incremental', action='store_true',
+                            help='Only upsert rows that are new or changed since the last incremental run, keyed by '
+                                 'the SKU column, and delete SKUs missing from the input')
+        parser.add_argument('--quarantine-dir', type=str, default=None,
+                            help='Directory of the <file>.quarantine.csv files receiving the rejected rows, '
+                                 'next to every input file by default')
+
+    def expand(self, patterns):
+        """
+        Expands glob patterns, patterns without a match are kept so they are reported as not found.
+        """
+        filepaths = []
+        for pattern in patterns:
+            filepaths.extend(sorted(glob.glob(pattern)) or [pattern])
+        return filepaths
+
+    def load_serial(self, filepaths, batch_size, chunksize, quarantine_dir=None, tracker=None):
+        resolver = HierarchyResolver()
+        complete = True
+        for filepath in filepaths:
+            try:
+                summary = SKUBulkLoader(batch_size, resolver, tracker).load_file(filepath, chunksize, quarantine_dir)
+            except FileNotFoundError:
+                summary = {'file': filepath, 'inserted': 0, 'skipped': 0, 'errored': 0, 'unchanged': 0,
+                           'errors': ['File not found'], 'parse_error': None, 'rows_per_second': 0.0,
+                           'quarantine': None}
+            complete = complete and not summary['errors']
+            yield summary
+
+        if tracker:
+            # Only a complete run tells which SKUs disappeared from the feed.
+            if complete:
+                loader = SKUBulkLoader(batch_size, resolver, tracker)
+                loader.finish()
+                self.stdout.write('{} SKUs deleted'.format(loader.deleted))
+                if not tracker.complete:
+                    self.stdout.write(self.style.WARNING(
+                        'Deletes not applied because rows without a readable SKU were rejected'))
+            else:
+                self.stdout.write(self.style.WARNING('Deletes not applied because the import had errors'))
 
     def handle(self, *args, **options):
-        filepath = options['filepath']
-        try:
-            data = pd.read_csv(filepath)
-            for index, row in data.iterrows():
-                try:
-                    location, created = Location.objects.get_or_create(name=row['LOCATION'])
-                    department, created = Department.objects.get_or_create(name=row['DEPARTMENT'], location=location)
-                    category, created = Category.objects.get_or_create(name=row['CATEGORY'], department=department)
-                    subcategory, created = SubCategory.objects.get_or_create(name=row['SUBCATEGORY'], category=category)
-                    sku_name = "SKUDESC{}".format(index+1)
-                    SKUDataMapping.objects.create(description=sku_name, location=location, department=department, category=category, subcategory=subcategory)
-                except Exception as ex:
-                    self.stdout.write(self.style.ERROR(ex))
-            self.stdout.write(self.style.SUCCESS('SKU Data imported successfully'))
-        except FileNotFoundError:
-            self.stdout.write(self.style.ERROR('File not found'))
+        filepaths = self.expand(options['filepath'])
+        if options['incremental']:
+            if options['workers'] > 1:
+                raise CommandError('--incremental can not be combined with --workers')
+            tracker = ImportStateTracker('loadskudata', options['batch_size'])
+            summaries = self.load_serial(filepaths, options['batch_size'], options['chunksize'],
+                                         options['quarantine_dir'], tracker)
+        elif options['workers'] > 1 and len(filepaths) > 1:
+            summaries = load_files_parallel(filepaths, options['workers'], options['batch_size'], options['chunksize'],
+                                            options['quarantine_dir'])
+        else:
+            summaries = self.load_serial(filepaths, options['batch_size'], options['chunksize'],
+                                         options['quarantine_dir'])
+
+        totals = dict.fromkeys(('inserted', 'skipped', 'errored'), 0)
+        unparsed = []
+        for summary in summaries:
+            for error in summary['errors']:
+                self.stdout.write(self.style.ERROR('{}: {}'.format(summary['file'], error)))
+            self.stdout.write('{file}: {inserted} inserted, {skipped} skipped, {errored} errored '
+                              '({rows_per_second:.0f} rows/sec)'.format(**summary))
+            if summary['quarantine']:
+                self.stdout.write(self.style.WARNING('{file}: rejected rows written to {quarantine}'.format(**summary)))
+            if options['incremental']:
+                self.stdout.write('{file}: {unchanged} unchanged'.format(**summary))
+            for key in totals:
+                totals[key] += summary[key]
+            if summary['parse_error']:
+                unparsed.append(summary['file'])
+        if unparsed:
+            raise CommandError('Could not parse {}, the rows before the error are loaded ({inserted} inserted, {skipped} '
+                               'skipped, {errored} errored in all), fix it and load it again'.format(
+                                   ', '.join(unparsed), **totals))
+        if totals['errored']:
+            raise CommandError('SKU Data import failed: {inserted} inserted, {skipped} skipped, {errored} errored, '
+                               'see the errors above'.format(**totals))
+        self.stdout.write(self.style.SUCCESS(
+            'SKU Data imported successfully: {inserted} inserted, {skipped} skipped, {errored} errored'.format(**totals)))
@@ -0,0 +1,169 @@
+import asyncio
+import json
+import statistics
+import time
+from urllib.parse import urlsplit
+
+from django.core.management.base import BaseCommand, CommandError
+
+try:
+    import resource
+except ImportError:  # Windows
+    resource = None
+
+
+class Command(BaseCommand):
+    """
+    run command to compare the WSGI and ASGI read paths:=
+        python manage.py loadtest http://localhost:8000/api/v1/get_skus_by_meta_data/?location=Perimeter
+                                  http://localhost:8001/api/v1/async/get_skus_by_meta_data/?location=Perimeter
+    Start the servers first, e.g. gunicorn inmar.wsgi --bind :8000 --threads 32 and
+    uvicorn inmar.asgi:application --port 8001. Every url is loaded by the same number of
+    concurrent clients, each one sending its requests one after the other on a keep-alive connection.
+    """
+    help = 'Measure throughput and latency of read endpoints under many concurrent clients'
+
+    def add_arguments(self, parser):
+        parser.add_argument('url', nargs='+', type=str, help='Urls to load, one after the other')
+        parser.add_argument('--clients', type=int, default=1000, help='Number of concurrent clients')
+        parser.add_argument('--requests', type=int, default=20000, help='Number of requests sent to every url')
+        parser.add_argument('--timeout', type=float, default=30, help='Seconds before a request counts as failed')
+        parser.add_argument('--output', type=str, help='Write the results to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['clients'] < 1 or options['requests'] < 1:
+            raise CommandError('--clients and --requests must be positive.')
+        raise_open_files_limit(options['clients'] + 100)
+
+        results = []
+        for url in options['url']:
+            if urlsplit(url).scheme != 'http':
+                raise CommandError('Only http urls are supported: {}'.format(url))
+            result = asyncio.run(run(url, options['clients'], options['requests'], options['timeout']))
+            results.append(result)
+            self.stdout.write(
+                '{url}\n  {requests} requests, {errors} errors in {seconds:.1f}s: {rps:.0f} req/s, '
+                'peak {concurrency} in flight\n  latency ms p50 {p50:.1f}  p95 {p95:.1f}  p99 {p99:.1f}  '
+                'max {max:.1f}'.format(**result))
+
+        if options['output']:
+            with open(options['output'], 'w') as output:
+                json.dump(results, output, indent=2)
+
+
+def raise_open_files_limit(needed):
+    """
+    Every client holds one socket, raise the soft limit of open files up to the hard limit when needed.
+    """
+    if resource is None:
+        return
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (needed if hard == resource.RLIM_INFINITY else min(needed, hard),
+                                                    hard))
+
+
+class Connection:
+    """
+    Minimal keep-alive HTTP/1.1 client, enough to send GET requests and read
+    Content-Length, chunked and close-delimited responses.
+    """
+
+    def __init__(self, url):
+        parts = urlsplit(url)
+        self.host = parts.hostname
+        self.port = parts.port or 80
+        self.target = (parts.path or '/') + ('?' + parts.query if parts.query else '')
+        self.request = 'GET {} HTTP/1.1\r\nHost: {}\r\nAccept: application/json\r\n\r\n'.format(
+            self.target, parts.netloc).encode()
+        self.reader = self.writer = None
+
+    async def get(self):
+        """
+        Sends the request and returns the status code, once the whole body was read.
+        """
+        if self.writer is None:
+            self.reader, self.writer = await asyncio.open_connection(self.host, self.port)
+        self.writer.write(self.request)
+        await self.writer.drain()
+
+        status = int((await self.reader.readline()).split()[1])
+        headers = {}
+        while True:
+            line = await self.reader.readline()
+            if line in (b'\r\n', b''):
+                break
+            name, _, value = line.decode('latin-1').partition(':')
+            headers[name.strip().lower()] = value.strip().lower()
+
+        if 'content-length' in headers:
+            await self.reader.readexactly(int(headers['content-length']))
+        elif headers.get('transfer-encoding') == 'chunked':
+            while True:
+                size = int((await self.reader.readline()).split(b';')[0], 16)
+                await self.reader.readexactly(size + 2)
+                if not size:
+                    break
+        else:
+            await self.reader.read()
+            self.close()
+        if headers.get('connection') == 'close':
+            self.close()
+        return status
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+async def run(url, clients, requests, timeout):
+    """
+    Sends `requests` GET requests to the url from `clients` concurrent clients and returns the statistics.
+    """
+    remaining = requests
+    in_flight = peak = errors = 0
+    latencies = []
+
+    async def client():
+        nonlocal remaining, in_flight, peak, errors
+        connection = Connection(url)
+        while remaining > 0:
+            remaining -= 1
+            in_flight += 1
+            peak = max(peak, in_flight)
+            started = time.perf_counter()
+            try:
+                status = await asyncio.wait_for(connection.get(), timeout)
+            except (OSError, ValueError, IndexError, asyncio.IncompleteReadError, asyncio.TimeoutError):
+                status = None
+                connection.close()
+            in_flight -= 1
+            if status == 200:
+                latencies.append((time.perf_counter() - started) * 1000)
+            else:
+                errors += 1
+        connection.close()
+
+    started = time.perf_counter()
+    await asyncio.gather(*(client() for _ in range(min(clients, requests))))
+    seconds = time.perf_counter() - started
+
+    latencies.sort()
+
+    def percentile(fraction):
+        return latencies[min(int(len(latencies) * fraction), len(latencies) - 1)] if latencies else 0.0
+
+    return {
+        'url': url,
+        'clients': clients,
+        'requests': requests,
+        'errors': errors,
+        'seconds': seconds,
+        'rps': len(latencies) / seconds,
+        'concurrency': peak,
+        'p50': statistics.median(latencies) if latencies else 0.0,
+        'p95': percentile(0.95),
+        'p99': percentile(0.99),
+        'max': latencies[-1] if latencies else 0.0,
+    }
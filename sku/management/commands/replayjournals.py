@@ -0,0 +1,31 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import DatabaseError
+from sku.write_behind import fcntl, replay_journals
+
+
+class Command(BaseCommand):
+    """
+    run command to replay the write-behind journals:= python manage.py replayjournals
+    Writes the SKUs queued by stopped processes that were not written to the database yet. Servers replay
+    them when they start, the command is for servers that are not restarted, or for platforms without file
+    locks, where it must only run while the server is stopped.
+    """
+    help = 'Write the SKUs left in the write-behind journals of stopped processes to the database'
+
+    def add_arguments(self, parser):
+        parser.add_argument('directory', type=str, nargs='?', default=None,
+                            help='Journal directory, SKU_WRITE_BEHIND_DIR by default')
+        parser.add_argument('--batch-size', type=int, default=1000, help='Number of SKUs written per transaction')
+
+    def handle(self, *args, **options):
+        directory = options['directory'] or getattr(settings, 'SKU_WRITE_BEHIND_DIR', None)
+        if not directory:
+            raise CommandError('Give the journal directory or set SKU_WRITE_BEHIND_DIR.')
+        if fcntl is None:
+            self.stdout.write(self.style.WARNING('No file locks on this platform, the server must be stopped.'))
+        try:
+            replayed = replay_journals(directory, options['batch_size'])
+        except DatabaseError as ex:
+            raise CommandError('Replaying the journals failed, they are kept: {}'.format(ex))
+        self.stdout.write(self.style.SUCCESS('Replayed {} SKU writes from {}'.format(replayed, directory)))
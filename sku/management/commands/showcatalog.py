@@ -0,0 +1,38 @@
+import datetime
+import os
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from sku.models import SKUSearchChange, HierarchyChange
+from sku.snapshot import CatalogSnapshot, SnapshotError
+
+
+class Command(BaseCommand):
+    """
+    run command to describe the catalog snapshot:= python manage.py showcatalog
+    Prints what the snapshot holds and how many changes were logged since it was written, the workers mapping
+    it catch up with them. Write a new snapshot with dumpcatalog when they grow.
+    """
+    help = 'Describe a catalog snapshot and how far the database moved since it was written'
+
+    def add_arguments(self, parser):
+        parser.add_argument('filepath', type=str, nargs='?', default=None,
+                            help='Snapshot file, SKU_CATALOG_SNAPSHOT by default')
+
+    def handle(self, *args, **options):
+        filepath = options['filepath'] or getattr(settings, 'SKU_CATALOG_SNAPSHOT', None)
+        if not filepath:
+            raise CommandError('Give the snapshot file or set SKU_CATALOG_SNAPSHOT.')
+        try:
+            catalog = CatalogSnapshot(filepath)
+        except (OSError, SnapshotError) as ex:
+            raise CommandError(str(ex))
+        meta = catalog.meta
+        self.stdout.write('{} ({:.1f} MB), written {}'.format(
+            filepath, os.path.getsize(filepath) / 2 ** 20,
+            datetime.datetime.fromtimestamp(meta['written_at']).isoformat(sep=' ', timespec='seconds')))
+        self.stdout.write('{location} locations, {department} departments, {category} categories, '
+                          '{subcategory} subcategories, {skus} SKUs, {strings} strings'.format(**meta))
+        self.stdout.write('SKU changes since: {}, hierarchy changes since: {}'.format(
+            SKUSearchChange.objects.filter(id__gt=meta['last_change']).count(),
+            HierarchyChange.objects.filter(id__gt=meta['last_hierarchy_change']).count()))
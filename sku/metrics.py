@@ -0,0 +1,290 @@
+"""
+Request instrumentation: the number and duration of the SQL queries, the render time and the size of the
+responses of every route, aggregated per process into histograms served at /metrics in the Prometheus
+text format. Requests are sampled, the others are only counted, and a request repeating the same
+query shape many times is reported as a likely N+1.
+"""
+import logging
+import random
+import re
+import threading
+import time
+from bisect import bisect_left
+from collections import Counter
+from contextvars import ContextVar
+
+from asgiref.sync import iscoroutinefunction, markcoroutinefunction
+from django.conf import settings
+from django.db.backends.signals import connection_created
+from django.dispatch import receiver
+from django.http import Http404, HttpResponse
+
+logger = logging.getLogger(__name__)
+
+SECONDS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# name -> (help, bucket upper bounds) of the histograms observed for every sampled request.
+HISTOGRAMS = {
+    'sku_request_duration_seconds': ('Time spent in the view and the middleware below, rendering included', SECONDS),
+    'sku_db_queries': ('SQL queries run by a request', (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000)),
+    'sku_db_duration_seconds': ('Time spent running the SQL queries of a request', SECONDS),
+    'sku_render_duration_seconds': ('Time spent rendering the response data', SECONDS),
+    'sku_response_bytes': ('Size of the response body', (256, 1024, 4096, 16384, 65536, 262144, 1048576,
+                                                          4194304, 16777216, 67108864)),
+}
+
+COUNTERS = {
+    'sku_requests_total': 'Requests served, sampled or not',
+    'sku_n_plus_one_total': 'Sampled requests repeating one query shape at least SKU_METRICS_N_PLUS_ONE times',
+}
+
+PLACEHOLDERS = re.compile(r'%s(?:\s*,\s*%s)+')
+NUMBERS = re.compile(r'\b\d+\b')
+
+
+def query_shape(sql):
+    """
+    Returns the SQL with its IN lists of placeholders and its literal numbers collapsed, so the queries
+    differing only by their parameters have the same shape.
+    """
+    return NUMBERS.sub('N', PLACEHOLDERS.sub('%s, ...', sql))
+
+
+class Histogram:
+    def __init__(self, bounds):
+        self.bounds = bounds
+        # One count per bucket, the last one above every bound, made cumulative on export.
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0
+        self.count = 0
+
+    def observe(self, value):
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+def label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Registry:
+    """
+    Histograms and counters of this process by metric and labels.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.histograms = {}
+        self.counters = {}
+
+    def increment(self, name, labels, amount=1):
+        with self.lock:
+            self.counters[name, labels] = self.counters.get((name, labels), 0) + amount
+
+    def observe(self, name, labels, value):
+        with self.lock:
+            histogram = self.histograms.get((name, labels))
+            if histogram is None:
+                histogram = self.histograms[name, labels] = Histogram(HISTOGRAMS[name][1])
+            histogram.observe(value)
+
+    def export(self):
+        """
+        Returns the metrics in the Prometheus text exposition format.
+        """
+        with self.lock:
+            counters = sorted(self.counters.items())
+            histograms = sorted((key, (list(h.counts), h.sum, h.count)) for key, h in self.histograms.items())
+        lines = []
+        for name, description in COUNTERS.items():
+            lines += ['# HELP {} {}'.format(name, description), '# TYPE {} counter'.format(name)]
+            lines += ['{}{{{}}} {}'.format(name, format_labels(labels), value)
+                      for (metric, labels), value in counters if metric == name]
+        for name, (description, bounds) in HISTOGRAMS.items():
+            lines += ['# HELP {} {}'.format(name, description), '# TYPE {} histogram'.format(name)]
+            for (metric, labels), (counts, total, count) in histograms:
+                if metric != name:
+                    continue
+                cumulative = 0
+                for bound, bucket in zip(bounds + ('+Inf',), counts):
+                    cumulative += bucket
+                    lines.append('{}_bucket{{{},le="{}"}} {}'.format(name, format_labels(labels), bound, cumulative))
+                lines.append('{}_sum{{{}}} {}'.format(name, format_labels(labels), total))
+                lines.append('{}_count{{{}}} {}'.format(name, format_labels(labels), count))
+        return '\n'.join(lines) + '\n'
+
+
+def format_labels(labels):
+    return ','.join('{}="{}"'.format(key, label(value)) for key, value in labels)
+
+
+registry = Registry()
+
+
+class RequestMetrics:
+    """
+    Measures one sampled request, it wraps the execution of its queries.
+    """
+    __slots__ = ('queries', 'db_seconds', 'statements', 'render_started', 'render_seconds')
+
+    def __init__(self):
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.statements = Counter()
+        self.render_started = None
+        self.render_seconds = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.db_seconds += time.perf_counter() - started
+            self.queries += 1
+            self.statements[sql] += 1
+
+    def repeated(self):
+        """
+        Returns the most repeated query shape and its number of runs.
+        """
+        shapes = Counter()
+        for sql, count in self.statements.items():
+            shapes[query_shape(sql)] += count
+        return shapes.most_common(1)[0] if shapes else (None, 0)
+
+
+# Metrics of the request being served, None when it is not sampled. Context variables follow the
+# request into the threads of sync_to_async.
+_current = ContextVar('sku_request_metrics', default=None)
+
+
+def execute_wrapper(execute, sql, params, many, context):
+    metrics = _current.get()
+    if metrics is None:
+        return execute(sql, params, many, context)
+    return metrics(execute, sql, params, many, context)
+
+
+@receiver(connection_created)
+def install_execute_wrapper(sender, connection, **kwargs):
+    """
+    Times the queries of every connection, unsampled requests only pay a context variable lookup.
+    """
+    if execute_wrapper not in connection.execute_wrappers:
+        connection.execute_wrappers.append(execute_wrapper)
+
+
+def route(request):
+    """
+    Returns the route pattern that served the request, bounded labels unlike the paths.
+    """
+    match = getattr(request, 'resolver_match', None)
+    return match.route if match is not None else 'unmatched'
+
+
+class InstrumentationMiddleware:
+    """
+    Samples SKU_METRICS_SAMPLE_RATE of the requests into the registry, see the module docstring.
+    Put it first in MIDDLEWARE so the durations cover the whole stack.
+    """
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+        self.sample_rate = getattr(settings, 'SKU_METRICS_SAMPLE_RATE', 1.0)
+        self.n_plus_one = getattr(settings, 'SKU_METRICS_N_PLUS_ONE', 10)
+        self.is_async = iscoroutinefunction(get_response)
+        if self.is_async:
+            markcoroutinefunction(self)
+            # Django would run a synchronous hook in a thread under ASGI.
+            self.process_template_response = self.aprocess_template_response
+
+    def __call__(self, request):
+        if self.is_async:
+            return self.__acall__(request)
+        if random.random() >= self.sample_rate:
+            response = self.get_response(request)
+            registry.increment('sku_requests_total', (('status', response.status_code), ('view', route(request))))
+            return response
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    async def __acall__(self, request):
+        if random.random() >= self.sample_rate:
+            response = await self.get_response(request)
+            registry.increment('sku_requests_total', (('status', response.status_code), ('view', route(request))))
+            return response
+        metrics = RequestMetrics()
+        token = _current.set(metrics)
+        started = time.perf_counter()
+        try:
+            response = await self.get_response(request)
+        finally:
+            _current.reset(token)
+        self.record(request, response, metrics, time.perf_counter() - started)
+        return response
+
+    def process_template_response(self, request, response):
+        """
+        Times the rendering of DRF responses, which happens after the view returned.
+        """
+        metrics = _current.get()
+        if metrics is not None:
+            metrics.render_started = time.perf_counter()
+            response.add_post_render_callback(lambda rendered: self.rendered(metrics))
+        return response
+
+    async def aprocess_template_response(self, request, response):
+        return self.process_template_response(request, response)
+
+    def rendered(self, metrics):
+        metrics.render_seconds = time.perf_counter() - metrics.render_started
+
+    def record(self, request, response, metrics, seconds):
+        view = route(request)
+        labels = (('view', view),)
+        registry.increment('sku_requests_total', (('status', response.status_code), ('view', view)))
+        registry.observe('sku_request_duration_seconds', labels, seconds)
+        registry.observe('sku_db_queries', labels, metrics.queries)
+        registry.observe('sku_db_duration_seconds', labels, metrics.db_seconds)
+        registry.observe('sku_render_duration_seconds', labels, metrics.render_seconds)
+        if not response.streaming:
+            registry.observe('sku_response_bytes', labels, len(response.content))
+        elif not getattr(response, 'is_async', False):
+            response.streaming_content = count_bytes(response.streaming_content, labels)
+
+        if metrics.queries >= self.n_plus_one:
+            shape, count = metrics.repeated()
+            if count >= self.n_plus_one:
+                registry.increment('sku_n_plus_one_total', labels)
+                logger.warning('Possible N+1 queries in %s: %d runs of %s', view, count, shape)
+
+
+def count_bytes(chunks, labels):
+    """
+    Passes a streamed body through and observes its size once it was sent.
+    """
+    size = 0
+    for chunk in chunks:
+        size += len(chunk)
+        yield chunk
+    registry.observe('sku_response_bytes', labels, size)
+
+
+def metrics(request):
+    """
+    Serves the metrics of this process in the Prometheus text format to the clients of SKU_METRICS_ALLOWED_IPS,
+    the route does not exist for the others.
+    """
+    if request.META.get('REMOTE_ADDR') not in getattr(settings, 'SKU_METRICS_ALLOWED_IPS', ('127.0.0.1', '::1')):
+        raise Http404
+    return HttpResponse(registry.export(), content_type='text/plain; version=0.0.4; charset=utf-8')
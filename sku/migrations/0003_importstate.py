@@ -0,0 +1,33 @@
+# Generated by Django 4.1.5 on 2026-10-18 12:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0002_skudatamapping_remove_skumapping_dpt_loc_cat_and_more"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ImportState",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("source", models.CharField(max_length=20)),
+                ("key", models.BigIntegerField()),
+                ("fingerprint", models.BigIntegerField()),
+            ],
+            options={
+                "unique_together": {("source", "key")},
+            },
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.1.5 on 2026-10-18 12:42
+
+from django.db import migrations, models
+from django.db.models import Count, Min
+
+# (model, parent field, [(referencing model, field), ...]) in top down order, merging
+# duplicate departments can create duplicate categories which are merged next.
+LEVELS = [
+    ("Department", "location", [("Category", "department"), ("SKUDataMapping", "department")]),
+    ("Category", "department", [("SubCategory", "category"), ("SKUDataMapping", "category")]),
+    ("SubCategory", "category", [("SKUDataMapping", "subcategory")]),
+]
+
+
+def merge_duplicates(apps, schema_editor):
+    """
+    Merges nodes sharing a name under the same parent into the oldest one, so the
+    unique constraints can be added.
+    """
+    for model_name, parent, references in LEVELS:
+        model = apps.get_model("sku", model_name)
+        duplicates = (
+            model.objects.values(parent, "name")
+            .annotate(keep=Min("id"), count=Count("id"))
+            .filter(count__gt=1)
+        )
+        for duplicate in duplicates:
+            ids = list(
+                model.objects.filter(**{parent: duplicate[parent], "name": duplicate["name"]})
+                .exclude(id=duplicate["keep"])
+                .values_list("id", flat=True)
+            )
+            for reference, field in references:
+                apps.get_model("sku", reference).objects.filter(
+                    **{"{}__in".format(field): ids}
+                ).update(**{field: duplicate["keep"]})
+            model.objects.filter(id__in=ids).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0003_importstate"),
+    ]
+
+    operations = [
+        migrations.RunPython(merge_duplicates, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name="skudatamapping",
+            index=models.Index(
+                fields=["location", "department", "category", "subcategory"],
+                name="sku_mapping_hierarchy_idx",
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="category",
+            constraint=models.UniqueConstraint(
+                fields=("department", "name"), name="sku_category_department_name_uniq"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="department",
+            constraint=models.UniqueConstraint(
+                fields=("location", "name"), name="sku_department_location_name_uniq"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="subcategory",
+            constraint=models.UniqueConstraint(
+                fields=("category", "name"), name="sku_subcategory_category_name_uniq"
+            ),
+        ),
+    ]
@@ -0,0 +1,120 @@
+# Generated by Django 4.1.5 on 2026-10-18 12:51
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+SOURCE_FIELDS = (
+    "sku",
+    "description",
+    "location_id",
+    "department_id",
+    "category_id",
+    "subcategory_id",
+    "location__name",
+    "department__name",
+    "category__name",
+    "subcategory__name",
+)
+
+SEARCH_FIELDS = (
+    "sku_id",
+    "description",
+    "location_id",
+    "department_id",
+    "category_id",
+    "subcategory_id",
+    "location_name",
+    "department_name",
+    "category_name",
+    "subcategory_name",
+)
+
+
+def populate(apps, schema_editor, batch_size=10000):
+    """
+    Copies the existing SKUs with their hierarchy names into sku_search, batch_size rows at a time.
+    """
+    mapping = apps.get_model("sku", "SKUDataMapping")
+    search = apps.get_model("sku", "SKUSearch")
+    last = 0
+    while True:
+        rows = list(
+            mapping.objects.filter(sku__gt=last)
+            .order_by("sku")
+            .values_list(*SOURCE_FIELDS)[:batch_size]
+        )
+        search.objects.bulk_create(
+            [search(**dict(zip(SEARCH_FIELDS, row))) for row in rows]
+        )
+        if len(rows) < batch_size:
+            return
+        last = rows[-1][0]
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0004_hierarchy_indexes"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SKUSearch",
+            fields=[
+                (
+                    "sku",
+                    models.OneToOneField(
+                        db_column="sku",
+                        on_delete=django.db.models.deletion.CASCADE,
+                        primary_key=True,
+                        related_name="search",
+                        serialize=False,
+                        to="sku.skudatamapping",
+                    ),
+                ),
+                ("description", models.CharField(max_length=50)),
+                ("location_id", models.IntegerField()),
+                ("department_id", models.IntegerField()),
+                ("category_id", models.IntegerField()),
+                ("subcategory_id", models.IntegerField()),
+                ("location_name", models.CharField(max_length=100)),
+                ("department_name", models.CharField(max_length=100)),
+                ("category_name", models.CharField(max_length=100)),
+                ("subcategory_name", models.CharField(max_length=100)),
+            ],
+            options={
+                "db_table": "sku_search",
+            },
+        ),
+        migrations.AddIndex(
+            model_name="skusearch",
+            index=models.Index(
+                fields=[
+                    "location_name",
+                    "department_name",
+                    "category_name",
+                    "subcategory_name",
+                ],
+                name="sku_search_path_idx",
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="skusearch",
+            index=models.Index(
+                fields=["department_name"], name="sku_search_department_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="skusearch",
+            index=models.Index(
+                fields=["category_name"], name="sku_search_category_idx"
+            ),
+        ),
+        migrations.AddIndex(
+            model_name="skusearch",
+            index=models.Index(
+                fields=["subcategory_name"], name="sku_search_subcategory_idx"
+            ),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 4.1.5 on 2026-10-18 12:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0005_sku_search"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SKUSearchChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("sku", models.IntegerField(null=True)),
+            ],
+            options={
+                "db_table": "sku_search_change",
+            },
+        ),
+    ]
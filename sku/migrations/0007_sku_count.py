@@ -0,0 +1,64 @@
+# Generated by Django 4.1.5 on 2026-10-18 13:02
+
+from django.db import migrations, models
+from django.db.models import Count
+
+PATH_FIELDS = ("location_id", "department_id", "category_id", "subcategory_id")
+
+
+def populate(apps, schema_editor):
+    """
+    Counts the existing SKUs of every path with one GROUP BY.
+    """
+    mapping = apps.get_model("sku", "SKUDataMapping")
+    counter = apps.get_model("sku", "SKUCount")
+    rows = mapping.objects.values_list(*PATH_FIELDS).annotate(skus=Count("sku")).order_by()
+    counter.objects.bulk_create(
+        [counter(count=row[-1], **dict(zip(PATH_FIELDS, row))) for row in rows],
+        batch_size=10000,
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0006_sku_search_change"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SKUCount",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("location_id", models.IntegerField()),
+                ("department_id", models.IntegerField()),
+                ("category_id", models.IntegerField()),
+                ("subcategory_id", models.IntegerField()),
+                ("count", models.IntegerField(default=0)),
+            ],
+            options={
+                "db_table": "sku_count",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="skucount",
+            constraint=models.UniqueConstraint(
+                fields=(
+                    "location_id",
+                    "department_id",
+                    "category_id",
+                    "subcategory_id",
+                ),
+                name="sku_count_path_uniq",
+            ),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
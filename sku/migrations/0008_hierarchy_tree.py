@@ -0,0 +1,139 @@
+# Generated by Django 4.1.5 on 2026-10-18 13:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+LEVEL_SOURCES = (
+    ("Location", None),
+    ("Department", "location_id"),
+    ("Category", "department_id"),
+    ("SubCategory", "category_id"),
+)
+
+
+def populate(apps, schema_editor, batch_size=10000):
+    """
+    Adds a tree node for every existing location, department, category and subcategory, level by
+    level, then the closure rows of every node and each of its ancestors.
+    """
+    node = apps.get_model("sku", "HierarchyNode")
+    closure = apps.get_model("sku", "HierarchyClosure")
+    ids = {}
+    parents = {}
+    for level, (model_name, parent_field) in enumerate(LEVEL_SOURCES):
+        model = apps.get_model("sku", model_name)
+        rows = list(model.objects.values_list("id", parent_field or "id", "name"))
+        node.objects.bulk_create(
+            [
+                node(
+                    level=level,
+                    node_id=pk,
+                    name=name,
+                    parent_id=ids.get((level - 1, parent)) if parent_field else None,
+                )
+                for pk, parent, name in rows
+            ],
+            batch_size=batch_size,
+        )
+        for pk, node_id, parent_id in node.objects.filter(level=level).values_list(
+            "id", "node_id", "parent_id"
+        ):
+            ids[(level, node_id)] = pk
+            parents[pk] = parent_id
+
+    links = []
+    for descendant in parents:
+        ancestor, depth = descendant, 0
+        while ancestor is not None:
+            links.append(
+                closure(ancestor_id=ancestor, descendant_id=descendant, depth=depth)
+            )
+            ancestor, depth = parents.get(ancestor), depth + 1
+    closure.objects.bulk_create(links, batch_size=batch_size)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0007_sku_count"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HierarchyNode",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("level", models.PositiveSmallIntegerField()),
+                ("node_id", models.IntegerField()),
+                ("name", models.CharField(max_length=100)),
+                (
+                    "parent",
+                    models.ForeignKey(
+                        null=True,
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="children",
+                        to="sku.hierarchynode",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "sku_hierarchy_node",
+            },
+        ),
+        migrations.CreateModel(
+            name="HierarchyClosure",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("depth", models.PositiveSmallIntegerField()),
+                (
+                    "ancestor",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="descendant_links",
+                        to="sku.hierarchynode",
+                    ),
+                ),
+                (
+                    "descendant",
+                    models.ForeignKey(
+                        on_delete=django.db.models.deletion.CASCADE,
+                        related_name="ancestor_links",
+                        to="sku.hierarchynode",
+                    ),
+                ),
+            ],
+            options={
+                "db_table": "sku_hierarchy_closure",
+            },
+        ),
+        migrations.AddConstraint(
+            model_name="hierarchynode",
+            constraint=models.UniqueConstraint(
+                fields=("level", "node_id"), name="sku_hierarchy_node_level_node_uniq"
+            ),
+        ),
+        migrations.AddConstraint(
+            model_name="hierarchyclosure",
+            constraint=models.UniqueConstraint(
+                fields=("ancestor", "depth", "descendant"),
+                name="sku_hierarchy_closure_ancestor_uniq",
+            ),
+        ),
+        migrations.RunPython(populate, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.5 on 2026-10-18 16:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0008_hierarchy_tree"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="HierarchyChange",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("level", models.PositiveSmallIntegerField()),
+                ("node_id", models.IntegerField()),
+            ],
+            options={
+                "db_table": "sku_hierarchy_change",
+            },
+        ),
+    ]
@@ -0,0 +1,48 @@
+# Generated by Django 4.1.5 on 2026-10-18 17:05
+
+from django.db import migrations, models
+
+# The category rules CategorySerializer used to hardcode.
+CATEGORY_RULES = (
+    ('letters', '', 'Only characters are allowed.'),
+    ('max_length', '20', 'Max length should be 20 characters.'),
+    ('blocked_parent', 'Bakery', 'No more categories allowed under this department. Please select other department'),
+)
+
+
+def add_category_rules(apps, schema_editor):
+    ValidationRule = apps.get_model('sku', 'ValidationRule')
+    ValidationRule.objects.bulk_create([ValidationRule(level='category', kind=kind, value=value, message=message)
+                                        for kind, value, message in CATEGORY_RULES])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0009_hierarchy_change"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="ValidationRule",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("level", models.CharField(max_length=20)),
+                ("kind", models.CharField(max_length=20)),
+                ("value", models.CharField(blank=True, max_length=100)),
+                ("message", models.CharField(max_length=200)),
+            ],
+            options={
+                "db_table": "sku_validation_rule",
+            },
+        ),
+        migrations.RunPython(add_category_rules, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,32 @@
+# Generated by Django 4.1.5 on 2026-10-18 18:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0010_validation_rule"),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name="SharedVersion",
+            fields=[
+                (
+                    "id",
+                    models.BigAutoField(
+                        auto_created=True,
+                        primary_key=True,
+                        serialize=False,
+                        verbose_name="ID",
+                    ),
+                ),
+                ("key", models.CharField(max_length=200, unique=True)),
+                ("version", models.BigIntegerField()),
+            ],
+            options={
+                "db_table": "sku_version",
+            },
+        ),
+    ]
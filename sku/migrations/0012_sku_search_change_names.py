@@ -0,0 +1,18 @@
+# Generated by Django 4.1.5 on 2026-10-18 19:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ("sku", "0011_shared_version"),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name="skusearchchange",
+            name="names",
+            field=models.BooleanField(default=False),
+        ),
+    ]
@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import models, transaction
 
 
 class Location(models.Model):
@@ -18,6 +18,11 @@ class Department(models.Model):
     name = models.CharField(max_length=100)
     location = models.ForeignKey(Location, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['location', 'name'], name='sku_department_location_name_uniq'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -29,6 +34,11 @@ class Category(models.Model):
     name = models.CharField(max_length=100)
     department = models.ForeignKey(Department, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['department', 'name'], name='sku_category_department_name_uniq'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -40,6 +50,11 @@ class SubCategory(models.Model):
     name = models.CharField(max_length=100)
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['category', 'name'], name='sku_subcategory_category_name_uniq'),
+        ]
+
     def __str__(self):
         return self.name
 
@@ -55,4 +70,162 @@ class SKUDataMapping(models.Model):
     category = models.ForeignKey(Category, on_delete=models.CASCADE)
     subcategory = models.ForeignKey(SubCategory, on_delete=models.CASCADE)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['location', 'department', 'category', 'subcategory'], name='sku_mapping_hierarchy_idx'),
+        ]
+
+    def delete(self, using=None, keep_parents=False):
+        """
+        Deletes the SKU through signals.delete_skus, which keeps sku_search and the counters up to date
+        """
+        from .signals import delete_skus
+        with transaction.atomic(using=using):
+            deleted = delete_skus([self.pk])
+        return len(deleted), {self._meta.label: len(deleted)}
+
+
+class ImportState(models.Model):
+    """
+    Model for fingerprints of previously imported rows, used by incremental imports
+    """
+    source = models.CharField(max_length=20)
+    key = models.BigIntegerField()
+    fingerprint = models.BigIntegerField()
+
+    class Meta:
+        unique_together = ('source', 'key')
+
+
+class SKUSearch(models.Model):
+    """
+    Denormalized read model of SKUDataMapping with the names of its hierarchy, kept up to date
+    by the signals and the loaders, so SKUs are filtered by names without joins
+    """
+    sku = models.OneToOneField(SKUDataMapping, primary_key=True, on_delete=models.CASCADE, db_column='sku',
+                               related_name='search')
+    description = models.CharField(max_length=50)
+    location_id = models.IntegerField()
+    department_id = models.IntegerField()
+    category_id = models.IntegerField()
+    subcategory_id = models.IntegerField()
+    location_name = models.CharField(max_length=100)
+    department_name = models.CharField(max_length=100)
+    category_name = models.CharField(max_length=100)
+    subcategory_name = models.CharField(max_length=100)
+
+    class Meta:
+        db_table = 'sku_search'
+        indexes = [
+            models.Index(fields=['location_name', 'department_name', 'category_name', 'subcategory_name'],
+                         name='sku_search_path_idx'),
+            models.Index(fields=['department_name'], name='sku_search_department_idx'),
+            models.Index(fields=['category_name'], name='sku_search_category_idx'),
+            models.Index(fields=['subcategory_name'], name='sku_search_subcategory_idx'),
+        ]
+
+
+class SKUSearchChange(models.Model):
+    """
+    Log of the SKUs written to sku_search, read by the in-process search indexes to catch up.
+    A null sku means any SKU may have changed, names that only the hierarchy names of the SKU changed
+    """
+    sku = models.IntegerField(null=True)
+    names = models.BooleanField(default=False)
+
+    class Meta:
+        db_table = 'sku_search_change'
+
+
+class HierarchyChange(models.Model):
+    """
+    Log of the written or deleted locations, departments, categories and subcategories, level is the
+    index of their model in hierarchy.LEVELS. Read by the hierarchies mapped from a catalog snapshot to catch up
+    """
+    level = models.PositiveSmallIntegerField()
+    node_id = models.IntegerField()
+
+    class Meta:
+        db_table = 'sku_hierarchy_change'
+
+
+class SharedVersion(models.Model):
+    """
+    Version counter shared by the workers of every host, moved to a new version on writes so the in-process
+    copies and the cached responses depending on its key are dropped by all of them, see versions
+    """
+    key = models.CharField(max_length=200, unique=True)
+    version = models.BigIntegerField()
+
+    class Meta:
+        db_table = 'sku_version'
+
+
+class ValidationRule(models.Model):
+    """
+    Rule the serializers check the nodes of a level against when they are written, kind is one of
+    rules.RULE_KINDS, message the error returned when the rule fails. Rules are checked in id order
+    """
+    level = models.CharField(max_length=20)
+    kind = models.CharField(max_length=20)
+    value = models.CharField(max_length=100, blank=True)
+    message = models.CharField(max_length=200)
+
+    class Meta:
+        db_table = 'sku_validation_rule'
+
+    def __str__(self):
+        return '{} {} {}'.format(self.level, self.kind, self.value)
+
+
+class SKUCount(models.Model):
+    """
+    Number of SKUs of every location, department, category and subcategory path, kept up to date
+    together with sku_search, so the counts of a level are summed over the paths and not the SKUs
+    """
+    location_id = models.IntegerField()
+    department_id = models.IntegerField()
+    category_id = models.IntegerField()
+    subcategory_id = models.IntegerField()
+    count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'sku_count'
+        constraints = [
+            models.UniqueConstraint(fields=['location_id', 'department_id', 'category_id', 'subcategory_id'],
+                                    name='sku_count_path_uniq'),
+        ]
+
+
+class HierarchyNode(models.Model):
+    """
+    Node of the Location -> Department -> Category -> SubCategory tree in one table, level is the
+    index of its model in hierarchy.LEVELS, node_id its id there. Indexed by HierarchyClosure
+    """
+    level = models.PositiveSmallIntegerField()
+    node_id = models.IntegerField()
+    name = models.CharField(max_length=100)
+    parent = models.ForeignKey('self', null=True, on_delete=models.CASCADE, related_name='children')
+
+    class Meta:
+        db_table = 'sku_hierarchy_node'
+        constraints = [
+            models.UniqueConstraint(fields=['level', 'node_id'], name='sku_hierarchy_node_level_node_uniq'),
+        ]
 
+
+class HierarchyClosure(models.Model):
+    """
+    Closure table of the hierarchy tree, one row for every node and each of its ancestors, itself
+    included at depth 0, so a subtree and an ancestor path are each read with one indexed query
+    """
+    ancestor = models.ForeignKey(HierarchyNode, on_delete=models.CASCADE, related_name='descendant_links')
+    descendant = models.ForeignKey(HierarchyNode, on_delete=models.CASCADE, related_name='ancestor_links')
+    depth = models.PositiveSmallIntegerField()
+
+    class Meta:
+        db_table = 'sku_hierarchy_closure'
+        constraints = [
+            models.UniqueConstraint(fields=['ancestor', 'depth', 'descendant'],
+                                    name='sku_hierarchy_closure_ancestor_uniq'),
+        ]
@@ -0,0 +1,227 @@
+from django.http import HttpResponse, StreamingHttpResponse
+from rest_framework.exceptions import ParseError
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+
+from .renderers import FastJSONRenderer, dumps
+
+
+def keyset_iterator(queryset, chunk_size=2000, key=None):
+    """
+    Iterates over a queryset ordered by primary key, reading chunk_size rows per query
+    with `pk > last seen`. Unlike QuerySet.iterator() this keeps memory constant on
+    MySQL too, whose driver buffers the whole result set of a query.
+    Rows can be model instances, or values_list tuples whose first item is the pk.
+    """
+    key = key or _row_key
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = list(chunk.order_by('pk')[:chunk_size])
+        yield from rows
+        if len(rows) < chunk_size:
+            return
+        last = key(rows[-1])
+
+
+def _row_key(row):
+    if isinstance(row, dict):
+        return row['pk'] if 'pk' in row else row['id']
+    if isinstance(row, (tuple, list)):
+        return row[0]
+    return row.pk
+
+
+class KeysetPagination(BasePagination):
+    """
+    Keyset pagination on the primary key. A page is read with `pk > after LIMIT limit`, so
+    deep pages cost the same as the first one. The body keeps its plain list shape, the
+    url of the next page is returned in the Link header.
+    """
+    page_size = api_settings.PAGE_SIZE
+    max_page_size = 10000
+    after_query_param = 'after'
+    page_size_query_param = 'limit'
+
+    def get_params(self, request):
+        # request.GET works for DRF and plain Django requests, the async views use the latter.
+        try:
+            after = request.GET.get(self.after_query_param)
+            after = int(after) if after is not None else None
+            limit = min(int(request.GET.get(self.page_size_query_param, self.page_size)),
+                        self.max_page_size)
+            if limit < 1:
+                raise ValueError
+        except ValueError:
+            raise ParseError('{} must be an integer and {} a positive integer.'.format(
+                self.after_query_param, self.page_size_query_param))
+        return after, limit
+
+    def paginate_queryset(self, queryset, request, view=None):
+        """
+        Returns a page of the queryset, or of a list of rows already ordered by pk.
+        """
+        self.request = request
+        after, self.limit = self.get_params(request)
+        if isinstance(queryset, (list, tuple)):
+            rows = queryset if after is None else [row for row in queryset if _row_key(row) > after]
+            page = list(rows[:self.limit])
+        else:
+            if after is not None:
+                queryset = queryset.filter(pk__gt=after)
+            page = list(queryset.order_by('pk')[:self.limit])
+        self.next_after = _row_key(page[-1]) if len(page) == self.limit else None
+        return page
+
+    async def apaginate_queryset(self, queryset, request):
+        """
+        Async version of paginate_queryset for querysets, reading the page with the async ORM.
+        """
+        self.request = request
+        after, self.limit = self.get_params(request)
+        if after is not None:
+            queryset = queryset.filter(pk__gt=after)
+        page = [row async for row in queryset.order_by('pk')[:self.limit]]
+        self.next_after = _row_key(page[-1]) if len(page) == self.limit else None
+        return page
+
+    def get_next_link(self):
+        if self.next_after is None:
+            return None
+        params = self.request.GET.copy()
+        params[self.after_query_param] = self.next_after
+        params[self.page_size_query_param] = self.limit
+        return self.request.build_absolute_uri('?' + params.urlencode())
+
+    def get_paginated_response(self, data):
+        headers = {}
+        next_link = self.get_next_link()
+        if next_link:
+            headers['Link'] = '<{}>; rel="next"'.format(next_link)
+        return Response(data, headers=headers)
+
+
+async def akeyset_iterator(queryset, chunk_size=2000, key=None):
+    """
+    Async version of keyset_iterator, reading every chunk with the async ORM.
+    """
+    key = key or _row_key
+    last = None
+    while True:
+        chunk = queryset if last is None else queryset.filter(pk__gt=last)
+        rows = [row async for row in chunk.order_by('pk')[:chunk_size]]
+        for row in rows:
+            yield row
+        if len(rows) < chunk_size:
+            return
+        last = key(rows[-1])
+
+
+def stream_ndjson(rows, serialize=list, chunk_size=2000):
+    """
+    Returns a StreamingHttpResponse writing one JSON document per line. Rows are
+    encoded chunk by chunk as they are fetched, the full list is never built.
+    serialize turns a list of rows into a list of JSON-able items.
+    """
+    def lines():
+        chunk = []
+        for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield b''.join(dumps(item) + b'\n' for item in serialize(chunk))
+                chunk = []
+        if chunk:
+            yield b''.join(dumps(item) + b'\n' for item in serialize(chunk))
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
+def list_response(request, queryset, serializer_class=None, serialize=None, chunk_size=2000):
+    """
+    Returns one keyset page of the queryset, or streams every row as NDJSON when that
+    format was negotiated (`?format=ndjson` or Accept: application/x-ndjson).
+    Rows are turned into JSON-able items by serializer_class, or by serialize which takes
+    a list of rows. Without either, values_list tuples are rendered as lists and other
+    rows as they are.
+    """
+    if serializer_class:
+        def serialize(rows):
+            return serializer_class(rows, many=True).data
+    elif serialize is None:
+        def serialize(rows):
+            return [list(row) if isinstance(row, tuple) else row for row in rows]
+
+    if getattr(request, 'accepted_renderer', None) and request.accepted_renderer.format == 'ndjson':
+        rows = queryset if isinstance(queryset, (list, tuple)) else keyset_iterator(queryset, chunk_size)
+        return stream_ndjson(rows, serialize, chunk_size)
+    paginator = KeysetPagination()
+    page = paginator.paginate_queryset(queryset, request)
+    return paginator.get_paginated_response(serialize(page))
+
+
+class KeysetListMixin:
+    """
+    Adds paginated and NDJSON streaming list responses to an APIView.
+    """
+    pagination_class = KeysetPagination
+
+    def list_response(self, request, queryset, serializer_class=None, serialize=None):
+        return list_response(request, queryset, serializer_class, serialize)
+
+
+def wants_ndjson(request):
+    """
+    Whether a plain Django request asked for NDJSON, with `?format=ndjson` or its Accept header.
+    """
+    return request.GET.get('format') == 'ndjson' or 'application/x-ndjson' in request.headers.get('Accept', '')
+
+
+async def astream_ndjson(rows, serialize=list, chunk_size=2000):
+    """
+    Async version of stream_ndjson over an async iterator of rows, streamed by Django 4.2 and later.
+    """
+    async def lines():
+        chunk = []
+        async for row in rows:
+            chunk.append(row)
+            if len(chunk) == chunk_size:
+                yield b''.join(dumps(item) + b'\n' for item in serialize(chunk))
+                chunk = []
+        if chunk:
+            yield b''.join(dumps(item) + b'\n' for item in serialize(chunk))
+
+    return StreamingHttpResponse(lines(), content_type='application/x-ndjson')
+
+
+async def _aiterate(rows):
+    for row in rows:
+        yield row
+
+
+async def alist_response(request, queryset, serialize=None, chunk_size=2000):
+    """
+    Async version of list_response for plain Django requests. serialize must not query the
+    database, related rows have to be fetched with the queryset.
+    """
+    if serialize is None:
+        def serialize(rows):
+            return [list(row) if isinstance(row, tuple) else row for row in rows]
+
+    if wants_ndjson(request):
+        if isinstance(queryset, (list, tuple)):
+            rows = _aiterate(queryset)
+        else:
+            rows = akeyset_iterator(queryset, chunk_size)
+        return await astream_ndjson(rows, serialize, chunk_size)
+
+    paginator = KeysetPagination()
+    if isinstance(queryset, (list, tuple)):
+        page = paginator.paginate_queryset(queryset, request)
+    else:
+        page = await paginator.apaginate_queryset(queryset, request)
+    response = HttpResponse(FastJSONRenderer().render(serialize(page)), content_type='application/json')
+    next_link = paginator.get_next_link()
+    if next_link:
+        response['Link'] = '<{}>; rel="next"'.format(next_link)
+    return response
@@ -0,0 +1,64 @@
+from rest_framework.renderers import BaseRenderer, JSONRenderer
+from rest_framework.utils.encoders import JSONEncoder
+
+try:
+    import orjson
+except ImportError:  # orjson is optional, the standard library encoder is used without it
+    orjson = None
+
+ENCODER = JSONEncoder(ensure_ascii=False, separators=(',', ':'), allow_nan=False)
+
+if orjson is not None:
+    # Dates and times go through DRF's encoder, which writes them its own way.
+    ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+
+
+def dumps(data):
+    """
+    Returns data as compact UTF-8 JSON bytes, the same bytes as DRF's JSONRenderer with the default
+    settings. orjson encodes them when it is installed, the types it does not know are converted by
+    DRF's encoder, and data it rejects is encoded by that encoder alone. The bytes only differ for
+    floats written with an exponent, which the API does not return.
+    """
+    if orjson is not None:
+        try:
+            data = orjson.dumps(data, default=ENCODER.default, option=ORJSON_OPTIONS)
+        except TypeError:
+            pass
+        else:
+            # Line and paragraph separators are escaped like DRF does, for JavaScript.
+            if b'\xe2\x80\xa8' in data or b'\xe2\x80\xa9' in data:
+                data = data.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+            return data
+    return ENCODER.encode(data).replace('\u2028', '\\u2028').replace('\u2029', '\\u2029').encode()
+
+
+class FastJSONRenderer(JSONRenderer):
+    """
+    JSONRenderer encoding through dumps. Indented output, requested by the browsable API or
+    `Accept: application/json; indent=4`, and non default JSON settings are left to DRF.
+    """
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        if (self.ensure_ascii or not self.compact or not self.strict
+                or self.get_indent(accepted_media_type, renderer_context or {}) is not None):
+            return super().render(data, accepted_media_type, renderer_context)
+        return dumps(data)
+
+
+class NDJSONRenderer(BaseRenderer):
+    """
+    Renders a list as newline delimited JSON, one item per line.
+    List views stream this format themselves, the renderer covers the other responses.
+    """
+    media_type = 'application/x-ndjson'
+    format = 'ndjson'
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if data is None:
+            return b''
+        items = data if isinstance(data, (list, tuple)) else [data]
+        return b''.join(dumps(item) + b'\n' for item in items)
@@ -0,0 +1,168 @@
+import hashlib
+from functools import wraps
+
+from django.core.cache import caches
+from django.db import transaction
+from django.http import HttpResponse, HttpResponseNotModified
+from django.utils.http import parse_etags, quote_etag
+
+from .hierarchy import LEVELS, get_hierarchy
+from .versions import bump_versions, get_versions
+
+CACHE_ALIAS = 'responses'
+
+TAG_PREFIX = 'sku:tag:'
+
+KEY_PREFIX = 'sku:response:'
+
+CACHED_HEADERS = ('Link',)
+
+
+def _responses():
+    return caches[CACHE_ALIAS]
+
+
+def tag_versions(tags):
+    """
+    Returns the current version of every tag. The versions are shared by all workers, see versions,
+    so a write in any of them changes the keys of the responses depending on its tags everywhere.
+    """
+    return get_versions(TAG_PREFIX + tag for tag in tags)
+
+
+def invalidate_tags(tags):
+    """
+    Evicts every cached response depending on one of the tags, by moving the tag to a new version.
+    """
+    bump_versions(TAG_PREFIX + tag for tag in tags)
+
+
+def invalidate_tags_on_commit(tags):
+    tags = set(tags)
+    transaction.on_commit(lambda: invalidate_tags(tags))
+
+
+def node_tags(level, pk, parent_id):
+    """
+    Returns the tags to invalidate when a hierarchy node is written: its subtree, the child
+    listing of its parent, and the SKU queries over the node, its ancestors and descendants.
+    """
+    hierarchy = get_hierarchy()
+    depth = LEVELS.index(level)
+    parent = 'children:{}:{}'.format(LEVELS[depth - 1], parent_id) if depth else 'children:root'
+    tags = ['node:{}:{}'.format(level, pk), parent, 'skus:all', 'skus:unresolved']
+
+    # The cached hierarchy still holds the node as it was before this write.
+    cached = hierarchy.get(level, pk)
+    if cached and cached.parent_id != parent_id and depth:
+        tags.append('children:{}:{}'.format(LEVELS[depth - 1], cached.parent_id))
+    path = hierarchy.path(level, pk) or ()
+    tags.extend('skus:{}:{}'.format(LEVELS[index], ancestor) for index, ancestor in enumerate(path))
+
+    nodes = [(level, pk)]
+    while nodes:
+        current, current_pk = nodes.pop()
+        tags.append('skus:{}:{}'.format(current, current_pk))
+        if current != LEVELS[-1]:
+            child_level = LEVELS[LEVELS.index(current) + 1]
+            nodes.extend((child_level, child.id) for child in hierarchy.children(current, current_pk))
+    return tags
+
+
+def created_node_tags(level, parent_ids):
+    """
+    Returns the tags to invalidate when nodes are created under the given parents.
+    """
+    depth = LEVELS.index(level)
+    if not depth:
+        return ['children:root', 'skus:unresolved']
+    return ['children:{}:{}'.format(LEVELS[depth - 1], pk) for pk in set(parent_ids)] + ['skus:unresolved']
+
+
+def sku_tags(location_id, department_id, category_id, subcategory_id):
+    """
+    Returns the tags to invalidate when a SKU mapped to the given path is written.
+    """
+    ids = (location_id, department_id, category_id, subcategory_id)
+    return ['skus:all'] + ['skus:{}:{}'.format(level, pk) for level, pk in zip(LEVELS, ids)]
+
+
+def location_detail_tags(request, kwargs):
+    """
+    Tags of the /location/<id>/department/... responses: the nodes of the path and the child listing.
+    """
+    ids = [kwargs.get(key) for key in ('location_id', 'department_id', 'category_id', 'subcategory_id')]
+    ids = [pk for pk in ids if pk]
+    tags = ['node:{}:{}'.format(level, pk) for level, pk in zip(LEVELS, ids)]
+    if ids:
+        tags.append('children:{}:{}'.format(LEVELS[len(ids) - 1], ids[-1]))
+    return tags
+
+
+def sku_query_tags(request, kwargs):
+    """
+    Tags of the get_skus_by_meta_data responses, the SKU queries over every node the filters resolve to.
+    """
+    hierarchy = get_hierarchy()
+    tags = []
+    for level in LEVELS:
+        name = request.GET.get(level)
+        if name is None:
+            continue
+        ids = hierarchy.ids(level, name)
+        if not ids:
+            return ['skus:unresolved']
+        tags.extend('skus:{}:{}'.format(level, pk) for pk in ids)
+    return tags or ['skus:all']
+
+
+def _cache_key(request, versions):
+    query = sorted((key, value) for key, values in request.GET.lists() for value in values)
+    parts = [request.get_host(), request.path, repr(query), request.META.get('HTTP_ACCEPT', ''), repr(versions)]
+    return KEY_PREFIX + hashlib.sha1('|'.join(parts).encode()).hexdigest()
+
+
+def cache_response(get_tags, timeout=None):
+    """
+    Caches the rendered GET responses of a view in the `responses` cache, keyed on host, path,
+    normalized query parameters, Accept header and the versions of the tags returned by
+    get_tags(request, kwargs). Responses carry an ETag and If-None-Match is answered with 304.
+    Streaming and non 200 responses are not cached.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(request, *args, **kwargs):
+            if request.method not in ('GET', 'HEAD'):
+                return view(request, *args, **kwargs)
+
+            cache = _responses()
+            key = _cache_key(request, tag_versions(get_tags(request, kwargs)))
+            entry = cache.get(key)
+            if entry is None:
+                response = view(request, *args, **kwargs)
+                if response.status_code != 200 or response.streaming:
+                    return response
+                if hasattr(response, 'render'):
+                    response.render()
+                entry = {
+                    'content': response.content,
+                    'content_type': response['Content-Type'],
+                    'etag': quote_etag(hashlib.md5(response.content).hexdigest()),
+                    'headers': {name: response[name] for name in CACHED_HEADERS if response.has_header(name)},
+                }
+                if timeout is None:
+                    cache.set(key, entry)
+                else:
+                    cache.set(key, entry, timeout)
+
+            etags = parse_etags(request.META.get('HTTP_IF_NONE_MATCH', ''))
+            if entry['etag'] in etags or '*' in etags:
+                response = HttpResponseNotModified()
+            else:
+                response = HttpResponse(entry['content'], content_type=entry['content_type'])
+                for name, value in entry['headers'].items():
+                    response[name] = value
+            response['ETag'] = entry['etag']
+            return response
+        return wrapped
+    return decorator
@@ -0,0 +1,68 @@
+from collections import Counter, defaultdict
+
+from django.db.models import Count, F, Sum
+
+from .hierarchy import LEVELS
+from .models import SKUDataMapping, SKUCount
+
+PATH_FIELDS = tuple('{}_id'.format(level) for level in LEVELS)
+
+
+def count_skus(deltas):
+    """
+    Adds the given numbers of SKUs to the counters of their paths, deltas maps (location_id,
+    department_id, category_id, subcategory_id) tuples to a positive or negative number.
+    Paths with the same delta are updated together, so a batch costs a few queries whatever its size.
+    Run it in the transaction writing the SKUs.
+    """
+    deltas = {path: delta for path, delta in deltas.items() if delta}
+    if not deltas:
+        return
+    # Counters are only created by additions, a removal never brings back the counter of a deleted node.
+    SKUCount.objects.bulk_create([SKUCount(**dict(zip(PATH_FIELDS, path)))
+                                  for path, delta in deltas.items() if delta > 0], ignore_conflicts=True)
+    counters = SKUCount.objects.filter(location_id__in={path[0] for path in deltas},
+                                       subcategory_id__in={path[3] for path in deltas})
+    ids = {row[1:]: row[0] for row in counters.values_list('id', *PATH_FIELDS)}
+    paths = defaultdict(list)
+    for path, delta in deltas.items():
+        if path in ids:
+            paths[delta].append(ids[path])
+    for delta, pks in paths.items():
+        SKUCount.objects.filter(id__in=pks).update(count=F('count') + delta)
+
+
+def path_deltas(added=(), removed=()):
+    """
+    Returns the count_skus deltas of the given added and removed path tuples.
+    """
+    deltas = Counter(added)
+    deltas.subtract(removed)
+    return deltas
+
+
+def forget_nodes(level, pks):
+    """
+    Deletes the counters of the paths through deleted nodes of a level.
+    """
+    SKUCount.objects.filter(**{'{}_id__in'.format(level): list(pks)}).delete()
+
+
+def rebuild_counts():
+    """
+    Recounts every path from SKUDataMapping with one GROUP BY.
+    """
+    SKUCount.objects.all().delete()
+    rows = SKUDataMapping.objects.values_list(*PATH_FIELDS).annotate(skus=Count('sku')).order_by()
+    SKUCount.objects.bulk_create([SKUCount(count=row[-1], **dict(zip(PATH_FIELDS, row))) for row in rows],
+                                 batch_size=10000)
+
+
+def rollup(level, filters=None):
+    """
+    Returns the number of SKUs of every node of the level as values rows of the ids from the location
+    down to the level and `skus`, ordered by those ids. filters are applied to the counters first.
+    """
+    fields = PATH_FIELDS[:LEVELS.index(level) + 1]
+    return (SKUCount.objects.filter(count__gt=0, **(filters or {})).values(*fields)
+            .annotate(skus=Sum('count')).order_by(*fields))
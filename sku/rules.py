@@ -0,0 +1,123 @@
+"""
+Validation rules of the hierarchy nodes, read from the sku_validation_rule table so they change without a
+deploy. Every process compiles them once and keeps them until a rule is written, like the hierarchy.
+A batch of nodes is validated against LevelRules resolved once for the batch: the names against the compiled
+checks, the parents against the set of blocked parent ids, so its size does not change the number of queries.
+"""
+import re
+import time
+
+from .hierarchy import LEVELS, get_hierarchy, version_check_interval
+from .models import ValidationRule
+from .versions import bump_versions, get_version
+
+VERSION_KEY = 'sku:rules:version'
+
+BLOCKED_PARENT = 'blocked_parent'
+
+
+def max_length(value):
+    length = int(value)
+    return lambda name: len(name) <= length
+
+
+# kind -> function of the rule value returning the check of a name, blocked_parent rules check the parent.
+NAME_CHECKS = {
+    'letters': lambda value: str.isalpha,
+    'max_length': max_length,
+    'pattern': lambda value: re.compile(value).fullmatch,
+}
+
+RULE_KINDS = tuple(NAME_CHECKS) + (BLOCKED_PARENT,)
+
+
+class LevelRules:
+    """
+    The rules of one level, ready to validate a batch: the checks of the names in rule order, each with its
+    message, and the messages of the parents no node may be written below by id.
+    """
+
+    def __init__(self, level, rules, hierarchy):
+        """
+        rules are the (name checks, blocked parents) of the level compiled by compile_rules, the blocked
+        parents are looked up by name in the hierarchy.
+        """
+        self.name_checks, blocked = rules
+        self.blocked = {}
+        depth = LEVELS.index(level)
+        for name, message in blocked:
+            for pk in hierarchy.ids(LEVELS[depth - 1], name) if depth else ():
+                self.blocked.setdefault(pk, message)
+
+    def name_error(self, name):
+        """
+        Returns the message of the first rule the name fails, or None.
+        """
+        for check, message in self.name_checks:
+            if not check(name):
+                return message
+        return None
+
+    def parent_error(self, parent_id):
+        """
+        Returns the message of the rule blocking the parent, or None.
+        """
+        return self.blocked.get(parent_id)
+
+
+def compile_rules(rows):
+    """
+    Returns the rules of every level from (level, kind, value, message) rows: the (check, message) pairs of
+    the names and the (parent name, message) pairs of the blocked parents. Rules of unknown levels or kinds
+    and rules whose value does not compile, like an invalid pattern, are skipped.
+    """
+    rules = {level: ([], []) for level in LEVELS}
+    for level, kind, value, message in rows:
+        if level not in rules:
+            continue
+        if kind == BLOCKED_PARENT:
+            rules[level][1].append((value, message))
+        elif kind in NAME_CHECKS:
+            try:
+                rules[level][0].append((NAME_CHECKS[kind](value), message))
+            except (ValueError, re.error):
+                continue
+    return rules
+
+
+_rules = None
+_version = None
+_checked = 0
+
+
+def get_rules():
+    """
+    Returns the compiled rules of every level, reading them on first use and again whenever a rule
+    was written by any worker, see get_hierarchy.
+    """
+    global _rules, _version, _checked
+    now = time.monotonic()
+    if _rules is None or now - _checked >= version_check_interval():
+        version = get_version(VERSION_KEY)
+        _checked = now
+        if _rules is None or version != _version:
+            _rules, _version = compile_rules(ValidationRule.objects.order_by('id')
+                                             .values_list('level', 'kind', 'value', 'message')), version
+    return _rules
+
+
+def invalidate_rules():
+    """
+    Drops the compiled rules of every worker.
+    Call it through transaction.on_commit so no worker reads uncommitted rules.
+    """
+    global _rules
+    bump_versions([VERSION_KEY])
+    _rules = None
+
+
+def level_rules(level):
+    """
+    Returns the LevelRules of a level, its blocked parents resolved with the current hierarchy.
+    """
+    return LevelRules(level, get_rules()[level], get_hierarchy())
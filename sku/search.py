@@ -0,0 +1,146 @@
+import time
+
+from django.db.models import Max, OuterRef, Subquery
+
+from .hierarchy import LEVELS, LEVEL_MODELS
+from .models import SKUDataMapping, SKUSearch, SKUSearchChange, SKUCount
+from .rollup import PATH_FIELDS, count_skus, path_deltas
+
+# Number of entries kept in the change log, search indexes lagging further behind are rebuilt.
+MAX_CHANGES = 100000
+
+# Seconds a gap in the change log ids is waited for, a transaction may still commit its entries.
+GAP_TIMEOUT = 5
+
+SOURCE_FIELDS = (
+    'sku', 'description', 'location_id', 'department_id', 'category_id', 'subcategory_id',
+    'location__name', 'department__name', 'category__name', 'subcategory__name',
+)
+
+SEARCH_FIELDS = (
+    'sku_id', 'description', 'location_id', 'department_id', 'category_id', 'subcategory_id',
+    'location_name', 'department_name', 'category_name', 'subcategory_name',
+)
+
+
+def search_by_names(params):
+    """
+    Returns the sku_search rows matching the location, department, category and subcategory names
+    given in params, any subset of them.
+    """
+    filters = {}
+    for param in LEVELS:
+        value = params.get(param)
+        if value is not None:
+            filters['{}_name'.format(param)] = value
+    return SKUSearch.objects.filter(**filters)
+
+
+def refresh_skus(skus, batch_size=1000):
+    """
+    Copies the SKUDataMapping rows of the given queryset, with their hierarchy names, into the
+    sku_search table. Rows are read with one join and replaced batch_size at a time, the path
+    counters are moved from the paths of the replaced rows to the new ones.
+    Run it in the transaction writing the SKUs, deleted SKUs are removed by the cascade.
+    """
+    last = None
+    while True:
+        chunk = skus if last is None else skus.filter(sku__gt=last)
+        rows = list(chunk.order_by('sku').values_list(*SOURCE_FIELDS)[:batch_size])
+        if rows:
+            # Replacing instead of upserting works the same on every backend.
+            replaced = SKUSearch.objects.filter(sku__in=[row[0] for row in rows])
+            removed = list(replaced.values_list(*PATH_FIELDS))
+            replaced.delete()
+            SKUSearch.objects.bulk_create([SKUSearch(**dict(zip(SEARCH_FIELDS, row))) for row in rows])
+            count_skus(path_deltas((row[2:6] for row in rows), removed))
+            record_changes(row[0] for row in rows)
+        if len(rows) < batch_size:
+            return
+        last = rows[-1][0]
+
+
+def refresh_nodes(level, pks):
+    """
+    Copies the current names of the given nodes into the sku_search rows below them, with one update, and logs
+    the SKUs of the renamed nodes as changed. Saving a node without changing its name changes nothing.
+    """
+    field = '{}_name'.format(level)
+    name = Subquery(LEVEL_MODELS[level].objects.filter(pk=OuterRef('{}_id'.format(level))).values('name')[:1])
+    renamed = SKUSearch.objects.filter(**{'{}_id__in'.format(level): list(pks)}).exclude(**{field: name})
+    skus = list(renamed.values_list('sku', flat=True))
+    if skus:
+        renamed.update(**{field: name})
+        # The indexes following the log rebuild anyway when it holds more entries than it keeps.
+        record_changes(skus if len(skus) <= MAX_CHANGES else [None], names=True)
+
+
+def rebuild(batch_size=10000):
+    """
+    Rebuilds the whole sku_search table and the path counters from SKUDataMapping.
+    """
+    SKUSearch.objects.all().delete()
+    SKUCount.objects.all().delete()
+    refresh_skus(SKUDataMapping.objects.all(), batch_size)
+    record_changes([None])
+
+
+def record_changes(skus, names=False):
+    """
+    Appends the written or deleted SKUs to the change log and drops its oldest entries. names marks SKUs
+    whose hierarchy names changed but not their ids.
+    """
+    SKUSearchChange.objects.bulk_create([SKUSearchChange(sku=sku, names=names) for sku in skus], batch_size=10000)
+    newest = SKUSearchChange.objects.aggregate(newest=Max('id'))['newest'] or 0
+    SKUSearchChange.objects.filter(id__lte=newest - MAX_CHANGES).delete()
+
+
+class ChangeLogFollower:
+    """
+    Position of an in-process copy of sku_search in the change log, for the indexes built from it.
+    """
+    # Whether the copy holds the hierarchy names, a copy of the ids skips the entries of renamed nodes.
+    follows_names = True
+
+    def __init__(self, last_change=0):
+        """
+        last_change is the id of the last change log entry the copy includes.
+        """
+        self.last_change = last_change
+        # Ids of the entries applied after last_change, beyond a gap, and since when the gap is open.
+        self.applied = frozenset()
+        self.gap_since = None
+
+    def read_changes(self, limit):
+        """
+        Returns the SKUs logged as changed since the position, and the position after them to pass to
+        advance once they are applied. The SKUs are None when there are more than limit of them, when
+        the log was pruned past the position or when any SKU may have changed: the copy has to be rebuilt.
+        """
+        changes = list(SKUSearchChange.objects.filter(id__gt=self.last_change).order_by('id')
+                       .values_list('id', 'sku', 'names')[:limit + 1])
+        # Entries up to MAX_CHANGES before the newest one may have been pruned from the log.
+        if len(changes) > limit or changes and changes[-1][0] - MAX_CHANGES > self.last_change:
+            return None, None
+
+        # Entries of concurrent transactions can commit out of id order, the position in the log only
+        # moves past a gap in the ids once it stayed open for GAP_TIMEOUT seconds.
+        contiguous = self.last_change
+        for pk, _, _ in changes:
+            if pk != contiguous + 1:
+                break
+            contiguous = pk
+        if contiguous == (changes[-1][0] if changes else self.last_change):
+            self.gap_since = None
+        elif self.gap_since is None:
+            self.gap_since = time.monotonic()
+        elif time.monotonic() - self.gap_since > GAP_TIMEOUT:
+            contiguous, self.gap_since = changes[-1][0], None
+
+        skus = {sku for pk, sku, names in changes if pk not in self.applied and (self.follows_names or not names)}
+        if None in skus:
+            return None, None
+        return skus, (contiguous, frozenset(pk for pk, _, _ in changes if pk > contiguous))
+
+    def advance(self, position):
+        self.last_change, self.applied = position
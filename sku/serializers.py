@@ -1,8 +1,230 @@
+from django.core.exceptions import ValidationError as DjangoValidationError
+from django.db import DatabaseError, connection, transaction
+from django.db.models import Max
 from rest_framework import serializers
+from .hierarchy import LEVELS, get_hierarchy
 from .models import Location, Department, Category, SubCategory, SKUDataMapping
+from .rules import level_rules
+from .signals import nodes_changed, skus_changed, NODE_LEVELS
 
 
-class LocationSerializer(serializers.ModelSerializer):
+class PreloadedPrimaryKeyRelatedField(serializers.PrimaryKeyRelatedField):
+    """
+    PrimaryKeyRelatedField reading the related objects preloaded by a BulkListSerializer,
+    instead of running one query per item. Outside of bulk writes it behaves as usual.
+    """
+
+    def to_internal_value(self, data):
+        preloaded = getattr(self.root, 'preloaded', {}).get(self.field_name)
+        if preloaded is None:
+            return super().to_internal_value(data)
+        if isinstance(data, bool):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+        try:
+            return preloaded[self.get_queryset().model._meta.pk.to_python(data)]
+        except KeyError:
+            self.fail('does_not_exist', pk_value=data)
+        except (TypeError, ValueError, DjangoValidationError):
+            self.fail('incorrect_type', data_type=type(data).__name__)
+
+
+class BulkListSerializer(serializers.ListSerializer):
+    """
+    List serializer of the bulk endpoints. Related objects of all items are loaded with one
+    query per relation, every item is validated on its own, and the valid ones are written with
+    bulk_create or bulk_update in one transaction. `results` holds the status of every item.
+    For updates the instance is a dict of the existing objects by pk, matched on the items' pk.
+    """
+    batch_size = 1000
+
+    def preload(self, data):
+        self.preloaded = {}
+        for name, field in self.child.fields.items():
+            if not isinstance(field, serializers.PrimaryKeyRelatedField) or field.read_only:
+                continue
+            pk_field = field.get_queryset().model._meta.pk
+            ids = set()
+            for item in data:
+                try:
+                    ids.add(pk_field.to_python(item[name]))
+                except (KeyError, TypeError, ValueError, DjangoValidationError):
+                    continue
+            self.preloaded[name] = field.get_queryset().in_bulk(ids)
+
+    def to_internal_value(self, data):
+        if not isinstance(data, list) or not all(isinstance(item, dict) for item in data):
+            raise serializers.ValidationError({'non_field_errors': ['Expected a list of objects.']})
+        self.preload(data)
+        pk_name = self.child.Meta.model._meta.pk.name
+
+        self.results = []
+        self.targets = []
+        validated = []
+        for item in data:
+            instance = None
+            if self.instance is not None:
+                pk = item.get('id', item.get(pk_name))
+                instance = self.instance.get(pk)
+                if instance is None:
+                    self.results.append({'status': 404, 'id': pk, 'errors': {'detail': 'Not found.'}})
+                    continue
+            self.child.instance = instance
+            try:
+                attrs = self.child.run_validation(item)
+            except serializers.ValidationError as exc:
+                self.results.append({'status': 400, 'errors': exc.detail})
+            else:
+                self.results.append(None)
+                self.targets.append(instance)
+                validated.append(attrs)
+        self.child.instance = None
+        return validated
+
+    def save(self, **kwargs):
+        """
+        Writes the valid items and fills in their results.
+        """
+        model = self.child.Meta.model
+        objs = []
+        if self.instance is None:
+            for attrs in self.validated_data:
+                objs.append(model(**attrs, **kwargs))
+            with transaction.atomic():
+                last = None
+                if not connection.features.can_return_rows_from_bulk_insert:
+                    last = model.objects.aggregate(last=Max('pk'))['last'] or 0
+                model.objects.bulk_create(objs, batch_size=self.batch_size)
+                self.fill_pks(model, objs, last)
+                self.changed(model, objs)
+            status = 201
+        else:
+            fields = set()
+            old = [model(**{field.attname: getattr(obj, field.attname) for field in model._meta.concrete_fields})
+                   for obj in self.targets]
+            for obj, attrs in zip(self.targets, self.validated_data):
+                for name, value in {**attrs, **kwargs}.items():
+                    if name == model._meta.pk.name:
+                        # The pk only matches the item to its object.
+                        continue
+                    setattr(obj, name, value)
+                    fields.add(name)
+                objs.append(obj)
+            with transaction.atomic():
+                if fields:
+                    model.objects.bulk_update(objs, fields, batch_size=self.batch_size)
+                self.changed(model, old + objs)
+            status = 200
+
+        written = iter(objs)
+        for index, result in enumerate(self.results):
+            if result is None:
+                obj = next(written)
+                self.results[index] = {'status': status, 'id': obj.pk, 'data': self.child.to_representation(obj)}
+        return objs
+
+    def fill_pks(self, model, objs, last):
+        """
+        Backends like MySQL return no primary keys from bulk_create, read them back: the hierarchy nodes
+        through their natural key (parent, name), the other models as the pks above `last`, the largest one
+        before the insert, which are assigned in insertion order. Raises DatabaseError when they can not all be
+        resolved, like when other objects were inserted meanwhile, so the write is rolled back.
+        """
+        missing = [obj for obj in objs if obj.pk is None]
+        if not missing:
+            return
+        if model._meta.constraints:
+            fields = [model._meta.get_field(name).attname for name in model._meta.constraints[0].fields]
+            lookup = {'{}__in'.format(name): {getattr(obj, name) for obj in missing} for name in fields}
+            pks = {tuple(row[1:]): row[0] for row in model.objects.filter(**lookup).values_list('pk', *fields)}
+            for obj in missing:
+                obj.pk = pks.get(tuple(getattr(obj, name) for name in fields))
+        elif last is not None:
+            given = {obj.pk for obj in objs if obj.pk is not None}
+            pks = [pk for pk in model.objects.filter(pk__gt=last).order_by('pk').values_list('pk', flat=True)
+                   if pk not in given]
+            if len(pks) == len(missing):
+                for obj, pk in zip(missing, pks):
+                    obj.pk = pk
+        if any(obj.pk is None for obj in missing):
+            raise DatabaseError('The ids of the created {} could not be read back, retry the request.'.format(
+                model._meta.verbose_name_plural))
+
+    def changed(self, model, objs):
+        # bulk_create and bulk_update send no signals.
+        if model is SKUDataMapping:
+            skus_changed(objs)
+        elif model in NODE_LEVELS:
+            nodes_changed(model, objs)
+
+
+class HierarchyRulesMixin:
+    """
+    Validates the name and the parent of hierarchy nodes against the ValidationRules of their level, see rules.
+    The rules are resolved once per root serializer, so every item of a bulk write is checked against the same
+    compiled rules and blocked parent ids, without queries of its own.
+    """
+
+    def get_level_rules(self):
+        rules = getattr(self.root, 'level_rules', None)
+        if rules is None:
+            rules = self.root.level_rules = level_rules(NODE_LEVELS[self.Meta.model][0])
+        return rules
+
+    def validate_name(self, value):
+        """Field level validation"""
+        error = self.get_level_rules().name_error(value)
+        if error:
+            raise serializers.ValidationError(error)
+        return value
+
+    def validate(self, data):
+        """Object level validation"""
+        depth = LEVELS.index(NODE_LEVELS[self.Meta.model][0])
+        parent = data.get(LEVELS[depth - 1]) if depth else None
+        error = self.get_level_rules().parent_error(parent.pk) if parent else None
+        if error:
+            raise serializers.ValidationError(error)
+        return data
+
+
+class ValuesListSerializer:
+    """
+    Read only serializer of values_list rows, producing the same items as a ModelSerializer without
+    building model instances or fields. The field to column mapping is worked out once per serializer
+    class, the pk column comes first so the rows can be keyset paginated.
+    """
+
+    def __init__(self, keys, columns, pk):
+        self.keys = tuple(keys)
+        # The pk is only selected ahead of the fields when they do not start with it.
+        self.columns = tuple(columns) if columns[0] == pk else (pk,) + tuple(columns)
+        self.offset = len(self.columns) - len(self.keys)
+
+    @classmethod
+    def for_serializer(cls, serializer_class, **columns):
+        """
+        Maps the fields of a ModelSerializer to their columns, the related fields to their `<name>_id`
+        column. Fields that are not model columns, like SerializerMethodFields, have to be given as
+        field name -> column lookup.
+        """
+        model = serializer_class.Meta.model
+        fields = {name: field for name, field in serializer_class().fields.items() if not field.write_only}
+        for name, field in fields.items():
+            if name not in columns:
+                columns[name] = model._meta.get_field(field.source).attname
+        return cls(fields, [columns[name] for name in fields], model._meta.pk.attname)
+
+    def queryset(self, queryset):
+        return queryset.values_list(*self.columns)
+
+    def serialize(self, rows):
+        keys = self.keys
+        if self.offset:
+            return [dict(zip(keys, row[1:])) for row in rows]
+        return [dict(zip(keys, row)) for row in rows]
+
+
+class LocationSerializer(HierarchyRulesMixin, serializers.ModelSerializer):
     departments = serializers.SerializerMethodField("get_all_departments")
 
     class Meta:
@@ -11,48 +233,73 @@ class LocationSerializer(serializers.ModelSerializer):
         # fields = '__all__'
 
     def get_all_departments(self, obj):
-        return obj.department_set.all().values_list('name')
+        return [(department.name,) for department in get_hierarchy().children('location', obj.id)]
+
 
-class DepartmentSerializer(serializers.ModelSerializer):
+class LocationTreeSerializer(serializers.BaseSerializer):
+    """
+    Read only serializer for locations with their prefetched departments, categories and subcategories.
+    Builds plain dicts without per-field overhead. With depth 1 the output matches LocationSerializer,
+    depth 2 and 3 nest the categories and subcategories of every department.
+    """
+
+    def to_representation(self, instance):
+        depth = self.context.get('depth', 1)
+        departments = instance.department_set.all()
+        if depth == 1:
+            return {'name': instance.name, 'departments': [(department.name,) for department in departments]}
+        return {'id': instance.id, 'name': instance.name,
+                'departments': [self.department(department, depth) for department in departments]}
+
+    def department(self, department, depth):
+        data = {'id': department.id, 'name': department.name, 'categories': []}
+        for category in department.category_set.all():
+            item = {'id': category.id, 'name': category.name}
+            if depth > 2:
+                item['subcategories'] = [{'id': sub.id, 'name': sub.name} for sub in category.subcategory_set.all()]
+            data['categories'].append(item)
+        return data
+
+
+class DepartmentSerializer(HierarchyRulesMixin, serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
 
     class Meta:
         model = Department
         fields = '__all__'
 
 
-class CategorySerializer(serializers.ModelSerializer):
+class CategorySerializer(HierarchyRulesMixin, serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
     department_name = serializers.SerializerMethodField('get_department_name')
 
     class Meta:
         model = Category
         fields = ('id', 'name', 'department', 'department_name')
-    
-        def get_department_name(self, obj):
-            return obj.department.name
 
+    def get_department_name(self, obj):
+        return obj.department.name
 
-    def validate_name(self, value):
-        """Field level validation"""
-        if not value.isalpha():
-            raise serializers.ValidationError("Only characters are allowed.")
-        elif len(value) > 20:
-            raise serializers.ValidationError("Max length should be 20 characters.")
-        return value
 
-    def validate(self, data):
-        """Object level validation"""
-        department = data.get('department')
-        if department.name in ["Bakery"]:
-            raise serializers.ValidationError(
-                "No more categories allowed under this department. Please select other department")
-
-        return data
-
-
-class SubCategorySerializer(serializers.ModelSerializer):
+class SubCategorySerializer(HierarchyRulesMixin, serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
 
     class Meta:
         model = SubCategory
         fields = '__all__'
 
 
+department_values = ValuesListSerializer.for_serializer(DepartmentSerializer)
+
+category_values = ValuesListSerializer.for_serializer(CategorySerializer, department_name='department__name')
+
+subcategory_values = ValuesListSerializer.for_serializer(SubCategorySerializer)
+
+
+class SKUDataMappingSerializer(serializers.ModelSerializer):
+    serializer_related_field = PreloadedPrimaryKeyRelatedField
+
+    class Meta:
+        model = SKUDataMapping
+        fields = '__all__'
+        extra_kwargs = {'sku': {'read_only': False, 'required': False}}
@@ -0,0 +1,30 @@
+"""
+Work a server process starts in the background once the application is loaded, instead of on the first requests.
+"""
+import logging
+
+from django.db import DatabaseError, connection
+
+from .column_index import get_column_index, index_enabled
+from .inverted_index import get_search_index
+from .write_behind import start_replay
+
+logger = logging.getLogger(__name__)
+
+
+def start_server():
+    """
+    Starts building the in-process indexes and replaying the write-behind journals of stopped processes, called by
+    inmar.wsgi and inmar.asgi. Management commands, migrate among them, do not start them, so they never touch the
+    database at startup.
+    """
+    start_replay()
+    try:
+        get_search_index()
+        if index_enabled():
+            get_column_index()
+    except DatabaseError:
+        logger.exception('Loading the indexes at startup failed, they are loaded on first use')
+    finally:
+        # The indexes are built by their own threads, requests get their own connections.
+        connection.close()
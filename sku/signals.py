@@ -0,0 +1,152 @@
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .hierarchy import LEVEL_MODELS, LEVELS, PARENT_FIELDS, invalidate_hierarchy, record_node_changes
+from .models import Location, Department, Category, SubCategory, SKUDataMapping, SKUSearch, ValidationRule
+from .response_cache import invalidate_tags, invalidate_tags_on_commit, node_tags, sku_tags
+from .rollup import count_skus, forget_nodes, path_deltas
+from .rules import invalidate_rules
+from .search import record_changes, refresh_nodes, refresh_skus
+from .tree import forget_tree_nodes, sync_tree
+
+NODE_LEVELS = {
+    Location: ('location', None),
+    Department: ('department', 'location_id'),
+    Category: ('category', 'department_id'),
+    SubCategory: ('subcategory', 'category_id'),
+}
+
+
+def nodes_changed(model, instances, refresh=True, deleted=False):
+    """
+    Copies the nodes' names into the sku_search table, syncs the hierarchy tree and logs the nodes as changed,
+    then invalidates the cached responses of the nodes' subtrees and the cached hierarchy once the transaction
+    commits. Called by the signals below and by bulk writes, which send none.
+    """
+    level, parent_field = NODE_LEVELS[model]
+    if any(instance.pk is None for instance in instances):
+        raise ValueError('The {} must be saved, their ids are missing.'.format(model._meta.verbose_name_plural))
+    nodes = [(instance.pk, getattr(instance, parent_field) if parent_field else None) for instance in instances]
+    record_node_changes(level, [pk for pk, _ in nodes])
+    if refresh:
+        refresh_nodes(level, {pk for pk, _ in nodes})
+    if deleted:
+        forget_tree_nodes(level, [pk for pk, _ in nodes])
+    else:
+        sync_tree(level, ((pk, parent_id, instance.name) for (pk, parent_id), instance in zip(nodes, instances)))
+
+    def invalidate():
+        # The tags are computed from the hierarchy as it was before the write, then it is dropped.
+        invalidate_tags(tag for pk, parent_id in nodes for tag in node_tags(level, pk, parent_id))
+        invalidate_hierarchy()
+
+    transaction.on_commit(invalidate)
+
+
+def skus_changed(instances, refresh=True):
+    """
+    Copies the SKUs into the sku_search table, or logs their deletion and takes them off the path
+    counters, then invalidates the cached SKU query responses covering them once the transaction commits.
+    """
+    pks = {sku.pk for sku in instances}
+    if None in pks:
+        # A SKU without pk would be left out of sku_search and the counters.
+        raise ValueError('The SKUs must be saved, their skus are missing.')
+    paths = [(sku.location_id, sku.department_id, sku.category_id, sku.subcategory_id) for sku in instances]
+    if refresh:
+        refresh_skus(SKUDataMapping.objects.filter(sku__in=pks))
+    else:
+        record_changes(pks)
+        count_skus(path_deltas(removed=paths))
+    invalidate_tags_on_commit(tag for path in set(paths) for tag in sku_tags(*path))
+
+
+def delete_skus(pks):
+    """
+    Deletes the SKUs with the given pks and their sku_search rows without sending a signal per SKU, then
+    runs skus_changed once for all of them. Returns the deleted SKUs, run it in a transaction.
+    SKUs deleted with QuerySet.delete() are not tracked, delete them with this or delete_nodes.
+    """
+    skus = list(SKUDataMapping.objects.filter(sku__in=list(pks)))
+    if skus:
+        pks = [sku.pk for sku in skus]
+        for queryset in (SKUSearch.objects.filter(sku__in=pks), SKUDataMapping.objects.filter(sku__in=pks)):
+            queryset._raw_delete(queryset.db)
+        skus_changed(skus, refresh=False)
+    return skus
+
+
+def delete_nodes(model, pks):
+    """
+    Deletes the hierarchy nodes of one level with the given pks, their subtrees and their SKUs without sending
+    a signal per deleted row: the rows are deleted level by level from the SKUs up, the nodes below are logged
+    as changed and the counters through the nodes dropped, then nodes_changed runs once for the nodes.
+    Returns the deleted nodes, run it in a transaction.
+    """
+    level = NODE_LEVELS[model][0]
+    nodes = list(model.objects.filter(pk__in=list(pks)))
+    if not nodes:
+        return nodes
+    depth = LEVELS.index(level)
+    subtree = [[node.pk for node in nodes]]
+    for child in LEVELS[depth + 1:]:
+        if not subtree[-1]:
+            break
+        subtree.append(list(LEVEL_MODELS[child].objects.filter(
+            **{'{}__in'.format(PARENT_FIELDS[child]): subtree[-1]}).values_list('pk', flat=True)))
+    below = {'{}_id__in'.format(level): subtree[0]}
+    skus = SKUDataMapping.objects.filter(**below).exists()
+    querysets = [SKUSearch.objects.filter(**below), SKUDataMapping.objects.filter(**below)]
+    querysets.extend(LEVEL_MODELS[child].objects.filter(pk__in=ids)
+                     for child, ids in reversed(list(zip(LEVELS[depth:], subtree))))
+    for queryset in querysets:
+        queryset._raw_delete(queryset.db)
+    forget_nodes(level, subtree[0])
+    for child, ids in zip(LEVELS[depth + 1:], subtree[1:]):
+        if ids:
+            record_node_changes(child, ids)
+    if skus:
+        # Any SKU below the nodes may be gone, the indexes following the change log reload.
+        record_changes([None])
+    nodes_changed(model, nodes, refresh=False, deleted=True)
+    return nodes
+
+
+@receiver(post_save, sender=Location)
+@receiver(post_save, sender=Department)
+@receiver(post_save, sender=Category)
+@receiver(post_save, sender=SubCategory)
+@receiver(post_delete, sender=Location)
+@receiver(post_delete, sender=Department)
+@receiver(post_delete, sender=Category)
+@receiver(post_delete, sender=SubCategory)
+def hierarchy_changed(sender, instance, **kwargs):
+    """
+    Invalidates the cached responses of the node's subtree and the cached hierarchy when a node is saved or deleted
+    """
+    # Deleted with QuerySet.delete() instead of delete_nodes: the sku_search rows below the node are deleted by
+    # the cascade, its path counters are not, and the SKUs of the cascade are not logged.
+    if 'created' not in kwargs:
+        forget_nodes(NODE_LEVELS[sender][0], [instance.pk])
+        record_changes([None])
+    nodes_changed(sender, [instance], refresh='created' in kwargs and not kwargs['created'],
+                  deleted='created' not in kwargs)
+
+
+@receiver(post_save, sender=SKUDataMapping)
+def sku_changed(sender, instance, **kwargs):
+    """
+    Invalidates the cached SKU query responses covering the SKU. Deleted SKUs go through delete_skus, a
+    post_delete receiver would make every cascade load and signal its SKUs one by one.
+    """
+    skus_changed([instance])
+
+
+@receiver(post_save, sender=ValidationRule)
+@receiver(post_delete, sender=ValidationRule)
+def rule_changed(sender, instance, **kwargs):
+    """
+    Drops the compiled validation rules of every worker once the transaction commits
+    """
+    transaction.on_commit(invalidate_rules)
@@ -0,0 +1,200 @@
+"""
+Snapshot files of NumPy arrays, memory-mapped when read so the processes reading the same file share
+its pages and only the parts they touch are read from disk.
+A file starts with MAGIC, the format version and the length of a JSON header, followed by the header,
+which holds the metadata of the snapshot and the dtype, shape and offset of every array, then by the
+arrays themselves, each aligned on ALIGNMENT bytes.
+Strings are stored in string tables, their UTF-8 bytes back to back in one array and their offsets in another.
+"""
+import json
+import mmap
+import os
+import struct
+import threading
+
+import numpy as np
+from django.conf import settings
+
+MAGIC = b'SKUSNAP\0'
+FORMAT_VERSION = 1
+PREAMBLE = struct.Struct('<8sII')
+ALIGNMENT = 64
+
+CATALOG_KIND = 'catalog'
+
+# Metadata every catalog snapshot holds, see catalog.dump_catalog.
+CATALOG_META = ('last_change', 'last_hierarchy_change', 'location', 'department', 'category', 'subcategory', 'skus',
+                'strings', 'written_at')
+
+
+class SnapshotError(ValueError):
+    """
+    A file that is not a readable snapshot: another file, another format version, or a truncated or corrupt one.
+    """
+
+
+def aligned(offset):
+    return -(-offset // ALIGNMENT) * ALIGNMENT
+
+
+def write_snapshot(path, arrays, **meta):
+    """
+    Writes the arrays, a dict of name -> array, with the JSON-able metadata. The file is written next to
+    the path then renamed over it, readers never see a partial snapshot.
+    """
+    arrays = {name: np.ascontiguousarray(array) for name, array in arrays.items()}
+    entries = {}
+    offset = 0
+    for name, array in arrays.items():
+        entries[name] = {'dtype': array.dtype.str, 'shape': list(array.shape), 'offset': offset}
+        offset = aligned(offset + array.nbytes)
+    header = json.dumps({'meta': meta, 'arrays': entries}).encode()
+    start = aligned(PREAMBLE.size + len(header))
+
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    temporary = '{}.{}.tmp'.format(path, os.getpid())
+    try:
+        with open(temporary, 'wb') as output:
+            output.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)) + header)
+            for name, array in arrays.items():
+                output.seek(start + entries[name]['offset'])
+                output.write(memoryview(array).cast('B') if array.size else b'')
+            output.truncate(start + offset)
+            output.flush()
+            os.fsync(output.fileno())
+        os.replace(temporary, path)
+    except BaseException:
+        if os.path.exists(temporary):
+            os.remove(temporary)
+        raise
+
+
+class Snapshot:
+    """
+    A snapshot file mapped in memory: meta holds its metadata, arrays the read only arrays over the mapping.
+    A file that can not be read as a snapshot raises SnapshotError, a missing or unreadable one OSError.
+    """
+
+    def __init__(self, path):
+        with open(path, 'rb') as source:
+            try:
+                magic, version, length = PREAMBLE.unpack(source.read(PREAMBLE.size))
+            except struct.error:
+                raise SnapshotError('{} is too short for a snapshot file.'.format(path)) from None
+            if magic != MAGIC:
+                raise SnapshotError('{} is not a snapshot file.'.format(path))
+            if version != FORMAT_VERSION:
+                raise SnapshotError('{} has format version {}, version {} is expected.'.format(
+                    path, version, FORMAT_VERSION))
+            try:
+                header = json.loads(source.read(length))
+            except ValueError as ex:
+                raise SnapshotError('{} has a corrupt header: {}'.format(path, ex)) from None
+            # An empty file can not be mapped, a snapshot always has its header.
+            self.mapping = mmap.mmap(source.fileno(), 0, access=mmap.ACCESS_READ)
+        start = aligned(PREAMBLE.size + length)
+        self.path = path
+        self.arrays = {}
+        try:
+            self.meta = header['meta']
+            if not isinstance(self.meta, dict):
+                raise TypeError('the metadata is not an object')
+            for name, entry in header['arrays'].items():
+                dtype = np.dtype(entry['dtype'])
+                count = int(np.prod(entry['shape'], dtype=np.int64))
+                self.arrays[name] = np.frombuffer(self.mapping, dtype, count, start + entry['offset']).reshape(
+                    entry['shape'])
+        except (KeyError, TypeError, ValueError, AttributeError) as ex:
+            # Arrays reaching past the end of a truncated file raise ValueError.
+            raise SnapshotError('{} has a corrupt header: {!r}'.format(path, ex)) from None
+
+
+def string_table(strings):
+    """
+    Returns the offsets and the data arrays of a string table of the strings, string i is the UTF-8 data
+    between offsets i and i + 1.
+    """
+    encoded = [string.encode() for string in strings]
+    offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+    np.cumsum([len(data) for data in encoded], out=offsets[1:])
+    return offsets, np.frombuffer(b''.join(encoded), dtype=np.uint8)
+
+
+class StringTable:
+    """
+    The strings of a string table, decoded when they are read.
+    """
+
+    def __init__(self, offsets, data):
+        self.offsets = offsets
+        self.data = memoryview(data)
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __getitem__(self, index):
+        return str(self.data[self.offsets[index]:self.offsets[index + 1]], 'utf-8')
+
+    def decode(self, indexes):
+        """
+        Returns the list of the strings at the indexes, an array.
+        """
+        data = self.data
+        starts, ends = self.offsets[indexes].tolist(), self.offsets[indexes + 1].tolist()
+        return [str(data[start:end], 'utf-8') for start, end in zip(starts, ends)]
+
+
+class CatalogSnapshot(Snapshot):
+    """
+    A catalog snapshot written by dumpcatalog: the locations, departments, categories and subcategories and the
+    SKUs, with the positions in the sku_search change log and the hierarchy change log it was written at, the
+    high-water marks from which the processes mapping it catch up.
+    For every level `<level>.id` holds the ids, `<level>.name` the indexes of the names in the string table and
+    `<level>.parent` the parent ids, below the locations. The SKUs are stored like the column index, see
+    column_index.ColumnIndex, with `description` holding the indexes of their descriptions, and the `search.`
+    arrays hold the search index, see inverted_index.SearchIndex, its terms in their own string table.
+    """
+
+    def __init__(self, path):
+        super().__init__(path)
+        if self.meta.get('kind') != CATALOG_KIND:
+            raise SnapshotError('{} is not a catalog snapshot.'.format(path))
+        missing = [key for key in CATALOG_META if key not in self.meta]
+        missing += [name for name in ('strings.offsets', 'strings.data') if name not in self.arrays]
+        if missing:
+            raise SnapshotError('{} is a catalog snapshot without {}.'.format(path, ', '.join(missing)))
+        self.strings = StringTable(self.arrays['strings.offsets'], self.arrays['strings.data'])
+
+    def node_rows(self, level):
+        """
+        Returns the (id, name, parent_id) rows of the nodes of a level, ordered by id.
+        """
+        ids = self.arrays[level + '.id']
+        parents = self.arrays[level + '.parent'].tolist() if level + '.parent' in self.arrays else [None] * len(ids)
+        # Names repeat across parents, each is decoded once.
+        unique, inverse = np.unique(self.arrays[level + '.name'], return_inverse=True)
+        names = self.strings.decode(unique)
+        return list(zip(ids.tolist(), [names[index] for index in inverse.tolist()], parents))
+
+
+_catalog = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog():
+    """
+    Returns the catalog snapshot of SKU_CATALOG_SNAPSHOT, mapped on first use and shared by the indexes of this
+    process, or None when no snapshot is configured or it can not be read.
+    Only the pages read are loaded from disk, and they are shared with the other processes mapping it.
+    """
+    global _catalog
+    path = getattr(settings, 'SKU_CATALOG_SNAPSHOT', None)
+    if not path:
+        return None
+    with _catalog_lock:
+        if _catalog is None or _catalog.path != path:
+            try:
+                _catalog = CatalogSnapshot(path)
+            except (OSError, SnapshotError):
+                return None
+        return _catalog
@@ -0,0 +1,66 @@
+import numpy as np
+import pandas as pd
+
+SKU_COLUMNS = ['SKU', 'NAME', 'LOCATION', 'DEPARTMENT', 'CATEGORY', 'SUBCATEGORY']
+
+META_COLUMNS = ['Location', 'Department', 'Category', 'SubCategory']
+
+
+class CatalogShape:
+    """
+    Shape of a synthetic catalog: number of locations, departments per location, categories
+    per department and subcategories per category, plus the total number of SKUs.
+    """
+
+    def __init__(self, locations=10, departments=20, categories=20, subcategories=20, skus=10000):
+        self.locations = locations
+        self.departments = departments
+        self.categories = categories
+        self.subcategories = subcategories
+        self.skus = skus
+
+    @property
+    def leaves(self):
+        return self.locations * self.departments * self.categories * self.subcategories
+
+    def names(self, leaf):
+        """
+        Returns the (location, department, category, subcategory) name arrays of the given leaf indexes.
+        """
+        leaf = np.asarray(leaf)
+        sub = leaf % self.subcategories
+        cat = leaf // self.subcategories % self.categories
+        dpt = leaf // (self.subcategories * self.categories) % self.departments
+        loc = leaf // (self.subcategories * self.categories * self.departments)
+        return (
+            np.char.add('Location ', loc.astype(str)),
+            np.char.add('Department ', dpt.astype(str)),
+            np.char.add('Category ', cat.astype(str)),
+            np.char.add('SubCategory ', sub.astype(str)),
+        )
+
+
+def meta_data_frame(shape):
+    """
+    Returns every hierarchy path of the shape in the meta_data.csv layout.
+    """
+    return pd.DataFrame(dict(zip(META_COLUMNS, shape.names(np.arange(shape.leaves)))))
+
+
+def sku_data_frames(shape, chunksize=100000, seed=0):
+    """
+    Yields the SKUs of the shape in the sku_data.txt layout, chunksize rows at a time.
+    SKUs are spread uniformly over the leaves, the same seed gives the same catalog.
+    """
+    rng = np.random.default_rng(seed)
+    for start in range(0, shape.skus, chunksize):
+        sku = np.arange(start + 1, min(start + chunksize, shape.skus) + 1)
+        loc, dpt, cat, sub = shape.names(rng.integers(0, shape.leaves, len(sku)))
+        yield pd.DataFrame({
+            'SKU': sku,
+            'NAME': np.char.add('SKUDESC', sku.astype(str)),
+            'LOCATION': loc,
+            'DEPARTMENT': dpt,
+            'CATEGORY': cat,
+            'SUBCATEGORY': sub,
+        }, columns=SKU_COLUMNS, index=sku - 1)
@@ -1,3 +1,1016 @@
-from django.test import TestCase
+import csv
+import json
+import os
+import shutil
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+import numpy as np
+from django.apps import apps
+from django.core.management import CommandError, call_command
+from django.db import DatabaseError, OperationalError, connection, transaction
+from django.db.models import Count
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from . import column_index, inverted_index
+from .catalog import dump_catalog
+from .column_index import ColumnIndex, get_column_index, wait_column_index
+from .export import EXPORT_COLUMNS
+from .hierarchy import get_hierarchy
+from .inverted_index import SearchIndex, get_search_index, wait_search_index
+from .loaders import load_files_parallel
+from .models import (Location, Department, Category, SubCategory, SKUDataMapping, ImportState, SKUSearch,
+                     SKUSearchChange, ValidationRule, SKUCount, HierarchyNode, HierarchyClosure)
+from .pagination import keyset_iterator
+from .renderers import dumps
+from .rollup import PATH_FIELDS, rebuild_counts
+from .rules import compile_rules
+from .search import ChangeLogFollower, record_changes, search_by_names
+from .serializers import (CategorySerializer, DepartmentSerializer, SubCategorySerializer, category_values,
+                          department_values, subcategory_values)
+from .server import start_server
+from .signals import delete_skus
+from .snapshot import CatalogSnapshot, FORMAT_VERSION, MAGIC, PREAMBLE, Snapshot, SnapshotError, write_snapshot
+from .tree import rebuild_tree
+from .write_behind import RECORD_FIELDS, checkpoint_path, replay_journals, write_batch, write_checkpoint
+
+
+class ConsistencyMixin:
+    """
+    Checks the read models kept up to date on writes against the hierarchy and the SKUs they are built from.
+    """
+
+    def assertConsistent(self):
+        skus = {(sku.sku, sku.description, sku.location.name, sku.department.name, sku.category.name,
+                 sku.subcategory.name) for sku in SKUDataMapping.objects.select_related(
+                     'location', 'department', 'category', 'subcategory')}
+        self.assertEqual(set(SKUSearch.objects.values_list(
+            'sku', 'description', 'location_name', 'department_name', 'category_name', 'subcategory_name')), skus)
+
+        counts = set(SKUCount.objects.filter(count__gt=0).values_list(*PATH_FIELDS, 'count'))
+        self.assertEqual(counts, set(SKUDataMapping.objects.values_list(*PATH_FIELDS).annotate(Count('sku'))
+                                     .order_by()))
+        rebuild_counts()
+        self.assertEqual(set(SKUCount.objects.filter(count__gt=0).values_list(*PATH_FIELDS, 'count')), counts)
+
+        tree = self.tree()
+        rebuild_tree()
+        self.assertEqual(self.tree(), tree)
+
+    def tree(self):
+        nodes = set(HierarchyNode.objects.values_list('level', 'node_id', 'name', 'parent__level', 'parent__node_id'))
+        closure = set(HierarchyClosure.objects.values_list(
+            'ancestor__level', 'ancestor__node_id', 'descendant__level', 'descendant__node_id', 'depth'))
+        return nodes, closure
+
+
+def create_path(location, department, category, subcategory):
+    location = Location.objects.get_or_create(name=location)[0]
+    department = Department.objects.get_or_create(name=department, location=location)[0]
+    category = Category.objects.get_or_create(name=category, department=department)[0]
+    subcategory = SubCategory.objects.get_or_create(name=subcategory, category=category)[0]
+    return location, department, category, subcategory
+
+
+def create_skus(subcategory, count, description='SKU'):
+    category = subcategory.category
+    return [SKUDataMapping.objects.create(description='{}{}'.format(description, number),
+                                          location_id=category.department.location_id,
+                                          department_id=category.department_id, category=category,
+                                          subcategory=subcategory)
+            for number in range(count)]
+
+
+SKU_HEADER = 'SKU,NAME,LOCATION,DEPARTMENT,CATEGORY,SUBCATEGORY\n'
+
+META_HEADER = 'Location,Department,Category,SubCategory\n'
+
+
+class TempDirMixin:
+    """
+    Gives every test a temporary directory for the files it loads.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.directory)
+
+    def write_file(self, name, header, rows):
+        path = os.path.join(self.directory, name)
+        with open(path, 'w') as output:
+            output.write(header + ''.join(row + '\n' for row in rows))
+        return path
+
+
+def sku_item(description, subcategory, **kwargs):
+    category = subcategory.category
+    return dict(description=description, location=category.department.location_id, department=category.department_id,
+                category=category.id, subcategory=subcategory.id, **kwargs)
+
+
+def no_returned_pks():
+    """
+    Makes bulk_create return no primary keys, as on MySQL.
+    """
+    return mock.patch.object(type(connection.features), 'can_return_rows_from_bulk_insert', False)
+
+
+class BulkWriteMixin:
+
+    def bulk_write(self, method, model, items):
+        """
+        Sends the items to the bulk endpoint of the model and runs the on_commit callbacks of the write.
+        """
+        with self.captureOnCommitCallbacks(execute=True):
+            return getattr(self.client, method)('/api/v1/bulk/{}/'.format(model), json.dumps(items),
+                                                content_type='application/json')
+
+
+@override_settings(SKU_VERSION_CHECK_INTERVAL=0)
+class BulkViewTests(BulkWriteMixin, ConsistencyMixin, TestCase):
+
+    def setUp(self):
+        self.location, self.department, self.category, self.subcategory = create_path(
+            'North', 'Bakery', 'Bread', 'Bagels')
+
+    def test_create(self):
+        response = self.bulk_write('post', 'sku', [sku_item('Plain', self.subcategory),
+                                                   sku_item('Seeded', self.subcategory)])
+        self.assertEqual(response.status_code, 201)
+        pks = [result['id'] for result in response.json()]
+        self.assertEqual(list(SKUDataMapping.objects.filter(sku__in=pks).values_list('description', flat=True)
+                              .order_by('sku')), ['Plain', 'Seeded'])
+        self.assertConsistent()
+
+    def test_create_without_returned_pks(self):
+        with no_returned_pks():
+            response = self.bulk_write('post', 'location', [{'name': 'East'}, {'name': 'West'}])
+            self.assertEqual(response.status_code, 201)
+            self.assertEqual([Location.objects.get(pk=result['id']).name for result in response.json()],
+                             ['East', 'West'])
+
+            response = self.bulk_write('post', 'sku', [sku_item('Plain', self.subcategory),
+                                                       sku_item('Given', self.subcategory, sku=900),
+                                                       sku_item('Seeded', self.subcategory)])
+        self.assertEqual(response.status_code, 201)
+        pks = [result['id'] for result in response.json()]
+        self.assertNotIn(None, pks)
+        self.assertEqual(pks[1], 900)
+        self.assertEqual([SKUDataMapping.objects.get(sku=pk).description for pk in pks], ['Plain', 'Given', 'Seeded'])
+        self.assertConsistent()
+
+    def test_update(self):
+        sku = create_skus(self.subcategory, 1)[0]
+        other = create_path('South', 'Deli', 'Cheese', 'Hard')[3]
+        response = self.bulk_write('patch', 'sku', [{'sku': sku.pk, **sku_item('Moved', other)}])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(SKUSearch.objects.get(sku=sku.pk).location_name, 'South')
+        self.bulk_write('patch', 'location', [{'id': self.location.pk, 'name': 'Northeast'}])
+        self.assertEqual(HierarchyNode.objects.get(level=0, node_id=self.location.pk).name, 'Northeast')
+        self.assertConsistent()
+
+    def test_delete_skus(self):
+        response = self.bulk_write('post', 'sku', [sku_item('SKU{}'.format(n), self.subcategory) for n in range(20)])
+        pks = [result['id'] for result in response.json()]
+        with CaptureQueriesContext(connection) as one:
+            self.bulk_write('delete', 'sku', pks[:1])
+        # No query per SKU, the signals are not sent.
+        with CaptureQueriesContext(connection) as many:
+            response = self.bulk_write('delete', 'sku', pks[1:10] + [999999])
+        self.assertEqual(len(many), len(one))
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([result['status'] for result in response.json()], [204] * 9 + [404])
+        self.assertEqual(set(SKUDataMapping.objects.values_list('sku', flat=True)), set(pks[10:]))
+        self.assertConsistent()
+
+    def test_delete_subtree(self):
+        _, department, _, subcategory = create_path('North', 'Deli', 'Cheese', 'Hard')
+        self.bulk_write('post', 'sku', [sku_item('Plain', self.subcategory), sku_item('Gouda', subcategory)])
+        response = self.bulk_write('delete', 'department', [department.pk])
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(SubCategory.objects.filter(pk=subcategory.pk).exists())
+        self.assertEqual(list(SKUDataMapping.objects.values_list('description', flat=True)), ['Plain'])
+        self.assertFalse(HierarchyNode.objects.filter(level=3, node_id=subcategory.pk).exists())
+        self.assertConsistent()
+
+        self.bulk_write('delete', 'location', [self.location.pk])
+        self.assertFalse(SKUDataMapping.objects.exists())
+        self.assertFalse(HierarchyNode.objects.exists())
+        self.assertConsistent()
+
+
+@override_settings(SKU_VERSION_CHECK_INTERVAL=0)
+class NodeDeleteTests(ConsistencyMixin, TestCase):
+
+    def delete(self, url):
+        with self.captureOnCommitCallbacks(execute=True):
+            return self.client.delete(url)
+
+    def test_queries_do_not_grow_with_skus(self):
+        first = create_path('North', 'Bakery', 'Bread', 'Buns')[3]
+        few = create_path('North', 'Bakery', 'Bread', 'Bagels')[3]
+        many = create_path('North', 'Bakery', 'Bread', 'Rolls')[3]
+        for subcategory, count in ((first, 1), (few, 1), (many, 30)):
+            create_skus(subcategory, count)
+        # The first write creates the shared versions.
+        self.delete('/api/v1/subcategory/{}/'.format(first.pk))
+        with CaptureQueriesContext(connection) as one:
+            self.assertEqual(self.delete('/api/v1/subcategory/{}/'.format(few.pk)).status_code, 204)
+        with CaptureQueriesContext(connection) as thirty:
+            self.assertEqual(self.delete('/api/v1/subcategory/{}/'.format(many.pk)).status_code, 204)
+        self.assertEqual(len(thirty), len(one))
+        self.assertFalse(SKUDataMapping.objects.exists())
+        self.assertConsistent()
+
+    def test_every_level(self):
+        location, department, category, subcategory = create_path('North', 'Bakery', 'Bread', 'Bagels')
+        create_skus(subcategory, 3)
+        for url, model, pk in (('/api/v1/subcategory/{}/', SubCategory, subcategory.pk),
+                               ('/api/v1/category/{}/', Category, category.pk),
+                               ('/api/v1/departments/{}/', Department, department.pk),
+                               ('/api/v1/location/{}/', Location, location.pk)):
+            self.assertEqual(self.delete(url.format(pk)).status_code, 204)
+            self.assertFalse(model.objects.filter(pk=pk).exists())
+            self.assertConsistent()
+
+
+@override_settings(SKU_VERSION_CHECK_INTERVAL=0)
+class ResponseCacheTests(BulkWriteMixin, TestCase):
+
+    def setUp(self):
+        self.subcategory = create_path('North', 'Bakery', 'Bread', 'Bagels')[3]
+
+    def skus(self, location='North'):
+        return self.client.get('/api/v1/get_skus_by_meta_data/', {'location': location}).json()
+
+    def test_writes_evict_cached_responses(self):
+        self.bulk_write('post', 'sku', [sku_item('Plain', self.subcategory)])
+        self.assertEqual(len(self.skus()), 1)
+        # A write bypassing the signals is not seen, the response is cached.
+        SKUSearch.objects.update(description='Changed')
+        first = self.client.get('/api/v1/get_skus_by_meta_data/', {'location': 'North'})
+        self.assertEqual(self.client.get('/api/v1/get_skus_by_meta_data/', {'location': 'North'})['ETag'],
+                         first['ETag'])
+
+        pk = self.bulk_write('post', 'sku', [sku_item('Seeded', self.subcategory)]).json()[0]['id']
+        self.assertEqual(len(self.skus()), 2)
+        self.bulk_write('delete', 'sku', [pk])
+        self.assertEqual(len(self.skus()), 1)
+
+    def test_renamed_nodes_are_resolved(self):
+        self.bulk_write('post', 'sku', [sku_item('Plain', self.subcategory)])
+        self.assertEqual(len(self.skus()), 1)
+        self.bulk_write('patch', 'location', [{'id': self.subcategory.category.department.location_id,
+                                               'name': 'South'}])
+        self.assertEqual(self.skus(), [])
+        self.assertEqual([row[1] for row in self.skus('South')], ['South'])
+
+    def test_orm_deletes(self):
+        skus = create_skus(self.subcategory, 2)
+        self.assertEqual(len(self.skus()), 2)
+        with self.captureOnCommitCallbacks(execute=True):
+            skus[0].delete()
+        self.assertEqual(len(self.skus()), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            Location.objects.filter(name='North').delete()
+        self.assertEqual(self.skus(), [])
+
+
+class CascadeTests(ConsistencyMixin, TestCase):
+
+    def test_sku_delete(self):
+        skus = create_skus(create_path('North', 'Bakery', 'Bread', 'Bagels')[3], 2)
+        self.assertEqual(skus[0].delete(), (1, {'sku.SKUDataMapping': 1}))
+        self.assertEqual(list(SKUSearch.objects.values_list('sku', flat=True)), [skus[1].pk])
+        self.assertConsistent()
+
+    def test_queryset_delete_does_not_signal_skus(self):
+        few = create_path('North', 'Bakery', 'Bread', 'Bagels')[3]
+        many = create_path('South', 'Bakery', 'Bread', 'Bagels')[3]
+        create_skus(few, 1)
+        create_skus(many, 30)
+        with CaptureQueriesContext(connection) as one:
+            Location.objects.filter(name='North').delete()
+        with CaptureQueriesContext(connection) as thirty:
+            Location.objects.filter(name='South').delete()
+        self.assertEqual(len(thirty), len(one))
+        self.assertFalse(SKUSearch.objects.exists())
+        self.assertConsistent()
+
+
+@override_settings(SKU_VERSION_CHECK_INTERVAL=0)
+class SearchTableTests(ConsistencyMixin, TestCase):
+
+    def setUp(self):
+        self.subcategory = create_path('North', 'Bakery', 'Bread', 'Bagels')[3]
+        self.skus = create_skus(self.subcategory, 3)
+        create_skus(create_path('South', 'Bakery', 'Bread', 'Rolls')[3], 2)
+
+    def changes(self):
+        return list(SKUSearchChange.objects.order_by('id').values_list('sku', flat=True))
+
+    def test_search_by_names(self):
+        self.assertEqual(search_by_names({'department': 'Bakery'}).count(), 5)
+        self.assertEqual(set(search_by_names({'location': 'North', 'subcategory': 'Bagels'})
+                             .values_list('sku', flat=True)), {sku.pk for sku in self.skus})
+        self.assertFalse(search_by_names({'location': 'North', 'subcategory': 'Rolls'}).exists())
+
+    def test_rename_logs_its_skus(self):
+        department = self.subcategory.category.department
+        logged = len(self.changes())
+        department.name = 'Pastry'
+        department.save()
+        self.assertEqual(sorted(self.changes()[logged:]), [sku.pk for sku in self.skus])
+        self.assertEqual(search_by_names({'department': 'Pastry'}).count(), 3)
+        self.assertConsistent()
+
+    def test_save_without_rename_logs_nothing(self):
+        logged = self.changes()
+        self.subcategory.category.department.save()
+        self.subcategory.save()
+        self.assertEqual(self.changes(), logged)
+        self.assertConsistent()
+
+
+@contextmanager
+def held_builds(index_class):
+    """
+    Holds the builds of index_class from sku_search in their background thread until the block exits.
+    """
+    release = threading.Event()
+    from_db = index_class.from_db
+    with mock.patch.object(index_class, 'from_db', lambda: release.wait() and from_db()):
+        try:
+            yield
+        finally:
+            release.set()
+
+
+@override_settings(SKU_VERSION_CHECK_INTERVAL=0)
+class ColumnIndexTests(BulkWriteMixin, TestCase):
+
+    def setUp(self):
+        self.bagels = create_path('North', 'Bakery', 'Bread', 'Bagels')[3]
+        self.rolls = create_path('South', 'Bakery', 'Bread', 'Rolls')[3]
+        create_skus(self.bagels, 3)
+        create_skus(self.rolls, 2)
+
+    def assertMatchesDB(self, index):
+        for filters in ({}, {'department': 'Bakery'}, {'location': 'North'}, {'location': 'South', 'category': 'Bread'},
+                        {'subcategory': 'Rolls', 'location': 'North'}):
+            ids = {'{}_id'.format(level): get_hierarchy().ids(level, name) for level, name in filters.items()}
+            self.assertEqual(index.filter(ids).tolist(), list(search_by_names(filters).order_by('sku')
+                                                               .values_list('sku', flat=True)))
+
+    def test_from_db(self):
+        self.assertMatchesDB(ColumnIndex.from_db(chunk_size=2))
+
+    def test_catch_up(self):
+        index = ColumnIndex.from_db()
+        pk = self.bulk_write('post', 'sku', [sku_item('Plain', self.rolls)]).json()[0]['id']
+        self.bulk_write('delete', 'sku', [search_by_names({'subcategory': 'Bagels'}).values_list('sku', flat=True)[0]])
+        self.assertTrue(index.catch_up())
+        self.assertIn(pk, index.filter({}).tolist())
+        self.assertMatchesDB(index)
+        self.assertMatchesDB(index.compact())
+
+    def test_renames_are_ignored(self):
+        index = ColumnIndex.from_db()
+        follower = ChangeLogFollower(index.last_change)
+        department = self.bagels.category.department
+        department.name = 'Pastry'
+        department.save()
+        self.assertEqual(index.read_changes(10)[0], set())
+        self.assertEqual(len(follower.read_changes(10)[0]), 3)
+        # A rename of more SKUs than the log keeps does not rebuild the ids either.
+        record_changes([None], names=True)
+        self.assertTrue(index.catch_up())
+        self.assertIsNone(follower.read_changes(10)[0])
+
+
+@override_settings(SKU_COLUMN_INDEX=True, SKU_VERSION_CHECK_INTERVAL=0)
+class ColumnIndexBuildTests(TransactionTestCase):
+
+    def setUp(self):
+        column_index.drop_column_index()
+        create_skus(create_path('North', 'Bakery', 'Bread', 'Bagels')[3], 3)
+
+    def tearDown(self):
+        builder = column_index._builder
+        if builder is not None:
+            builder.join()
+        column_index.drop_column_index()
+
+    def skus(self):
+        return self.client.get('/api/v1/get_skus_by_meta_data/', {'location': 'North'}).json()
+
+    def test_built_in_background(self):
+        with held_builds(ColumnIndex):
+            self.assertIsNone(get_column_index())
+            # The database answers until the index is built.
+            self.assertEqual(len(self.skus()), 3)
+            self.assertIsNone(get_column_index())
+        self.assertEqual(len(wait_column_index()), 3)
+
+    def test_rebuilt_in_background(self):
+        index = wait_column_index()
+        record_changes([None])
+        with held_builds(ColumnIndex):
+            # The current index keeps answering while the new one is built.
+            self.assertIs(get_column_index(), index)
+            self.assertEqual(len(self.skus()), 3)
+            self.assertIs(get_column_index(), index)
+        rebuilt = wait_column_index()
+        self.assertIsNot(rebuilt, index)
+        self.assertEqual(len(rebuilt), 3)
+
+
+@override_settings(SKU_VERSION_CHECK_INTERVAL=0)
+class SearchIndexTests(BulkWriteMixin, TestCase):
+
+    def setUp(self):
+        self.bagels = create_path('North', 'Bakery', 'Bread', 'Bagels')[3]
+        self.rolls = create_path('South', 'Bakery', 'Bread', 'Rolls')[3]
+        self.plain = create_skus(self.bagels, 2, 'Plain bagel ')
+        self.seeded = create_skus(self.rolls, 2, 'Seeded roll ')
+
+    def found(self, index, query):
+        return [sku for sku, _ in index.search(query)]
+
+    def test_from_db(self):
+        index = SearchIndex.from_db(chunk_size=2)
+        self.assertEqual(self.found(index, 'bag'), [sku.pk for sku in self.plain])
+        self.assertEqual(self.found(index, 'bakery se'), [sku.pk for sku in self.seeded])
+        self.assertEqual(self.found(index, 'north rolls'), [])
+        self.assertEqual(index.suggest('se'), [('seeded', 2)])
+        self.assertEqual(index.suggest('ba', 1), [('bakery', 4)])
+
+    def test_catch_up(self):
+        index = SearchIndex.from_db()
+        pk = self.bulk_write('post', 'sku', [sku_item('Seeded bagel', self.bagels)]).json()[0]['id']
+        self.bulk_write('delete', 'sku', [self.plain[0].pk])
+        department = self.rolls.category.department
+        department.name = 'Pastry'
+        department.save()
+        self.assertTrue(index.catch_up())
+        self.assertEqual(self.found(index, 'bagel'), [self.plain[1].pk, pk])
+        self.assertEqual(self.found(index, 'pastry'), [sku.pk for sku in self.seeded])
+        self.assertEqual(self.found(index.compact(), 'seeded'), [sku.pk for sku in self.seeded] + [pk])
+
+
+@override_settings(SKU_VERSION_CHECK_INTERVAL=0)
+class SearchIndexBuildTests(TransactionTestCase):
+
+    def setUp(self):
+        inverted_index.drop_search_index()
+        self.skus = create_skus(create_path('North', 'Bakery', 'Bread', 'Bagels')[3], 3, 'Plain bagel ')
+
+    def tearDown(self):
+        builder = inverted_index._builder
+        if builder is not None:
+            builder.join()
+        inverted_index.drop_search_index()
+
+    def test_built_in_background(self):
+        with held_builds(SearchIndex):
+            self.assertIsNone(get_search_index())
+            response = self.client.get('/api/v1/sku/search/', {'q': 'bagel'})
+            self.assertEqual(response.status_code, 503)
+            self.assertEqual(response['Retry-After'], '1')
+        wait_search_index()
+        response = self.client.get('/api/v1/sku/search/', {'q': 'bagel'})
+        self.assertEqual([hit['sku'] for hit in response.json()], [sku.pk for sku in self.skus])
+
+
+class ImportTests(ConsistencyMixin, TempDirMixin, TestCase):
+
+    def importdata(self, rows, **options):
+        stdout = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('importdata', self.write_file('meta_data.csv', META_HEADER, rows), incremental=True,
+                         stdout=stdout, **options)
+        return stdout.getvalue()
+
+    def loadskudata(self, rows):
+        stdout = StringIO()
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('loadskudata', self.write_file('sku_data.txt', SKU_HEADER, rows), incremental=True,
+                         stdout=stdout)
+        return stdout.getvalue()
+
+    def test_incremental_deletes(self):
+        self.importdata(['North,Bakery,Bread,Bagels', 'North,Bakery,Bread,Muffins', 'North,Bakery,Bread,Donuts'])
+        muffins = SubCategory.objects.get(name='Muffins')
+        SKUDataMapping.objects.create(description='Blueberry', location_id=muffins.category.department.location_id,
+                                      department_id=muffins.category.department_id, category_id=muffins.category_id,
+                                      subcategory=muffins)
+
+        output = self.importdata(['North,Bakery,Bread,Bagels'])
+        self.assertIn('1 subcategories deleted with 0 SKUs', output)
+        self.assertIn('1 subcategories missing from the input kept, 1 SKUs reference them', output)
+        self.assertEqual(set(SubCategory.objects.values_list('name', flat=True)), {'Bagels', 'Muffins'})
+        self.assertEqual(SKUDataMapping.objects.count(), 1)
+        self.assertConsistent()
+
+        output = self.importdata(['North,Bakery,Bread,Bagels'], delete_skus=True)
+        self.assertIn('1 subcategories deleted with 1 SKUs', output)
+        self.assertEqual(list(SubCategory.objects.values_list('name', flat=True)), ['Bagels'])
+        self.assertFalse(SKUDataMapping.objects.exists())
+        self.assertConsistent()
+
+    def test_quarantined_tuples_are_kept(self):
+        self.importdata(['North,Bakery,Bread,Bagels', 'North,Bakery,Bread,Muffins', 'North,Bakery,Bread,Donuts'])
+        # The Bagels and Muffins rows are quarantined, their category is spelled differently from the first row's.
+        output = self.importdata(['North,Bakery,bread,Rolls', 'North,Bakery,Bread,Bagels',
+                                  'North,Bakery,Bread,Muffins'])
+        self.assertIn('2 rows skipped', output)
+        self.assertIn('1 subcategories deleted with 0 SKUs', output)
+        self.assertEqual(set(SubCategory.objects.values_list('name', flat=True)), {'Bagels', 'Muffins', 'Rolls'})
+        self.assertConsistent()
+
+    def test_quarantined_skus_are_kept(self):
+        self.loadskudata(['1,Plain,North,Bakery,Bread,Bagels', '2,Seeded,North,Bakery,Bread,Bagels',
+                          '3,Sesame,North,Bakery,Bread,Bagels'])
+        output = self.loadskudata(['1,Plain,North,Bakery,Bread,Bagels', '2,,North,Bakery,Bread,Bagels'])
+        self.assertIn('1 SKUs deleted', output)
+        self.assertEqual(dict(SKUDataMapping.objects.values_list('sku', 'description')), {1: 'Plain', 2: 'Seeded'})
+        self.assertConsistent()
+
+        # A rejected row without a readable SKU may be any of them, nothing is deleted.
+        output = self.loadskudata(['1,Plain,North,Bakery,Bread,Bagels', 'two,Seeded,North,Bakery,Bread,Bagels'])
+        self.assertIn('Deletes not applied because rows without a readable SKU were rejected', output)
+        self.assertEqual(SKUDataMapping.objects.count(), 2)
+
+    def test_unparseable_file(self):
+        self.importdata(['North,Bakery,Bread,Bagels'])
+        path = self.write_file('broken.csv', META_HEADER, ['North,Bakery,Bread,Rolls', 'North,Bakery,Bread,Buns,extra'])
+        with self.assertRaisesMessage(CommandError, 'line 3'):
+            call_command('importdata', path, incremental=True, stdout=StringIO())
+        # The input is incomplete, the subcategories missing from it are not deleted.
+        self.assertEqual(list(SubCategory.objects.values_list('name', flat=True)), ['Bagels'])
+
+
+class ParallelLoadTests(ConsistencyMixin, TempDirMixin, TransactionTestCase):
+
+    def test_quarantined_rows_create_no_nodes(self):
+        paths = [
+            self.write_file('first.txt', SKU_HEADER, ['1,Plain,North,Bakery,Bread,Bagels',
+                                                      '2,Seeded,North,Bakery,Bread,Bagels']),
+            self.write_file('second.txt', SKU_HEADER, ['3,Gouda,North,Deli,Cheese,Hard',
+                                                       'x,Ghost,Nowhere,Void,Empty,None', '4,,South,Deli,Cheese,Soft']),
+        ]
+        # The in-memory test database is only shared with threads of this process.
+        with mock.patch('concurrent.futures.ProcessPoolExecutor', ThreadPoolExecutor):
+            summaries = {os.path.basename(summary['file']): summary
+                         for summary in load_files_parallel(paths, workers=1, chunksize=2)}
+        self.assertEqual(summaries['first.txt']['inserted'], 2)
+        self.assertEqual(summaries['second.txt']['inserted'], 1)
+        self.assertEqual(summaries['second.txt']['errored'], 0)
+
+        with open(summaries['second.txt']['quarantine']) as quarantine:
+            rejected = quarantine.read()
+        self.assertIn('Ghost', rejected)
+        self.assertIn('South', rejected)
+        self.assertEqual(set(Location.objects.values_list('name', flat=True)), {'North'})
+        self.assertEqual(set(SubCategory.objects.values_list('name', flat=True)), {'Bagels', 'Hard'})
+        self.assertEqual(sorted(SKUDataMapping.objects.values_list('subcategory__name', flat=True)),
+                         ['Bagels', 'Bagels', 'Hard'])
+        self.assertConsistent()
+
+
+class JournalReplayTests(ConsistencyMixin, TempDirMixin, TransactionTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.location, self.department, self.category, self.subcategory = create_path(
+            'North', 'Bakery', 'Bread', 'Bagels')
+
+    def record(self, sku, description, subcategory_id=None):
+        return dict(zip(RECORD_FIELDS, (sku, description, self.location.pk, self.department.pk, self.category.pk,
+                                        subcategory_id or self.subcategory.pk)))
+
+    def write_journal(self, name, records):
+        return self.write_file('journal-{}.ndjson'.format(name), '', [json.dumps(record) for record in records])
+
+    def test_replay(self):
+        SKUDataMapping.objects.create(sku=1, description='Plain', location=self.location, department=self.department,
+                                      category=self.category, subcategory=self.subcategory)
+        path = self.write_journal('1-1', [self.record(1, 'Toasted'), self.record(2, 'Seeded'),
+                                          self.record(3, 'Orphan', subcategory_id=999999)])
+        with open(path, 'a') as output:
+            # A record cut by the crash, it was never acknowledged.
+            output.write('{"sku": 4, "descr')
+
+        with self.assertLogs('sku.write_behind', 'ERROR') as logs:
+            self.assertEqual(replay_journals(self.directory), 3)
+        self.assertIn('Orphan', logs.output[0])
+        self.assertEqual(dict(SKUDataMapping.objects.values_list('sku', 'description')), {1: 'Toasted', 2: 'Seeded'})
+        self.assertFalse(os.path.exists(path))
+        self.assertConsistent()
+
+    def test_replay_from_checkpoint(self):
+        path = self.write_journal('1-2', [self.record(1, 'Written'), self.record(2, 'Pending')])
+        with open(path, 'rb') as source:
+            write_checkpoint(path, len(source.readline()))
+
+        self.assertEqual(replay_journals(self.directory), 1)
+        self.assertEqual(list(SKUDataMapping.objects.values_list('sku', flat=True)), [2])
+        self.assertFalse(os.path.exists(checkpoint_path(path)))
+        self.assertConsistent()
+
+    def test_failed_replay_keeps_the_journal(self):
+        path = self.write_journal('1-3', [self.record(1, 'Plain')])
+        with mock.patch('sku.write_behind.write_skus', side_effect=OperationalError('no such table')), \
+                mock.patch('time.sleep'), self.assertLogs('sku.write_behind', 'ERROR'):
+            with self.assertRaises(OperationalError):
+                replay_journals(self.directory)
+        self.assertTrue(os.path.exists(path))
+        self.assertFalse(SKUDataMapping.objects.exists())
+
+
+class WriteRetryTests(SimpleTestCase):
+
+    def write(self, failures, attempts=None):
+        errors = [OperationalError('gone away')] * failures + [None]
+        with mock.patch('sku.write_behind.write_skus', side_effect=errors) as write, \
+                mock.patch('sku.write_behind.close_old_connections'), mock.patch('time.sleep') as sleep, \
+                mock.patch('sku.write_behind.MAX_RETRY_DELAY', 4), self.assertLogs('sku.write_behind', 'ERROR'):
+            try:
+                write_batch([{'sku': 1}], attempts)
+            finally:
+                self.calls = write.call_count
+                self.delays = [call.args[0] for call in sleep.call_args_list]
+
+    def test_backs_off(self):
+        self.write(5)
+        self.assertEqual(self.calls, 6)
+        self.assertEqual(self.delays, [1, 2, 4, 4, 4])
+
+    def test_gives_up_after_attempts(self):
+        with self.assertRaises(OperationalError):
+            self.write(5, attempts=3)
+        self.assertEqual(self.calls, 3)
+        self.assertEqual(self.delays, [1, 2])
+
+
+class StartupTests(SimpleTestCase):
+
+    def test_replay_starts_with_the_server(self):
+        with mock.patch('sku.write_behind.start_replay') as start_replay:
+            apps.get_app_config('sku').ready()
+            start_replay.assert_not_called()
+        with mock.patch('sku.server.start_replay') as start_replay, mock.patch('sku.server.get_search_index'):
+            start_server()
+            start_replay.assert_called_once_with()
+
+
+class LoadSKUDataTests(TempDirMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.path = self.write_file('sku_data.txt', SKU_HEADER, ['1,Plain,North,Bakery,Bread,Bagels',
+                                                                 '2,Seeded,North,Bakery,Bread,Bagels'])
+
+    def test_success(self):
+        stdout = StringIO()
+        call_command('loadskudata', self.path, stdout=stdout)
+        self.assertIn('SKU Data imported successfully: 2 inserted, 0 skipped, 0 errored', stdout.getvalue())
+
+    def test_errored_rows_fail_the_command(self):
+        stdout = StringIO()
+        with mock.patch('sku.loaders.refresh_skus', side_effect=[DatabaseError('Lock wait timeout'), None]):
+            with self.assertRaisesMessage(CommandError, '1 inserted, 0 skipped, 1 errored'):
+                call_command('loadskudata', self.path, chunksize=1, stdout=stdout)
+        self.assertIn('Lock wait timeout', stdout.getvalue())
+        self.assertNotIn('successfully', stdout.getvalue())
+        self.assertEqual(SKUDataMapping.objects.count(), 1)
+
+
+class MetricsTests(TestCase):
+
+    def test_served_to_allowed_addresses_only(self):
+        self.client.get('/api/v1/location/')
+        response = self.client.get('/metrics')
+        self.assertEqual(response.status_code, 200)
+        self.assertIn(b'sku_request_duration_seconds', response.content)
+        self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='203.0.113.7').status_code, 404)
+        with override_settings(SKU_METRICS_ALLOWED_IPS=['10.0.0.5']):
+            self.assertEqual(self.client.get('/metrics', REMOTE_ADDR='10.0.0.5').status_code, 200)
+            self.assertEqual(self.client.get('/metrics').status_code, 404)
+
+
+class SnapshotTests(TempDirMixin, TestCase):
+
+    def corrupt(self, header, data=b''):
+        path = os.path.join(self.directory, 'corrupt.snap')
+        with open(path, 'wb') as output:
+            output.write(PREAMBLE.pack(MAGIC, FORMAT_VERSION, len(header)) + header + data)
+        return path
+
+    def test_write_and_read(self):
+        path = os.path.join(self.directory, 'arrays.snap')
+        arrays = {'ids': np.arange(5, dtype=np.int32), 'grid': np.ones((3, 2)), 'empty': np.empty(0, dtype=np.int64)}
+        write_snapshot(path, arrays, kind='test', rows=5)
+        snapshot = Snapshot(path)
+        self.assertEqual(snapshot.meta, {'kind': 'test', 'rows': 5})
+        self.assertEqual(set(snapshot.arrays), set(arrays))
+        for name, array in arrays.items():
+            np.testing.assert_array_equal(snapshot.arrays[name], array)
+            self.assertEqual(snapshot.arrays[name].dtype, array.dtype)
+        self.assertFalse(snapshot.arrays['ids'].flags.writeable)
+
+    def test_corrupt_files(self):
+        header = json.dumps({'meta': {}, 'arrays': {'ids': {'dtype': '<i4', 'shape': [1000], 'offset': 0}}}).encode()
+        paths = [
+            self.write_file('short.snap', 'SKU', []),
+            self.write_file('other.snap', 'not a snapshot at all', []),
+            self.corrupt(b'{"meta": '),
+            self.corrupt(b'\xff\xfe'),
+            self.corrupt(b'[]'),
+            self.corrupt(json.dumps({'meta': {}}).encode()),
+            self.corrupt(json.dumps({'meta': {}, 'arrays': {'ids': {'dtype': 'nonsense', 'shape': [1],
+                                                                    'offset': 0}}}).encode()),
+            # The arrays reach past the end of the file.
+            self.corrupt(header),
+        ]
+        for path in paths:
+            with self.subTest(path=path), self.assertRaises(SnapshotError):
+                Snapshot(path)
+
+    def test_catalog(self):
+        path = os.path.join(self.directory, 'catalog.snap')
+        create_skus(create_path('North', 'Bakery', 'Bread', 'Bagels')[3], 3)
+        dump_catalog(path)
+        catalog = CatalogSnapshot(path)
+        self.assertEqual(catalog.node_rows('subcategory')[0][1], 'Bagels')
+        stdout = StringIO()
+        call_command('showcatalog', path, stdout=stdout)
+        self.assertIn('1 locations, 1 departments, 1 categories, 1 subcategories, 3 SKUs', stdout.getvalue())
+
+        write_snapshot(path, {}, kind='catalog')
+        with self.assertRaisesMessage(CommandError, 'without last_change'):
+            call_command('showcatalog', path, stdout=StringIO())
+        with self.assertRaisesMessage(CommandError, 'corrupt header'):
+            call_command('showcatalog', self.corrupt(b'{"meta"'), stdout=StringIO())
+
+
+class KeysetPaginationTests(TestCase):
+
+    def setUp(self):
+        self.skus = [sku.pk for sku in create_skus(create_path('North', 'Bakery', 'Bread', 'Bagels')[3], 5)]
+        create_skus(create_path('South', 'Bakery', 'Bread', 'Rolls')[3], 2)
+
+    def test_pages_follow_the_link_header(self):
+        url, pages = '/api/v1/get_skus_by_meta_data/?location=North&limit=2', []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, 200)
+            pages.append([row[0] for row in response.json()])
+            link = response.get('Link')
+            url = link[1:link.index('>; rel="next"')] if link else None
+        self.assertEqual(pages, [self.skus[0:2], self.skus[2:4], self.skus[4:]])
+
+    def test_full_last_page_links_to_an_empty_one(self):
+        response = self.client.get('/api/v1/get_skus_by_meta_data/', {'location': 'North', 'limit': 5})
+        self.assertIn('after={}'.format(self.skus[-1]), response['Link'])
+        response = self.client.get('/api/v1/get_skus_by_meta_data/',
+                                   {'location': 'North', 'limit': 5, 'after': self.skus[-1]})
+        self.assertEqual(response.json(), [])
+        self.assertNotIn('Link', response)
+
+    def test_ndjson_streams_every_row(self):
+        response = self.client.get('/api/v1/get_skus_by_meta_data/', {'location': 'North', 'format': 'ndjson',
+                                                                      'limit': 2})
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        rows = [json.loads(line) for line in b''.join(response.streaming_content).splitlines()]
+        self.assertEqual([row[0] for row in rows], self.skus)
+
+    def test_invalid_parameters(self):
+        for params in ({'limit': 0}, {'limit': 'ten'}, {'after': 'first'}):
+            with self.subTest(params=params):
+                self.assertEqual(self.client.get('/api/v1/location/', params).status_code, 400)
+
+    def test_keyset_iterator(self):
+        self.assertEqual([sku.pk for sku in keyset_iterator(SKUDataMapping.objects.all(), chunk_size=2)],
+                         list(SKUDataMapping.objects.order_by('pk').values_list('pk', flat=True)))
+        self.assertEqual([row[0] for row in keyset_iterator(Location.objects.values_list('pk', 'name'), 1)],
+                         list(Location.objects.order_by('pk').values_list('pk', flat=True)))
+
+
+class ValuesListSerializerTests(TestCase):
+
+    def setUp(self):
+        create_path('North', 'Bakery', 'Bread', 'Bagels')
+        create_path('North', 'Bakery', 'Cakes', 'Muffins')
+        create_path('South', 'Deli', 'Cheese', 'Hard')
+        self.cases = [
+            ('departments', Department, DepartmentSerializer, department_values),
+            ('category', Category, CategorySerializer, category_values),
+            ('subcategory', SubCategory, SubCategorySerializer, subcategory_values),
+        ]
+
+    def test_rows_match_the_model_serializer(self):
+        for _, model, serializer_class, values in self.cases:
+            with self.subTest(model=model.__name__):
+                expected = serializer_class(model.objects.order_by('pk'), many=True).data
+                rows = values.queryset(model.objects.order_by('pk'))
+                self.assertEqual(values.serialize(rows), [dict(item) for item in expected])
+
+    def test_list_endpoints_match_the_model_serializer(self):
+        for url, model, serializer_class, _ in self.cases:
+            expected = json.loads(dumps(serializer_class(model.objects.order_by('pk'), many=True).data))
+            for prefix in ('/api/v1/', '/api/v1/async/'):
+                with self.subTest(url=prefix + url):
+                    self.assertEqual(self.client.get('{}{}/'.format(prefix, url)).json(), expected)
+
+
+@override_settings(SKU_VERSION_CHECK_INTERVAL=0)
+class ValidationRuleTests(BulkWriteMixin, TestCase):
+
+    def setUp(self):
+        self.location = create_path('North', 'Bakery', 'Bread', 'Bagels')[0]
+        self.closed = Location.objects.create(name='Closed')
+
+    def add_rules(self, *rules):
+        with self.captureOnCommitCallbacks(execute=True):
+            for level, kind, value, message in rules:
+                ValidationRule.objects.create(level=level, kind=kind, value=value, message=message)
+
+    def test_compile_rules_skips_invalid_rules(self):
+        rules = compile_rules([('location', 'letters', '', 'Letters only'), ('location', 'pattern', '(', 'Broken'),
+                               ('aisle', 'letters', '', 'Unknown level'), ('location', 'colour', 'red', 'Unknown'),
+                               ('department', 'blocked_parent', 'Closed', 'Closed location')])
+        self.assertEqual([message for _, message in rules['location'][0]], ['Letters only'])
+        self.assertEqual(rules['department'], ([], [('Closed', 'Closed location')]))
+
+    def test_names_and_parents(self):
+        self.add_rules(('location', 'max_length', '8', 'Too long'), ('location', 'pattern', '[A-Z].*', 'Capitalize'),
+                       ('department', 'blocked_parent', 'Closed', 'Closed location'))
+        response = self.bulk_write('post', 'location', [{'name': 'East'}, {'name': 'Northwest by west'},
+                                                        {'name': 'south'}])
+        self.assertEqual(response.status_code, 207)
+        self.assertEqual([str(result.get('errors', '')) for result in response.json()][1:], [
+            str({'name': ['Too long']}), str({'name': ['Capitalize']})])
+        self.assertEqual(set(Location.objects.values_list('name', flat=True)), {'North', 'Closed', 'East'})
+
+        response = self.bulk_write('post', 'department', [{'name': 'Deli', 'location': self.location.pk},
+                                                          {'name': 'Deli', 'location': self.closed.pk}])
+        self.assertEqual(response.status_code, 207)
+        self.assertIn('Closed location', str(response.json()[1]))
+        self.assertEqual(list(Department.objects.filter(name='Deli').values_list('location_id', flat=True)),
+                         [self.location.pk])
+
+    def test_rule_changes_are_seen(self):
+        self.assertEqual(self.bulk_write('post', 'location', [{'name': 'east'}]).status_code, 201)
+        self.add_rules(('location', 'pattern', '[A-Z].*', 'Capitalize'))
+        self.assertIn('Capitalize', str(self.bulk_write('post', 'location', [{'name': 'west'}]).json()))
+        with self.captureOnCommitCallbacks(execute=True):
+            ValidationRule.objects.all().delete()
+        self.assertEqual(self.bulk_write('post', 'location', [{'name': 'west'}]).status_code, 201)
+
+
+class TreeTests(ConsistencyMixin, TestCase):
+
+    def setUp(self):
+        self.north, self.bakery, self.bread, self.bagels = create_path('North', 'Bakery', 'Bread', 'Bagels')
+        self.rolls = create_path('North', 'Bakery', 'Bread', 'Rolls')[3]
+        self.south = create_path('South', 'Deli', 'Cheese', 'Cheddar')[0]
+
+    def get(self, url, **params):
+        return self.client.get('/api/v1/{}'.format(url), params)
+
+    def node(self, level, node, children=None):
+        data = {'id': node.pk, 'level': level, 'name': node.name}
+        if children is not None:
+            data['children'] = children
+        return data
+
+    def test_whole_tree(self):
+        tree = self.get('tree/').json()
+        self.assertEqual([location['name'] for location in tree], ['North', 'South'])
+        self.assertEqual(tree[0]['children'][0]['children'][0], self.node('category', self.bread, [
+            self.node('subcategory', self.bagels), self.node('subcategory', self.rolls)]))
+        self.assertEqual(self.get('tree/', depth=1).json(), [
+            self.node('location', self.north, [self.node('department', self.bakery, [])]),
+            self.node('location', self.south, [self.node('department', Department.objects.get(name='Deli'), [])])])
+
+    def test_subtree_and_ancestors(self):
+        self.assertEqual(self.get('tree/department/{}/'.format(self.bakery.pk), depth=1).json(),
+                         self.node('department', self.bakery, [self.node('category', self.bread, [])]))
+        self.assertEqual(self.get('tree/category/{}/'.format(self.bread.pk)).json(), self.node(
+            'category', self.bread, [self.node('subcategory', self.bagels), self.node('subcategory', self.rolls)]))
+        self.assertEqual(self.get('tree/subcategory/{}/ancestors/'.format(self.rolls.pk)).json(), [
+            self.node('location', self.north), self.node('department', self.bakery),
+            self.node('category', self.bread), self.node('subcategory', self.rolls)])
+        for url in ('tree/aisle/1/', 'tree/category/0/', 'tree/category/0/ancestors/'):
+            self.assertEqual(self.get(url).status_code, 404)
+
+    def test_moves_are_followed(self):
+        self.bakery.location = self.south
+        self.bakery.save()
+        self.assertEqual([node['name'] for node in self.get('tree/subcategory/{}/ancestors/'.format(
+            self.bagels.pk)).json()], ['South', 'Bakery', 'Bread', 'Bagels'])
+        self.assertEqual(self.get('tree/location/{}/'.format(self.north.pk)).json()['children'], [])
+        self.assertConsistent()
+
+    def test_location_depth(self):
+        north = self.get('location/{}/'.format(self.north.pk)).json()
+        self.assertEqual(north, {'name': 'North', 'departments': [['Bakery']]})
+        bread = {'id': self.bread.pk, 'name': 'Bread'}
+        north = self.get('location/{}/'.format(self.north.pk), depth=2).json()
+        self.assertEqual(north['departments'], [{'id': self.bakery.pk, 'name': 'Bakery', 'categories': [bread]}])
+        north = self.get('location/{}/'.format(self.north.pk), depth=3).json()
+        self.assertEqual(north['departments'][0]['categories'][0]['subcategories'], [
+            {'id': self.bagels.pk, 'name': 'Bagels'}, {'id': self.rolls.pk, 'name': 'Rolls'}])
+
+    def test_invalid_depth(self):
+        for url, depth in (('location/', 0), ('location/', 4), ('location/', 'all'), ('tree/', 4),
+                           ('tree/category/{}/'.format(self.bread.pk), -1)):
+            response = self.get(url, depth=depth)
+            self.assertEqual(response.status_code, 400)
+            self.assertIn('depth must be between 1 and', response.json()['detail'])
+
+
+class ExportTests(ConsistencyMixin, TempDirMixin, TestCase):
+
+    def setUp(self):
+        super().setUp()
+        create_skus(create_path('North', 'Bakery', 'Bread', 'Bagels')[3], 3, description='Plain, "sesame" ')
+        create_skus(create_path('South', 'Deli', 'Cheese', 'Cheddar')[3], 2)
+
+    def export(self, **params):
+        response = self.client.get('/api/v1/sku/export/', params)
+        self.assertEqual(response.status_code, 200)
+        return b''.join(response.streaming_content)
+
+    def rows(self):
+        return [[str(value) for value in row] for row in SKUDataMapping.objects.order_by('sku').values_list(
+            'sku', 'description', 'location__name', 'department__name', 'category__name', 'subcategory__name')]
+
+    def test_formats(self):
+        rows = self.rows()
+        exported = list(csv.reader(StringIO(self.export().decode())))
+        self.assertEqual(exported, [list(EXPORT_COLUMNS)] + rows)
+        exported = [json.loads(line) for line in self.export(format='ndjson').splitlines()]
+        self.assertEqual([[str(item[column]) for column in EXPORT_COLUMNS] for item in exported], rows)
+        exported = list(csv.reader(StringIO(self.export(location='South').decode())))
+        self.assertEqual(exported[1:], rows[3:])
+        self.assertEqual(self.client.get('/api/v1/sku/export/', {'format': 'xml'}).status_code, 400)
+
+    def test_round_trip(self):
+        rows = self.rows()
+        for format, name in (('csv', 'sku_data.txt'), ('parquet', 'sku_data.parquet')):
+            path = self.write_file(name, '', [])
+            with open(path, 'wb') as output:
+                output.write(self.export(format=format))
+            with self.captureOnCommitCallbacks(execute=True), transaction.atomic():
+                delete_skus(SKUDataMapping.objects.values_list('sku', flat=True))
+            # Forgets the rows of the previous load, they would be skipped as unchanged.
+            ImportState.objects.all().delete()
+            with self.captureOnCommitCallbacks(execute=True):
+                call_command('loadskudata', path, incremental=True, stdout=StringIO())
+            self.assertEqual(self.rows(), rows)
+            self.assertConsistent()
+
+
+class GenerateCatalogTests(ConsistencyMixin, TempDirMixin, TestCase):
+
+    def generate(self, name, **options):
+        directory = os.path.join(self.directory, name)
+        call_command('generatecatalog', directory, shape='2x2x2x2', skus=25, chunksize=10, stdout=StringIO(), **options)
+        rows = []
+        for filename in ('meta_data.csv', 'sku_data.txt'):
+            with open(os.path.join(directory, filename)) as data:
+                rows.append(list(csv.reader(data)))
+        return rows
+
+    def test_files(self):
+        meta, skus = self.generate('first')
+        self.assertEqual(meta[0], META_HEADER.strip().split(','))
+        self.assertEqual(len({tuple(row) for row in meta[1:]}), 16)
+        self.assertEqual(skus[0], SKU_HEADER.strip().split(','))
+        self.assertEqual([row[0] for row in skus[1:]], [str(sku) for sku in range(1, 26)])
+        self.assertTrue({tuple(row[2:]) for row in skus[1:]} <= {tuple(row) for row in meta[1:]})
+        self.assertEqual(self.generate('again'), [meta, skus])
+        self.assertNotEqual(self.generate('other', seed=1)[1], skus)
+
+    def test_loaded(self):
+        directory = os.path.join(self.directory, 'catalog')
+        call_command('generatecatalog', directory, shape='2x2x2x2', skus=25, chunksize=10, stdout=StringIO())
+        with self.captureOnCommitCallbacks(execute=True):
+            call_command('importdata', os.path.join(directory, 'meta_data.csv'), stdout=StringIO())
+            call_command('loadskudata', os.path.join(directory, 'sku_data.txt'), stdout=StringIO())
+        self.assertEqual(SubCategory.objects.count(), 16)
+        self.assertEqual(SKUDataMapping.objects.count(), 25)
+        self.assertConsistent()
+
+    def test_invalid_options(self):
+        for options in ({'shape': 'large'}, {'shape': '2x2xtwo'}, {'skus': -1}, {'chunksize': 0}):
+            with self.assertRaises(CommandError):
+                call_command('generatecatalog', self.directory, stdout=StringIO(), **options)
@@ -0,0 +1,155 @@
+from .hierarchy import LEVELS
+from .models import Location, Department, Category, SubCategory, HierarchyNode, HierarchyClosure
+
+NODE_FIELDS = ('id', 'parent_id', 'level', 'node_id', 'name')
+
+# (model, parent field) of every level.
+LEVEL_SOURCES = (
+    (Location, None),
+    (Department, 'location_id'),
+    (Category, 'department_id'),
+    (SubCategory, 'category_id'),
+)
+
+
+def sync_tree(level, rows):
+    """
+    Brings the tree nodes of a level in line with the given (id, parent_id, name) rows of its model:
+    missing nodes are added with their closure rows, renamed ones updated and the subtrees of the
+    moved ones re-linked below their new parent. Parents have to be synced before their children.
+    Called by the signals, bulk writes and the loaders, inside their transaction.
+    """
+    depth = LEVELS.index(level)
+    rows = {pk: (parent_id, name) for pk, parent_id, name in rows}
+    if not rows:
+        return
+    parents = {}
+    if depth:
+        parents = HierarchyNode.objects.filter(level=depth - 1, node_id__in={parent for parent, _ in rows.values()})
+        parents = dict(parents.values_list('node_id', 'id'))
+    existing = {row[0]: row[1:] for row in HierarchyNode.objects.filter(level=depth, node_id__in=list(rows))
+                .values_list('node_id', 'id', 'parent_id', 'name')}
+
+    missing = [pk for pk in rows if pk not in existing]
+    if missing:
+        # Nodes added concurrently by another writer are skipped, with their closure rows.
+        HierarchyNode.objects.bulk_create([
+            HierarchyNode(level=depth, node_id=pk, name=rows[pk][1], parent_id=parents.get(rows[pk][0]))
+            for pk in missing
+        ], ignore_conflicts=True)
+        link(HierarchyNode.objects.filter(level=depth, node_id__in=missing).values_list('id', 'parent_id'))
+
+    renamed = [HierarchyNode(id=node, name=rows[pk][1])
+               for pk, (node, _, name) in existing.items() if name != rows[pk][1]]
+    HierarchyNode.objects.bulk_update(renamed, ['name'], batch_size=1000)
+    for pk, (node, parent, _) in existing.items():
+        if parent != parents.get(rows[pk][0]):
+            move(node, parents.get(rows[pk][0]))
+
+
+def link(nodes):
+    """
+    Adds the closure rows of new leaf nodes, given as (id, parent id) pairs: the node itself and the
+    ancestors of its parent one level further.
+    """
+    nodes = list(nodes)
+    ancestors = {}
+    links = HierarchyClosure.objects.filter(descendant_id__in={parent for _, parent in nodes if parent})
+    for descendant, ancestor, depth in links.values_list('descendant_id', 'ancestor_id', 'depth'):
+        ancestors.setdefault(descendant, []).append((ancestor, depth))
+    HierarchyClosure.objects.bulk_create([
+        HierarchyClosure(ancestor_id=ancestor, descendant_id=node, depth=depth + 1)
+        for node, parent in nodes for ancestor, depth in [(node, -1)] + ancestors.get(parent, [])
+    ], ignore_conflicts=True)
+
+
+def move(node, parent):
+    """
+    Re-links the subtree of the node below a new parent, None for a root.
+    """
+    subtree = dict(HierarchyClosure.objects.filter(ancestor_id=node).values_list('descendant_id', 'depth'))
+    HierarchyClosure.objects.filter(descendant_id__in=list(subtree)).exclude(ancestor_id__in=list(subtree)).delete()
+    ancestors = HierarchyClosure.objects.filter(descendant_id=parent).values_list('ancestor_id', 'depth')
+    HierarchyClosure.objects.bulk_create([
+        HierarchyClosure(ancestor_id=ancestor, descendant_id=descendant, depth=above + below + 1)
+        for ancestor, above in ancestors for descendant, below in subtree.items()
+    ])
+    HierarchyNode.objects.filter(id=node).update(parent_id=parent)
+
+
+def forget_tree_nodes(level, pks):
+    """
+    Deletes the tree nodes of deleted model rows of a level, their subtrees and closure rows go with them.
+    """
+    HierarchyNode.objects.filter(level=LEVELS.index(level), node_id__in=list(pks)).delete()
+
+
+def rebuild_tree(batch_size=1000):
+    """
+    Rebuilds the tree nodes and the closure table from the four hierarchy models, level by level.
+    """
+    HierarchyClosure.objects.all().delete()
+    HierarchyNode.objects.all().delete()
+    for level, (model, parent_field) in zip(LEVELS, LEVEL_SOURCES):
+        rows = model.objects.order_by('id').values_list('id', parent_field or 'id', 'name')
+        if not parent_field:
+            rows = ((pk, None, name) for pk, _, name in rows)
+        batch = []
+        for row in rows:
+            batch.append(row)
+            if len(batch) == batch_size:
+                sync_tree(level, batch)
+                batch = []
+        sync_tree(level, batch)
+
+
+def nest(rows):
+    """
+    Returns the nested representation of NODE_FIELDS rows ordered by level: every node with its children
+    ordered as the rows, the nodes whose parent is not among the rows are the roots.
+    """
+    nodes = {}
+    roots = []
+    for pk, parent, level, node_id, name in rows:
+        node = {'id': node_id, 'level': LEVELS[level], 'name': name}
+        if level < len(LEVELS) - 1:
+            node['children'] = []
+        nodes[pk] = node
+        if parent in nodes:
+            nodes[parent]['children'].append(node)
+        else:
+            roots.append(node)
+    return roots
+
+
+def whole_tree(depth=None):
+    """
+    Returns the whole hierarchy nested below its locations, down to the depth-th level below them.
+    """
+    nodes = HierarchyNode.objects.all()
+    if depth is not None:
+        nodes = nodes.filter(level__lte=depth)
+    return nest(nodes.order_by('level', 'node_id').values_list(*NODE_FIELDS))
+
+
+def subtree(level, pk, depth=None):
+    """
+    Returns the node with its subtree nested down to depth levels below it, read with one range query
+    over the closure rows of the node, or None when it does not exist.
+    """
+    links = HierarchyClosure.objects.filter(ancestor__level=LEVELS.index(level), ancestor__node_id=pk)
+    if depth is not None:
+        links = links.filter(depth__lte=depth)
+    roots = nest(links.order_by('depth', 'descendant__node_id').values_list(
+        *('descendant__{}'.format(field) for field in NODE_FIELDS)))
+    return roots[0] if roots else None
+
+
+def ancestors(level, pk):
+    """
+    Returns the path from the location down to the node, itself included, read with one query, empty
+    when it does not exist.
+    """
+    links = HierarchyClosure.objects.filter(descendant__level=LEVELS.index(level), descendant__node_id=pk)
+    return [{'id': node_id, 'level': LEVELS[level], 'name': name} for level, node_id, name in links.order_by(
+        '-depth').values_list('ancestor__level', 'ancestor__node_id', 'ancestor__name')]
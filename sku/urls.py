@@ -1,40 +1,82 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
+from . import async_views
+from .response_cache import cache_response, location_detail_tags, sku_query_tags
+from .serializers import LocationSerializer, DepartmentSerializer, CategorySerializer, SubCategorySerializer, \
+    SKUDataMappingSerializer
 from .views import LocationViewSet, LocationDetailView, DepartmentDetailsAPIView, CategoryViewSet, \
-    get_skus_by_meta_data, SubCategoryView
+    get_skus_by_meta_data, count_skus_by_meta_data, SubCategoryView, BulkView, search_skus, suggest_search_terms, \
+    hierarchy_tree, hierarchy_ancestors, export_skus, QueuedSKUView
 
 router = DefaultRouter()
 router.register('location', LocationViewSet)
 router.register(r'category', CategoryViewSet, basename='category')
 
+location_detail_view = cache_response(location_detail_tags)(LocationDetailView.as_view())
+
 urlpatterns = [
     path('', include(router.urls)),
 
     # URL pattern for location and department details
-    path("location/<int:location_id>/department/", LocationDetailView.as_view(), name='location-department'),
+    path("location/<int:location_id>/department/", location_detail_view, name='location-department'),
 
     # URL pattern for location, department and category details
-    path("location/<int:location_id>/department/<int:department_id>/category/", LocationDetailView.as_view(), name='location-department-category'),
+    path("location/<int:location_id>/department/<int:department_id>/category/", location_detail_view, name='location-department-category'),
 
     # URL pattern for location, department, category and subcategory details
-    path("location/<int:location_id>/department/<int:department_id>/category/<int:category_id>/subcategory/", LocationDetailView.as_view(), name="category-subcategory"),
+    path("location/<int:location_id>/department/<int:department_id>/category/<int:category_id>/subcategory/", location_detail_view, name="category-subcategory"),
 
     # URL pattern for location, department, category, subcategory details and subcategory id
-    path("location/<int:location_id>/department/<int:department_id>/category/<int:category_id>/subcategory/<int:subcategory_id>/", LocationDetailView.as_view(), name='subcategory'),
+    path("location/<int:location_id>/department/<int:department_id>/category/<int:category_id>/subcategory/<int:subcategory_id>/", location_detail_view, name='subcategory'),
 
     # URL pattern for department list & details
     path('departments/', DepartmentDetailsAPIView.as_view(), name='department-list'),
     path('departments/<int:pk>/', DepartmentDetailsAPIView.as_view(), name='department-detail'),
 
     # URL pattern for getting SKUs by meta data
-    path('get_skus_by_meta_data/', get_skus_by_meta_data, name='get_skus_by_meta_data'),
+    path('get_skus_by_meta_data/', cache_response(sku_query_tags)(get_skus_by_meta_data), name='get_skus_by_meta_data'),
+
+    # URL pattern for the number of SKUs of every node of a hierarchy level
+    path('sku/counts/', count_skus_by_meta_data, name='sku-counts'),
+
+    # URL pattern for downloading the SKUs as CSV, NDJSON or Parquet
+    path('sku/export/', export_skus, name='sku-export'),
+
+    # URL patterns for the hierarchy tree, a subtree of one node and the path down to a node
+    path('tree/', hierarchy_tree, name='tree'),
+    path('tree/<str:level>/<int:pk>/', hierarchy_tree, name='tree-node'),
+    path('tree/<str:level>/<int:pk>/ancestors/', hierarchy_ancestors, name='tree-ancestors'),
+
+    # URL patterns for the full text search over SKUs and its typeahead completions
+    path('sku/search/', search_skus, name='sku-search'),
+    path('sku/search/suggest/', suggest_search_terms, name='sku-search-suggest'),
 
     # URL pattern for SubCategory & SubCategory with primary key
     path('subcategory/', SubCategoryView.as_view()),
     path('subcategory/<int:pk>/', SubCategoryView.as_view()),
-]
-
-
 
+    # URL patterns for bulk create, update and delete, the body is a JSON array or NDJSON
+    path('bulk/location/', BulkView.as_view(serializer_class=LocationSerializer), name='bulk-location'),
+    path('bulk/department/', BulkView.as_view(serializer_class=DepartmentSerializer), name='bulk-department'),
+    path('bulk/category/', BulkView.as_view(serializer_class=CategorySerializer), name='bulk-category'),
+    path('bulk/subcategory/', BulkView.as_view(serializer_class=SubCategorySerializer), name='bulk-subcategory'),
+    path('bulk/sku/', BulkView.as_view(serializer_class=SKUDataMappingSerializer), name='bulk-sku'),
 
+    # URL pattern for SKU writes acknowledged once journaled and written to the database in batches
+    path('sku/queue/', QueuedSKUView.as_view(), name='sku-queue'),
 
+    # URL patterns of the async read endpoints, same parameters and bodies as above, for ASGI deployments
+    path('async/get_skus_by_meta_data/', async_views.get_skus_by_meta_data, name='async-get_skus_by_meta_data'),
+    path('async/location/', async_views.location_list, name='async-location-list'),
+    path('async/location/<int:location_id>/department/', async_views.location_detail,
+         name='async-location-department'),
+    path('async/location/<int:location_id>/department/<int:department_id>/category/', async_views.location_detail,
+         name='async-location-department-category'),
+    path('async/location/<int:location_id>/department/<int:department_id>/category/<int:category_id>/subcategory/',
+         async_views.location_detail, name='async-category-subcategory'),
+    path('async/location/<int:location_id>/department/<int:department_id>/category/<int:category_id>/subcategory/'
+         '<int:subcategory_id>/', async_views.location_detail, name='async-subcategory'),
+    path('async/departments/', async_views.department_list, name='async-department-list'),
+    path('async/category/', async_views.category_list, name='async-category-list'),
+    path('async/subcategory/', async_views.subcategory_list, name='async-subcategory-list'),
+]
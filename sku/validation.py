@@ -0,0 +1,144 @@
+import os
+
+import numpy as np
+import pandas as pd
+
+from .models import Location, Department, Category, SubCategory, SKUDataMapping
+
+
+def max_length(model, field):
+    return model._meta.get_field(field).max_length
+
+
+# Columns of the sku_data.txt layout, with the max_length of their model field, None for the SKU number.
+SKU_FIELDS = {
+    'SKU': None,
+    'NAME': max_length(SKUDataMapping, 'description'),
+    'LOCATION': max_length(Location, 'name'),
+    'DEPARTMENT': max_length(Department, 'name'),
+    'CATEGORY': max_length(Category, 'name'),
+    'SUBCATEGORY': max_length(SubCategory, 'name'),
+}
+
+# Columns of the meta_data.csv layout.
+META_FIELDS = {
+    'Location': max_length(Location, 'name'),
+    'Department': max_length(Department, 'name'),
+    'Category': max_length(Category, 'name'),
+    'SubCategory': max_length(SubCategory, 'name'),
+}
+
+
+def normalize_names(values):
+    """
+    Trims the names and collapses their inner whitespace, empty names become missing.
+    """
+    values = values.astype('string').str.strip().str.replace(r'\s+', ' ', regex=True)
+    values = values.mask(values == '')
+    return values.astype(object).where(values.notna(), None)
+
+
+def quarantine_path(filepath, directory=None):
+    """
+    Returns the quarantine file of an input file: <name>.quarantine.csv next to it or in directory.
+    """
+    name = os.path.splitext(os.path.basename(filepath))[0] + '.quarantine.csv'
+    return os.path.join(directory or os.path.dirname(filepath), name)
+
+
+class ChunkValidator:
+    """
+    Validates and normalizes whole chunks before they reach the ORM, with column operations only.
+    Names are trimmed, then rows are rejected when a required column is missing or empty, a value is
+    longer than its model field, the SKU is not a positive integer, the SKU appears again further down
+    the chunk, or a name differs only by case from an earlier one under the same parent.
+    Rejected rows are appended to the quarantine CSV file with their line and reason.
+    """
+
+    def __init__(self, fields, hierarchy, key=None, quarantine=None):
+        """
+        fields maps the required columns to their max length, None for the integer key column.
+        hierarchy lists the name columns from the location down, key is the column of unique ids.
+        """
+        self.fields = fields
+        self.hierarchy = list(hierarchy)
+        self.key = key
+        self.quarantine = quarantine
+        self.rejected = 0
+        self.written = False
+
+    @classmethod
+    def for_skus(cls, quarantine=None):
+        return cls(SKU_FIELDS, ('LOCATION', 'DEPARTMENT', 'CATEGORY', 'SUBCATEGORY'), 'SKU', quarantine)
+
+    @classmethod
+    def for_meta_data(cls, quarantine=None):
+        return cls(META_FIELDS, ('Location', 'Department', 'Category', 'SubCategory'), quarantine=quarantine)
+
+    def validate(self, data):
+        """
+        Returns the valid rows of the DataFrame, normalized, and quarantines the others.
+        """
+        reasons = pd.Series('', index=data.index, dtype=object)
+
+        def reject(mask, reason):
+            reasons[(reasons == '') & mask] = reason
+
+        missing = [column for column in self.fields if column not in data.columns]
+        if missing:
+            reject(pd.Series(True, index=data.index), 'missing column {}'.format(', '.join(missing)))
+            self.write(data, reasons)
+            return data.iloc[:0]
+
+        clean = data.copy()
+        for column, length in self.fields.items():
+            if length is None:
+                clean[column] = pd.to_numeric(data[column], errors='coerce')
+                reject(~(clean[column] > 0) | (clean[column] % 1 != 0), '{} is not a positive integer'.format(column))
+                continue
+            clean[column] = normalize_names(data[column])
+            reject(clean[column].isna(), '{} is empty'.format(column))
+            reject(clean[column].str.len() > length, '{} is longer than {} characters'.format(column, length))
+
+        if self.key:
+            keys = clean[self.key][reasons == '']
+            reject(keys.duplicated(keep='last').reindex(data.index, fill_value=False),
+                   'duplicate {}, a later line has the same value'.format(self.key))
+            clean[self.key] = clean[self.key].where(reasons == '', 0).astype('int64')
+        self.reject_conflicts(clean, reasons)
+
+        self.write(data, reasons)
+        return clean[(reasons == '').to_numpy()]
+
+    def reject_conflicts(self, clean, reasons):
+        """
+        Rejects the names spelled differently from the first one of the chunk that has the same
+        lower cased path, they would create a second node differing only by case.
+        """
+        valid = clean[(reasons == '').to_numpy()]
+        path = None
+        for column in self.hierarchy:
+            lower = valid[column].str.lower()
+            path = lower if path is None else path + '\x1f' + lower
+            first = valid[column].groupby(path.to_numpy(), sort=False).transform('first')
+            conflict = (valid[column] != first) & (reasons[valid.index] == '')
+            reasons[conflict[conflict].index] = (column + ' conflicts with "' + first[conflict] + '"').to_numpy()
+
+    def write(self, data, reasons):
+        """
+        Appends the rejected rows, as read, to the quarantine file with their line and reason.
+        """
+        rejected = (reasons != '').to_numpy()
+        if not rejected.any():
+            return
+        self.rejected += int(rejected.sum())
+        if not self.quarantine:
+            return
+        rows = data[rejected].copy()
+        # Lines are counted from 1 and the header is line 1.
+        rows.insert(0, 'line', np.asarray(rows.index) + 2)
+        rows['reason'] = reasons[rejected].to_numpy()
+        if not self.written:
+            os.makedirs(os.path.dirname(os.path.abspath(self.quarantine)), exist_ok=True)
+        rows.to_csv(self.quarantine, mode='a' if self.written else 'w', header=not self.written, index=False)
+        self.written = True
@@ -0,0 +1,59 @@
+"""
+Version counters shared by the workers of every host through the sku_version table. The in-process copies
+(the hierarchy, the validation rules) and the cached responses record the versions of the keys they depend on,
+writes move those keys to new versions once they commit. A counter is created on first use and moved with one
+atomic UPDATE, so no bump is lost between workers, unlike the get/set increments of a per-process cache.
+"""
+import time
+
+from django.db.models import F
+
+from .models import SharedVersion
+
+# Keys read or moved per query.
+BATCH_SIZE = 500
+
+
+def create_versions(keys):
+    """
+    Creates the missing counters. They start at the current time, so versions recorded before a counter was
+    deleted can not come back.
+    """
+    start = time.time_ns()
+    SharedVersion.objects.bulk_create([SharedVersion(key=key, version=start) for key in keys],
+                                      batch_size=BATCH_SIZE, ignore_conflicts=True)
+
+
+def get_versions(keys):
+    """
+    Returns the current version of every key, in the order of keys.
+    """
+    keys = list(keys)
+    versions = {}
+    for start in range(0, len(keys), BATCH_SIZE):
+        versions.update(SharedVersion.objects.filter(key__in=keys[start:start + BATCH_SIZE])
+                        .values_list('key', 'version'))
+    missing = [key for key in keys if key not in versions]
+    if missing:
+        create_versions(missing)
+        for start in range(0, len(missing), BATCH_SIZE):
+            versions.update(SharedVersion.objects.filter(key__in=missing[start:start + BATCH_SIZE])
+                            .values_list('key', 'version'))
+    return [versions[key] for key in keys]
+
+
+def get_version(key):
+    return get_versions([key])[0]
+
+
+def bump_versions(keys):
+    """
+    Moves the keys to new versions. Call it through transaction.on_commit so no worker reads uncommitted data
+    under the new version.
+    """
+    keys = sorted(set(keys))
+    if not keys:
+        return
+    create_versions(keys)
+    for start in range(0, len(keys), BATCH_SIZE):
+        SharedVersion.objects.filter(key__in=keys[start:start + BATCH_SIZE]).update(version=F('version') + 1)
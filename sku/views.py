@@ -1,83 +1,162 @@
+from django.db import DatabaseError, IntegrityError, transaction
+from django.db.models import Prefetch
+from django.http import HttpResponse, StreamingHttpResponse
+from django.views.decorators.http import require_GET
 from rest_framework import viewsets, status
+from rest_framework.exceptions import NotFound, ParseError
 from rest_framework.generics import get_object_or_404
 from rest_framework.status import HTTP_404_NOT_FOUND, HTTP_400_BAD_REQUEST
 from rest_framework.views import APIView
 from rest_framework.decorators import action, api_view
 from rest_framework.response import Response
 
-from .models import Location, Department, Category, SubCategory, SKUDataMapping
-from .serializers import LocationSerializer, DepartmentSerializer, CategorySerializer, SubCategorySerializer
+from .column_index import index_enabled, indexed_skus
+from .export import EXPORT_FORMATS, catalog_queryset, export_catalog
+from .hierarchy import LEVELS, get_hierarchy
+from .inverted_index import get_search_index
+from .models import Location, Department, Category, SubCategory, SKUDataMapping, SKUSearch
+from .pagination import KeysetListMixin, list_response
+from .renderers import dumps
+from .rollup import PATH_FIELDS, rollup
+from .search import search_by_names
+from .serializers import LocationSerializer, LocationTreeSerializer, DepartmentSerializer, CategorySerializer, \
+    SubCategorySerializer, SKUDataMappingSerializer, BulkListSerializer, department_values, category_values, \
+    subcategory_values
+from .signals import delete_nodes, delete_skus
+from .tree import ancestors, subtree, whole_tree
+from .write_behind import get_write_queue, to_record
 
 
-class LocationViewSet(viewsets.ModelViewSet):
+def parse_depth(params, max_depth=3):
+    """
+    Returns the `depth` parameter of the location tree, 1 by default.
+    """
+    try:
+        depth = int(params.get('depth', 1))
+    except ValueError:
+        depth = 0
+    if not 1 <= depth <= max_depth:
+        raise ParseError('depth must be between 1 and {}.'.format(max_depth))
+    return depth
+
+
+def delete_node(node):
+    """
+    Deletes a location, department, category or subcategory with its subtree and SKUs through delete_nodes,
+    which propagates the changes once instead of sending a signal per deleted row.
+    """
+    with transaction.atomic():
+        delete_nodes(type(node), [node.pk])
+
+
+def prefetch_tree(queryset, depth):
+    """
+    Prefetches the levels below the locations needed by the depth, ordered by id.
+    """
+    prefetches = [Prefetch('department_set', queryset=Department.objects.only('id', 'name', 'location_id')
+                           .order_by('id'))]
+    if depth > 1:
+        prefetches.append(Prefetch('department_set__category_set',
+                                   queryset=Category.objects.only('id', 'name', 'department_id').order_by('id')))
+    if depth > 2:
+        prefetches.append(Prefetch('department_set__category_set__subcategory_set',
+                                   queryset=SubCategory.objects.only('id', 'name', 'category_id').order_by('id')))
+    return queryset.prefetch_related(*prefetches)
+
+
+class LocationViewSet(KeysetListMixin, viewsets.ModelViewSet):
     """
     ViewSet for Location model
+    Reads serve the nested hierarchy from 1 + depth queries, `?depth=` is 1 (departments, default),
+    2 (and categories) or 3 (and subcategories).
     """
     queryset = Location.objects.all()
     serializer_class = LocationSerializer
+    max_depth = 3
 
+    def get_depth(self):
+        return parse_depth(self.request.query_params, self.max_depth)
 
-class LocationDetailView(APIView):
+    def get_queryset(self):
+        """
+        Prefetches the levels needed by the requested depth.
+        """
+        queryset = super().get_queryset()
+        if self.action not in ('list', 'retrieve'):
+            return queryset
+        return prefetch_tree(queryset, self.get_depth())
+
+    def get_serializer_class(self):
+        if self.action in ('list', 'retrieve'):
+            return LocationTreeSerializer
+        return LocationSerializer
+
+    def get_serializer_context(self):
+        context = super().get_serializer_context()
+        if self.action in ('list', 'retrieve'):
+            context['depth'] = self.get_depth()
+        return context
+
+    def list(self, request, *args, **kwargs):
+        """
+        Returns a page of locations, or streams all of them as NDJSON
+        """
+        context = self.get_serializer_context()
+
+        def serialize(rows):
+            return LocationTreeSerializer(rows, many=True, context=context).data
+
+        return self.list_response(request, self.get_queryset(), serialize=serialize)
+
+    def perform_destroy(self, instance):
+        delete_node(instance)
+
+
+class LocationDetailView(KeysetListMixin, APIView):
     """
     View for Location detail. Returns serialized data based on the id's provided in the url.
+    The data is read from the cached hierarchy, no query is made once it is built.
     """
     queryset = Location.objects.all()
     serializer_class = LocationSerializer
 
-    def get_serializer_class(self):
+    def represent(self, level, node, hierarchy):
         """
-        Returns the serializer class based on the id's provided in the url.
+        Returns the node in the same shape as its ModelSerializer.
         """
-        location = self.kwargs.get('location_id')
-        department = self.kwargs.get('department_id')
-        category = self.kwargs.get('category_id')
-        subcategory = self.kwargs.get('subcategory_id')
-
-        if subcategory or all([location, department, category]):
-            serializer = SubCategorySerializer
-        elif location and department:
-            serializer = CategorySerializer
-        elif location:
-            serializer = DepartmentSerializer
-        else:
-            serializer = LocationSerializer
-        return serializer
+        if level == 'department':
+            return {'id': node.id, 'name': node.name, 'location': node.parent_id}
+        if level == 'category':
+            return {'id': node.id, 'name': node.name, 'department': node.parent_id,
+                    'department_name': hierarchy.get('department', node.parent_id).name}
+        return {'id': node.id, 'name': node.name, 'category': node.parent_id}
 
-    def get_queryset(self):
+    def get_rows(self):
         """
-        Returns the queryset based on the id's provided in the url.
-        """
-        location = self.kwargs.get('location_id')
-        department = self.kwargs.get('department_id')
-        category = self.kwargs.get('category_id')
-        subcategory = self.kwargs.get('subcategory_id')
-
-        if subcategory:
-            queryset = SubCategory.objects.filter(id=subcategory, category_id=category,
-                                                  category_id__department_id=department,
-                                                  category_id__department_id__location_id=location)
-        elif all([location, department, category]):
-            queryset = SubCategory.objects.filter(category_id=category, category_id__department_id=department,
-                                                  category_id__department_id__location_id=location)
-        elif all([location, department]):
-            queryset = Category.objects.filter(department_id=department, department_id__location_id=location)
-        elif location:
-            queryset = Department.objects.filter(location_id=location)
-        else:
-            queryset = Location.objects.all()
-        return queryset
+        Returns the rows based on the id's provided in the url, an empty list when they do not form a path.
+        """
+        ids = [self.kwargs.get(key) for key in ('location_id', 'department_id', 'category_id', 'subcategory_id')]
+        ids = tuple(pk for pk in ids if pk)
+        hierarchy = get_hierarchy()
+        if not ids:
+            return LocationSerializer(Location.objects.all(), many=True).data
+
+        level = LEVELS[len(ids) - 1]
+        if hierarchy.path(level, ids[-1]) != ids:
+            return []
+        if level == 'subcategory':
+            return [self.represent(level, hierarchy.get(level, ids[-1]), hierarchy)]
+        child_level = LEVELS[len(ids)]
+        return [self.represent(child_level, node, hierarchy) for node in hierarchy.children(level, ids[-1])]
 
     def get(self, request, *args, **kwargs):
         """
         Handles GET request and returns serialized data.
         """
-        queryset = self.get_queryset()
-        serializer_class = self.get_serializer_class()
-        serializer = serializer_class(queryset, many=True)
-        return Response(serializer.data, status=status.HTTP_200_OK)
+        return self.list_response(request, self.get_rows())
 
 
-class DepartmentDetailsAPIView(APIView):
+class DepartmentDetailsAPIView(KeysetListMixin, APIView):
     """
     Endpoint for managing department details.
     POST request: /departments/
@@ -114,9 +193,8 @@ class DepartmentDetailsAPIView(APIView):
             serializer = DepartmentSerializer(department)
             return Response(serializer.data)
         else:
-            departments = Department.objects.all()
-            serializer = DepartmentSerializer(departments, many=True)
-            return Response(serializer.data)
+            return self.list_response(request, department_values.queryset(Department.objects.all()),
+                                      serialize=department_values.serialize)
 
     def put(self, request, pk):
         """
@@ -134,11 +212,11 @@ class DepartmentDetailsAPIView(APIView):
         Handles a DELETE request to delete a department.
         """
         department = self.get_object(pk)
-        department.delete()
+        delete_node(department)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class CategoryViewSet(viewsets.ModelViewSet):
+class CategoryViewSet(KeysetListMixin, viewsets.ModelViewSet):
     """
     API endpoint for Category model
     Endpoints:
@@ -148,6 +226,13 @@ class CategoryViewSet(viewsets.ModelViewSet):
     queryset = Category.objects.all()
     serializer_class = CategorySerializer
 
+    def list(self, request, *args, **kwargs):
+        """
+        Returns a page of categories, or streams all of them as NDJSON
+        """
+        return self.list_response(request, category_values.queryset(self.get_queryset()),
+                                  serialize=category_values.serialize)
+
     def create(self, request, *args, **kwargs):
         """
         Creates a new category instance
@@ -187,11 +272,11 @@ class CategoryViewSet(viewsets.ModelViewSet):
         Deletes a category instance
         """
         obj = self.get_object()
-        obj.delete()
+        delete_node(obj)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
-class SubCategoryView(APIView):
+class SubCategoryView(KeysetListMixin, APIView):
     """
     API endpoint for SubCategory management.
     """
@@ -207,9 +292,8 @@ class SubCategoryView(APIView):
             serializer = SubCategorySerializer(subcategory)
             return Response(serializer.data)
         else:
-            subcategory = SubCategory.objects.all()
-            serializer = SubCategorySerializer(subcategory, many=True)
-            return Response(serializer.data)
+            return self.list_response(request, subcategory_values.queryset(SubCategory.objects.all()),
+                                      serialize=subcategory_values.serialize)
 
     def post(self, request):
         """
@@ -237,27 +321,315 @@ class SubCategoryView(APIView):
         Delete a SubCategory instance.
         """
         subcategory = self.get_object(pk)
-        subcategory.delete()
+        delete_node(subcategory)
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+class BulkView(APIView):
+    """
+    Bulk endpoint of one model, the body is a JSON array or NDJSON (application/x-ndjson).
+    POST request: creates the objects of the body
+    PUT/PATCH request: updates the objects of the body, matched on their id
+    DELETE request: deletes the objects whose ids are given in the body
+    The response lists the status of every item in the order of the body, with 207 when some failed.
+    Related objects are checked with one query per relation and the writes run in one transaction.
+    """
+    serializer_class = None
+
+    def get_items(self, request):
+        if not isinstance(request.data, list):
+            raise ParseError('Expected a JSON array or NDJSON body.')
+        return request.data
+
+    def respond(self, results, success, response_status=None):
+        if all(result['status'] == success for result in results):
+            return Response(results, status=response_status or success)
+        return Response(results, status=status.HTTP_207_MULTI_STATUS)
+
+    def write(self, serializer, success):
+        serializer.is_valid()
+        if not isinstance(serializer.validated_data, list):
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            serializer.save()
+        except IntegrityError as exc:
+            return Response({'detail': str(exc)}, status=status.HTTP_409_CONFLICT)
+        except DatabaseError as exc:
+            # Like ids of created objects that could not be read back, see fill_pks. The writes were rolled back.
+            return Response({'detail': str(exc)}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        return self.respond(serializer.results, success)
+
+    def post(self, request):
+        """
+        Creates the objects of the body.
+        """
+        serializer = BulkListSerializer(child=self.serializer_class(), data=self.get_items(request))
+        return self.write(serializer, status.HTTP_201_CREATED)
+
+    def put(self, request, partial=False):
+        """
+        Updates the objects of the body, every item carries the id of its object.
+        """
+        items = self.get_items(request)
+        model = self.serializer_class.Meta.model
+        pk_name = model._meta.pk.name
+        ids = {item.get('id', item.get(pk_name)) for item in items if isinstance(item, dict)}
+        instances = model.objects.in_bulk([pk for pk in ids if isinstance(pk, int)])
+        serializer = BulkListSerializer(child=self.serializer_class(partial=partial), instance=instances,
+                                        data=items, partial=partial)
+        return self.write(serializer, status.HTTP_200_OK)
+
+    def patch(self, request):
+        """
+        Partially updates the objects of the body.
+        """
+        return self.put(request, partial=True)
+
+    def delete(self, request):
+        """
+        Deletes the objects whose ids are given in the body, as a list of ids or of objects with an id.
+        """
+        model = self.serializer_class.Meta.model
+        pk_name = model._meta.pk.name
+        ids = [item.get('id', item.get(pk_name)) if isinstance(item, dict) else item
+               for item in self.get_items(request)]
+        pks = [pk for pk in ids if isinstance(pk, int)]
+        with transaction.atomic():
+            # QuerySet.delete would send post_delete for every row, the changes are propagated once instead.
+            deleted = delete_skus(pks) if model is SKUDataMapping else delete_nodes(model, pks)
+        existing = {obj.pk for obj in deleted}
+        results = [{'status': status.HTTP_204_NO_CONTENT, 'id': pk} if pk in existing else
+                   {'status': status.HTTP_404_NOT_FOUND, 'id': pk, 'errors': {'detail': 'Not found.'}}
+                   for pk in ids]
+        return self.respond(results, status.HTTP_204_NO_CONTENT, status.HTTP_200_OK)
+
+
+class QueuedSKUView(BulkView):
+    """
+    Write-behind endpoint of the SKUs, enabled by SKU_WRITE_BEHIND_DIR, the body is a JSON array or NDJSON.
+    POST request: creates or updates the SKUs of the body, every item giving its sku
+    The items are validated like the bulk ones, the valid ones are acknowledged with 202 once appended to
+    the journal of the process and written to the database in batches shortly after.
+    """
+    serializer_class = SKUDataMappingSerializer
+    http_method_names = ['post', 'options']
+
+    def post(self, request):
+        """
+        Queues the SKUs of the body.
+        """
+        write_queue = get_write_queue()
+        if write_queue is None:
+            return Response({'detail': 'The write-behind queue is disabled, set SKU_WRITE_BEHIND_DIR.'},
+                            status=status.HTTP_501_NOT_IMPLEMENTED)
+        serializer = BulkListSerializer(child=self.serializer_class(), data=self.get_items(request))
+        serializer.is_valid()
+        if not isinstance(serializer.validated_data, list):
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        validated = iter(serializer.validated_data)
+        records = []
+        results = []
+        for result in serializer.results:
+            attrs = next(validated) if result is None else None
+            if attrs is None:
+                results.append(result)
+            elif attrs.get('sku') is None:
+                # Queued writes are replayed after a crash, only upserts by sku can be replayed safely.
+                results.append({'status': status.HTTP_400_BAD_REQUEST, 'errors': {'sku': ['This field is required.']}})
+            else:
+                records.append(to_record(attrs))
+                results.append({'status': status.HTTP_202_ACCEPTED, 'id': attrs['sku']})
+        write_queue.put(records)
+        return self.respond(results, status.HTTP_202_ACCEPTED)
+
+
 @api_view(['GET'])
 def get_skus_by_meta_data(request):
     """
     Retrieve a list of SKUs based on the provided meta data.
-    The meta data includes location, department, category, and subcategory.
+    The meta data includes location, department, category, and subcategory, any subset of them can be given.
+    The SKUs are read with the names of their hierarchy from the denormalized sku_search table, without joins,
+    and returned ordered by sku, one page at a time.
     parameters:
           location(string): The location of the SKU.
           department(string): The department of the SKU.
           category(string): The category of the SKU.
           subcategory(string): The subcategory of the SKU.
+          after(int): Only return SKUs with a greater sku, used to fetch the next page.
+          limit(int): Page size, the url of the next page is returned in the Link header.
+          format(string): ndjson streams all matching SKUs instead of one page.
     """
-    location = request.query_params.get('location')
-    department = request.query_params.get('department')
-    category = request.query_params.get('category')
-    subcategory = request.query_params.get('subcategory')
-    skus = SKUDataMapping.objects.filter(
-        location__name=location, department__name=department, category__name=category, subcategory__name=subcategory
+    return list_response(request, skus_by_meta_data(request.query_params))
+
+
+def skus_by_meta_data(params):
+    """
+    Returns the sku_search rows matching the location, department, category and subcategory names of the
+    params as [sku, location, department, category, subcategory] values_list rows. With SKU_COLUMN_INDEX
+    they are matched by the column index of the process instead, the same rows without a query, once it is built.
+    """
+    if index_enabled():
+        rows = indexed_skus(params)
+        if rows is not None:
+            return rows
+    return search_by_names(params).values_list(
+        'sku', 'location_name', 'department_name', 'category_name', 'subcategory_name'
     )
-    data = [[sk.sku, sk.location.name, sk.department.name, sk.category.name, sk.subcategory.name] for sk in skus]
-    return Response(data)
+
+
+@require_GET
+def export_skus(request):
+    """
+    Downloads the SKUs as a file in the sku_data.txt layout of loadskudata, streamed as it is read.
+    A plain Django view, DRF would take `format` for the name of one of its renderers.
+    parameters:
+          format(string): csv (default), ndjson or parquet. loadskudata reads the csv and parquet files.
+          location(string), department(string), category(string), subcategory(string): Only export the
+                SKUs below the nodes with these names, as in get_skus_by_meta_data.
+    """
+    format = request.GET.get('format', 'csv')
+    if format not in EXPORT_FORMATS:
+        return HttpResponse(dumps({'detail': 'format must be one of {}.'.format(', '.join(EXPORT_FORMATS))}),
+                            status=HTTP_400_BAD_REQUEST, content_type='application/json')
+    try:
+        content = export_catalog(format, catalog_queryset(request.GET))
+    except ImportError as ex:
+        return HttpResponse(dumps({'detail': str(ex)}), status=status.HTTP_501_NOT_IMPLEMENTED,
+                            content_type='application/json')
+    content_type, extension = EXPORT_FORMATS[format]
+    response = StreamingHttpResponse(content, content_type=content_type)
+    response['Content-Disposition'] = 'attachment; filename="sku_data{}"'.format(extension)
+    return response
+
+
+@api_view(['GET'])
+def count_skus_by_meta_data(request):
+    """
+    Number of SKUs of every node of a hierarchy level, summed with one GROUP BY over the path counters,
+    so the cost depends on the number of nodes and not of SKUs.
+    parameters:
+          level(string): location, department, category or subcategory, location by default.
+          location(string), department(string), category(string), subcategory(string): Only count the
+                SKUs below the nodes with these names, as in get_skus_by_meta_data.
+    """
+    params = request.query_params
+    level = params.get('level', 'location')
+    if level not in LEVELS:
+        raise ParseError('level must be one of {}.'.format(', '.join(LEVELS)))
+    hierarchy = get_hierarchy()
+    filters = {}
+    for param, field in zip(LEVELS, PATH_FIELDS):
+        value = params.get(param)
+        if value is not None:
+            filters['{}__in'.format(field)] = hierarchy.ids(param, value)
+
+    depth = LEVELS.index(level) + 1
+    rows = []
+    for row in rollup(level, filters):
+        item = {}
+        for param, field in zip(LEVELS[:depth], PATH_FIELDS):
+            item[field] = row[field]
+            item[param] = hierarchy.name(param, row[field])
+        item['skus'] = row['skus']
+        rows.append(item)
+    return Response(rows)
+
+
+def parse_tree_depth(params):
+    """
+    Returns the optional `depth` parameter of the tree endpoints, None for the whole subtree.
+    """
+    if 'depth' not in params:
+        return None
+    return parse_depth(params, len(LEVELS) - 1)
+
+
+@api_view(['GET'])
+def hierarchy_tree(request, level=None, pk=None):
+    """
+    The whole hierarchy, or the subtree of one node, nested as {id, level, name, children}. A subtree
+    is read with one range query over the closure table.
+    parameters:
+          depth(int): Number of levels returned below the locations or the node, all of them by default.
+    """
+    depth = parse_tree_depth(request.query_params)
+    if level is None:
+        return Response(whole_tree(depth))
+    if level not in LEVELS:
+        raise NotFound()
+    node = subtree(level, pk, depth)
+    if node is None:
+        raise NotFound()
+    return Response(node)
+
+
+@api_view(['GET'])
+def hierarchy_ancestors(request, level, pk):
+    """
+    The path from the location down to the node as a list of {id, level, name}, read with one query.
+    """
+    path = ancestors(level, pk) if level in LEVELS else []
+    if not path:
+        raise NotFound()
+    return Response(path)
+
+
+def parse_limit(params, default, maximum):
+    try:
+        limit = int(params.get('limit', default))
+    except ValueError:
+        limit = 0
+    if not 1 <= limit <= maximum:
+        raise ParseError('limit must be between 1 and {}.'.format(maximum))
+    return limit
+
+
+def index_building():
+    """
+    Answers a search arriving while the search index of the process is first built.
+    """
+    return Response({'detail': 'The search index is being built, retry shortly.'},
+                    status=status.HTTP_503_SERVICE_UNAVAILABLE, headers={'Retry-After': '1'})
+
+
+@api_view(['GET'])
+def search_skus(request):
+    """
+    Full text search over the SKU descriptions and hierarchy names, served by the in-process inverted index.
+    Every word of the query has to start a word of the SKU, so partial input matches as it is typed.
+    SKUs are ranked by how often the matched words occur in them, then by sku.
+    parameters:
+          q(string): The words to search for.
+          limit(int): Maximum number of SKUs returned, 20 by default and at most 1000.
+    """
+    limit = parse_limit(request.query_params, 20, 1000)
+    index = get_search_index()
+    if index is None:
+        return index_building()
+    hits = index.search(request.query_params.get('q', ''), limit)
+    rows = SKUSearch.objects.in_bulk([sku for sku, _ in hits])
+    return Response([
+        {'sku': sku, 'description': rows[sku].description, 'location': rows[sku].location_name,
+         'department': rows[sku].department_name, 'category': rows[sku].category_name,
+         'subcategory': rows[sku].subcategory_name, 'score': score}
+        for sku, score in hits if sku in rows
+    ])
+
+
+@api_view(['GET'])
+def suggest_search_terms(request):
+    """
+    Typeahead completions of the last word of the query, the indexed words it starts, most frequent first.
+    parameters:
+          q(string): The text typed so far.
+          limit(int): Maximum number of words returned, 10 by default and at most 100.
+    """
+    limit = parse_limit(request.query_params, 10, 100)
+    words = request.query_params.get('q', '').split()
+    if not words:
+        return Response([])
+    index = get_search_index()
+    if index is None:
+        return index_building()
+    return Response([{'term': term, 'skus': count} for term, count in index.suggest(words[-1], limit)])
@@ -0,0 +1,386 @@
+"""
+Write-behind queue of SKU writes. The SKUs posted to it are acknowledged once appended to a journal file and
+synced to disk, a background thread then writes them to SKUDataMapping in batches of up to
+SKU_WRITE_BEHIND_BATCH_SIZE SKUs, or whatever arrived within SKU_WRITE_BEHIND_WINDOW seconds, with one
+bulk_create and one bulk_update per batch. The writes cost a batch transaction instead of one each.
+Every process appends to its own journal in SKU_WRITE_BEHIND_DIR and records how far it was written to the
+database. Journals left behind by a crashed process are replayed in the background by the next server started
+with SKU_WRITE_BEHIND_DIR set, or by replayjournals. Every record carries its sku and is written as an upsert,
+so replaying one again is harmless.
+"""
+import atexit
+import glob
+import json
+import logging
+import os
+import queue
+import threading
+import time
+
+from django.conf import settings
+from django.db import DatabaseError, InterfaceError, OperationalError, close_old_connections, connection, transaction
+
+from .models import SKUDataMapping
+from .renderers import dumps
+from .signals import skus_changed
+
+try:
+    import fcntl
+except ImportError:  # without file locks the journals of crashed processes are only replayed by replayjournals
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# Fields of the journal records, the sku first.
+RECORD_FIELDS = ('sku', 'description', 'location_id', 'department_id', 'category_id', 'subcategory_id')
+
+# A journal whose records were all written to the database is emptied once it is larger than this.
+MAX_JOURNAL_BYTES = 64 * 2 ** 20
+
+# Seconds waited before a batch is written again when the database failed, doubled after every failure up to
+# MAX_RETRY_DELAY.
+RETRY_DELAY = 1
+MAX_RETRY_DELAY = 60
+
+# Attempts at writing a batch of a replayed journal, the journal is left for the next replay once they all failed.
+REPLAY_ATTEMPTS = 5
+
+# Errors of an unavailable database, lost connection, deadlock or lock timeout, after which a batch is written
+# again. Any other database error comes from the records and would fail again.
+RETRIED_ERRORS = (OperationalError, InterfaceError)
+
+
+def to_record(attrs):
+    """
+    Returns the journal record of SKUDataMappingSerializer validated data.
+    """
+    return {name: attrs[name[:-3]].pk if name.endswith('_id') else attrs[name] for name in RECORD_FIELDS}
+
+
+def write_skus(records, batch_size=1000):
+    """
+    Creates or updates the SKUs of journal records in one transaction, the last record of a SKU wins and SKUs
+    already as recorded are skipped. Returns the numbers of SKUs created and updated.
+    """
+    records = {record['sku']: record for record in records}
+    fields = RECORD_FIELDS[1:]
+    with transaction.atomic():
+        existing = SKUDataMapping.objects.in_bulk(list(records))
+        old, created, updated = [], [], []
+        for sku, record in records.items():
+            obj = existing.get(sku)
+            if obj is None:
+                created.append(SKUDataMapping(**record))
+            elif any(getattr(obj, name) != record[name] for name in fields):
+                old.append(SKUDataMapping(**{name: getattr(obj, name) for name in RECORD_FIELDS}))
+                for name in fields:
+                    setattr(obj, name, record[name])
+                updated.append(obj)
+        SKUDataMapping.objects.bulk_create(created, batch_size=batch_size)
+        SKUDataMapping.objects.bulk_update(updated, fields, batch_size=batch_size)
+        # bulk_create and bulk_update send no signals.
+        if created or updated:
+            skus_changed(old + created + updated)
+    return len(created), len(updated)
+
+
+def lock(file):
+    """
+    Takes the lock of an open journal without waiting, returns False when another process holds it.
+    """
+    if fcntl is None:
+        return True
+    try:
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except OSError:
+        return False
+    return True
+
+
+class Journal:
+    """
+    Journal of one process: NDJSON records appended to a file, and the offset up to which they were written
+    to the database in `<file>.applied`. The file is locked while the process lives.
+    Appends are synced with group commit: while a sync runs, the appends arriving wait for the next one,
+    which covers all of them.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = open(path, 'ab')
+        if not lock(self.file):
+            self.file.close()
+            raise OSError('{} is used by another process.'.format(path))
+        self.written = self.file.tell()
+        self.synced = self.written
+        self.sync_lock = threading.Lock()
+
+    def append(self, records):
+        """
+        Appends the records and returns the offset after them, the caller holds the lock of the queue.
+        """
+        self.file.write(b''.join(dumps(record) + b'\n' for record in records))
+        self.file.flush()
+        self.written = self.file.tell()
+        return self.written
+
+    def sync(self, offset):
+        """
+        Returns once the journal is on disk up to offset.
+        """
+        with self.sync_lock:
+            if self.synced >= offset:
+                return
+            written = self.written
+            os.fsync(self.file.fileno())
+            self.synced = written
+
+    def applied(self, offset):
+        write_checkpoint(self.path, offset)
+
+    def truncate(self):
+        """
+        Empties the journal, the caller holds the lock of the queue and all its records are written.
+        """
+        with self.sync_lock:
+            self.file.truncate(0)
+            self.file.seek(0)
+            self.written = self.synced = 0
+            write_checkpoint(self.path, 0)
+
+
+def checkpoint_path(path):
+    return path + '.applied'
+
+
+def write_checkpoint(path, offset):
+    # Losing the checkpoint only replays records already written, which is harmless.
+    temporary = checkpoint_path(path) + '.tmp'
+    with open(temporary, 'w') as output:
+        output.write(str(offset))
+    os.replace(temporary, checkpoint_path(path))
+
+
+def read_checkpoint(path):
+    try:
+        with open(checkpoint_path(path)) as source:
+            return int(source.read() or 0)
+    except (OSError, ValueError):
+        return 0
+
+
+def read_records(path, offset=0):
+    """
+    Yields the records of a journal after offset. A last line without its newline was cut by a crash
+    before it was acknowledged, it is skipped.
+    """
+    with open(path, 'rb') as source:
+        if offset > os.fstat(source.fileno()).st_size:
+            # The journal was emptied before its checkpoint was reset.
+            offset = 0
+        source.seek(offset)
+        for line in source:
+            if not line.endswith(b'\n'):
+                return
+            yield json.loads(line)
+
+
+def replay_journal(path, batch_size=1000, attempts=REPLAY_ATTEMPTS):
+    """
+    Writes the records of the journal of a stopped process past its checkpoint, then deletes the journal.
+    Returns the number of records written, None when the journal is in use or was already replayed.
+    Raises the database error of a batch that failed attempts times, the journal is kept.
+    """
+    try:
+        journal = open(path, 'rb')
+    except FileNotFoundError:
+        return None
+    with journal:
+        if not lock(journal):
+            return None
+        try:
+            if os.stat(path).st_ino != os.fstat(journal.fileno()).st_ino:
+                return None
+        except FileNotFoundError:
+            # Replayed by another process while the lock was taken.
+            return None
+        replayed = 0
+        batch = []
+        for record in read_records(path, read_checkpoint(path)):
+            batch.append(record)
+            if len(batch) == batch_size:
+                write_batch(batch, attempts)
+                replayed += len(batch)
+                batch = []
+        if batch:
+            write_batch(batch, attempts)
+            replayed += len(batch)
+        os.remove(path)
+        if os.path.exists(checkpoint_path(path)):
+            os.remove(checkpoint_path(path))
+    return replayed
+
+
+def replay_journals(directory, batch_size=1000, attempts=REPLAY_ATTEMPTS):
+    """
+    Replays the journals of the stopped processes in directory, returns the number of records written.
+    """
+    replayed = 0
+    for path in sorted(glob.glob(os.path.join(directory, 'journal-*.ndjson'))):
+        count = replay_journal(path, batch_size, attempts)
+        if count is not None:
+            logger.info('Replayed %d SKU writes from %s', count, path)
+            replayed += count
+    return replayed
+
+
+def write_batch(records, attempts=None):
+    """
+    Writes the records, retrying while the database is unavailable, waiting longer after every failure. After
+    attempts failures the error is raised, by default the records are retried until written. Records the
+    database refuses, like a SKU whose subcategory was deleted since it was queued or a description too long for
+    its column, are logged and skipped.
+    """
+    delay = RETRY_DELAY
+    failures = 0
+    while True:
+        close_old_connections()
+        try:
+            try:
+                write_skus(records)
+            except RETRIED_ERRORS:
+                raise
+            except DatabaseError:
+                for record in records:
+                    try:
+                        write_skus([record])
+                    except RETRIED_ERRORS:
+                        raise
+                    except DatabaseError as ex:
+                        logger.error('Skipped queued SKU write %s: %s', record, ex)
+            return
+        except RETRIED_ERRORS:
+            failures += 1
+            if attempts is not None and failures >= attempts:
+                raise
+            logger.exception('Writing %d queued SKUs failed, retrying in %d seconds', len(records), delay)
+            time.sleep(delay)
+            delay = min(delay * 2, MAX_RETRY_DELAY)
+
+
+def start_replay():
+    """
+    Replays the journals of the stopped processes in a background thread when SKU_WRITE_BEHIND_DIR is set,
+    so their SKUs are written as the server starts and not on its first queued write. Called by
+    server.start_server, management commands do not replay. Returns the thread, whose replayed attribute is the
+    number of records written, or None.
+    """
+    global _replay
+    directory = getattr(settings, 'SKU_WRITE_BEHIND_DIR', None)
+    if not directory or fcntl is None or not glob.glob(os.path.join(directory, 'journal-*.ndjson')):
+        return None
+
+    def run():
+        try:
+            thread.replayed = replay_journals(directory, getattr(settings, 'SKU_WRITE_BEHIND_BATCH_SIZE', 1000))
+        except Exception:
+            logger.exception('Replaying the journals in %s failed, run replayjournals', directory)
+        finally:
+            # The thread has its own connection.
+            connection.close()
+
+    thread = _replay = threading.Thread(target=run, name='sku-journal-replay', daemon=True)
+    thread.replayed = 0
+    thread.start()
+    return thread
+
+
+class WriteBehindQueue:
+    """
+    The queue of this process: its journal and the thread writing the appended records to the database.
+    """
+
+    def __init__(self, directory, batch_size=1000, window=0.2):
+        os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.batch_size = batch_size
+        self.window = window
+        # Process ids are reused, a journal left behind by an earlier process must not be taken over.
+        self.journal = Journal(os.path.join(directory, 'journal-{}-{}.ndjson'.format(os.getpid(), time.time_ns())))
+        self.pending = queue.Queue()
+        self.lock = threading.Lock()
+        # Number of puts queued and written to the database, waited on by wait.
+        self.queued = 0
+        self.written = 0
+        self.done = threading.Condition()
+        self.thread = threading.Thread(target=self.run, name='sku-write-behind', daemon=True)
+        self.thread.start()
+        atexit.register(self.wait, 10)
+
+    def put(self, records):
+        """
+        Appends the records to the journal and returns once it is synced to disk, they are written
+        to the database later.
+        """
+        if not records:
+            return
+        with self.lock:
+            # Records are queued in journal order, a batch written up to an offset covers all before it.
+            offset = self.journal.append(records)
+            self.queued += 1
+            self.pending.put((records, offset, self.queued))
+        self.journal.sync(offset)
+
+    def wait(self, timeout=None):
+        """
+        Returns True once the records put so far are written to the database, False on timeout.
+        """
+        queued = self.queued
+        with self.done:
+            return self.done.wait_for(lambda: self.written >= queued, timeout)
+
+    def run(self):
+        if fcntl is not None:
+            try:
+                replay_journals(self.directory, self.batch_size)
+            except RETRIED_ERRORS:
+                logger.exception('Replaying the journals in %s failed, run replayjournals', self.directory)
+        while True:
+            records, offset, number = self.pending.get()
+            batch = list(records)
+            deadline = time.monotonic() + self.window
+            while len(batch) < self.batch_size:
+                try:
+                    records, offset, number = self.pending.get(timeout=max(deadline - time.monotonic(), 0))
+                except queue.Empty:
+                    break
+                batch.extend(records)
+            write_batch(batch)
+            self.journal.applied(offset)
+            with self.lock:
+                if offset == self.journal.written and offset > MAX_JOURNAL_BYTES:
+                    self.journal.truncate()
+            with self.done:
+                self.written = number
+                self.done.notify_all()
+
+
+_replay = None
+_queue = None
+_queue_lock = threading.Lock()
+
+
+def get_write_queue():
+    """
+    Returns the write-behind queue of this process, started on first use, or None when SKU_WRITE_BEHIND_DIR
+    is not set.
+    """
+    global _queue
+    directory = getattr(settings, 'SKU_WRITE_BEHIND_DIR', None)
+    if not directory:
+        return None
+    with _queue_lock:
+        if _queue is None:
+            _queue = WriteBehindQueue(directory, getattr(settings, 'SKU_WRITE_BEHIND_BATCH_SIZE', 1000),
+                                      getattr(settings, 'SKU_WRITE_BEHIND_WINDOW', 0.2))
+        return _queue